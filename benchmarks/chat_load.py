@@ -0,0 +1,59 @@
+import argparse
+import asyncio
+import time
+from benchmarks import fakes
+
+# teste de carga do /chat contra substitutos locais do azure: mede a vazão (req/s)
+# para vários níveis de sessões concorrentes. com o caminho assíncrono a vazão deve
+# crescer com a concorrência, já que nenhuma chamada bloqueia o event loop
+#
+# uso: python -m benchmarks.chat_load --latency 0.05 --requests 200
+
+
+async def run_level(main, concurrency: int, total: int) -> dict:
+    semaphore = asyncio.Semaphore(concurrency)
+
+    async def one(i: int):
+        async with semaphore:
+            # cada requisição usa a própria sessão; o cache de respostas fica desligado
+            # para medir o caminho completo (busca + modelo)
+            await main.chat(main.Question(
+                question=f"Domanda {i % 10}?", session_id=f"s-{concurrency}-{i}", use_cache=False
+            ))
+
+    started = time.perf_counter()
+    await asyncio.gather(*(one(i) for i in range(total)))
+    elapsed = time.perf_counter() - started
+    return {"concurrency": concurrency, "requests": total, "seconds": elapsed, "rps": total / elapsed}
+
+
+async def run(levels: list, total: int, latency: float):
+    fakes.install_env()
+    import main
+    from src import clients
+
+    clients.override("openai_async", fakes.FakeAsyncOpenAI(latency=latency))
+    clients.override("search_async", fakes.FakeAsyncSearchClient(latency=latency))
+    clients.override("blob_async", fakes.FakeAsyncBlobServiceClient(latency=latency))
+
+    # aquece caches (encoder do tiktoken, embeddings das perguntas) antes de medir
+    await run_level(main, 1, 10)
+
+    print(f"{'concorrenza':>12} {'richieste':>10} {'secondi':>8} {'req/s':>8}")
+    for level in levels:
+        result = await run_level(main, level, total)
+        print(f"{result['concurrency']:>12} {result['requests']:>10} {result['seconds']:>8.2f} {result['rps']:>8.1f}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Test di carico del /chat con servizi locali")
+    parser.add_argument("--levels", default="1,2,4,8,16,32")
+    parser.add_argument("--requests", type=int, default=128)
+    parser.add_argument("--latency", type=float, default=0.05, help="latenza simulata di ogni servizio (s)")
+    args = parser.parse_args()
+    levels = [int(level) for level in args.levels.split(",")]
+    asyncio.run(run(levels, args.requests, args.latency))
+
+
+if __name__ == "__main__":
+    main()
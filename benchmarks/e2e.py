@@ -0,0 +1,182 @@
+import argparse
+import asyncio
+import glob
+import json
+import os
+import subprocess
+import time
+from datetime import datetime
+import numpy as np
+from benchmarks import fakes
+from benchmarks.memory import peak_rss_mib
+
+# benchmark de ponta a ponta sem credenciais: os pdfs de data/ passam pelo código real de
+# ingestão (download, smart_doc, chunks, legendas, embeddings, envio) e depois o /chat real
+# responde perguntas sobre eles, com openai, search, blob e document intelligence trocados
+# pelos substitutos em memória de benchmarks/fakes.py. mede a vazão e o tempo por etapa da
+# ingestão, a latência p50/p95/p99 do /chat por concorrência e o pico de memória, e grava
+# tudo num json para comparar uma execução com outra (--compare)
+#
+# uso: python -m benchmarks.e2e --latency 0.02 --levels 1,8,32 --compare .cache/benchmarks/e2e-anterior.json
+
+RESULTS_DIR = ".cache/benchmarks"
+
+
+# registra os substitutos no lugar dos clientes reais; devolve o container dos pdfs
+def install_fakes(latency: float, latency_per_page: float):
+    from src import clients
+    index = fakes.FakeSearchIndex()
+    container = fakes.FakeContainerClient(latency=latency)
+    clients.override("openai", fakes.FakeOpenAI(latency=latency))
+    clients.override("openai_async", fakes.FakeAsyncOpenAI(latency=latency))
+    clients.override("vision", fakes.FakeOpenAI(latency=latency, answer="Grafico di prova con assi e legenda."))
+    clients.override("search", fakes.FakeSearchClient(index, latency=latency))
+    clients.override("search_async", fakes.FakeAsyncSearchClient(latency=latency, index=index))
+    clients.override("blob_async", fakes.FakeAsyncBlobServiceClient(latency=latency))
+    clients.override("blob_container", container)
+    clients.override("document_intelligence", fakes.FakeDocumentIntelligenceClient(latency_per_page=latency_per_page))
+    return container, index
+
+
+# ingestão em massa do container falso, como o "worker.py bulk" faz com o container real
+def run_ingestion(concurrency: int) -> dict:
+    from src import bulk_ingest
+    summary = bulk_ingest.run_bulk(bulk_ingest.iter_container_sources(), concurrency)
+    return {k: v for k, v in summary.items() if k != "failures"}
+
+
+# perguntas tiradas do próprio texto indexado, para a busca textual ter o que encontrar
+def sample_questions(index, count: int = 10) -> list:
+    texts = sorted(doc["content"] for doc in index.documents.values())
+    step = max(1, len(texts) // count)
+    return [" ".join(text.split()[:8]) + "?" for text in texts[::step][:count]] or ["Di cosa parla il documento?"]
+
+
+async def run_chat_level(main, questions: list, concurrency: int, total: int) -> dict:
+    semaphore = asyncio.Semaphore(concurrency)
+    latencies = []
+
+    async def one(i: int):
+        async with semaphore:
+            started = time.perf_counter()
+            # sessão nova por requisição e sem cache de respostas: mede o caminho completo
+            await main.chat(main.Question(
+                question=questions[i % len(questions)], session_id=f"e2e-{concurrency}-{i}", use_cache=False
+            ))
+            latencies.append(time.perf_counter() - started)
+
+    started = time.perf_counter()
+    await asyncio.gather(*(one(i) for i in range(total)))
+    elapsed = time.perf_counter() - started
+    p50, p95, p99 = np.percentile(latencies, [50, 95, 99]) * 1000
+    return {"concurrency": concurrency, "requests": total, "seconds": elapsed, "rps": total / elapsed,
+            "p50_ms": p50, "p95_ms": p95, "p99_ms": p99}
+
+
+async def run_chat(main, questions: list, levels: list, total: int) -> list:
+    # aquece caches (encoder do tiktoken, embeddings das perguntas) antes de medir
+    await run_chat_level(main, questions, 1, len(questions))
+    return [await run_chat_level(main, questions, level, total) for level in levels]
+
+
+def git_commit():
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True).stdout.strip()
+    except OSError:
+        return None
+
+
+# métricas numéricas de um resultado, com nomes planos ("chat.c8.p95_ms")
+def flatten(results: dict) -> dict:
+    metrics = {}
+    for key in ("pages_per_second", "chunks_per_second", "seconds"):
+        metrics[f"ingestion.{key}"] = results["ingestion"][key]
+    for stage, seconds in results["ingestion"]["stages"].items():
+        metrics[f"ingestion.stage.{stage}"] = seconds
+    metrics["ingestion.reingest_seconds"] = results["ingestion"]["reingest_seconds"]
+    for level in results["chat"]:
+        for key in ("rps", "p50_ms", "p95_ms", "p99_ms"):
+            metrics[f"chat.c{level['concurrency']}.{key}"] = level[key]
+    for key, value in results["memory"].items():
+        metrics[f"memory.{key}"] = value
+    return metrics
+
+
+def compare(previous_path: str, results: dict):
+    with open(previous_path) as f:
+        previous = flatten(json.load(f))
+    current = flatten(results)
+    print(f"\n{'metrica':<34} {'prima':>10} {'adesso':>10} {'diff':>8}")
+    for name, value in current.items():
+        old = previous.get(name)
+        if old is None:
+            continue
+        change = f"{(value - old) / old * 100:+.1f}%" if old else "-"
+        print(f"{name:<34} {old:>10.2f} {value:>10.2f} {change:>8}")
+
+
+def run(args):
+    fakes.install_env()
+    os.environ.setdefault("SMART_DOC_DI_MODE", "selective")
+    import main
+    container, index = install_fakes(args.latency, args.latency_per_page)
+
+    paths = sorted(glob.glob(args.pattern))
+    for path in paths:
+        with open(path, "rb") as f:
+            container.get_blob_client(os.path.basename(path)).upload_blob(f.read(), overwrite=True)
+
+    ingestion = run_ingestion(args.ingest_concurrency)
+    memory = {"after_ingestion_mib": peak_rss_mib()}
+    # segunda passada: nada mudou, tudo deve ser pulado pelo manifesto
+    started = time.perf_counter()
+    run_ingestion(args.ingest_concurrency)
+    ingestion["reingest_seconds"] = time.perf_counter() - started
+
+    questions = sample_questions(index)
+    levels = [int(level) for level in args.levels.split(",")]
+    chat = asyncio.run(run_chat(main, questions, levels, args.requests))
+    memory["after_chat_mib"] = peak_rss_mib()
+
+    print(f"\n{'concorrenza':>12} {'richieste':>10} {'req/s':>8} {'p50 ms':>8} {'p95 ms':>8} {'p99 ms':>8}")
+    for r in chat:
+        print(f"{r['concurrency']:>12} {r['requests']:>10} {r['rps']:>8.1f} "
+              f"{r['p50_ms']:>8.1f} {r['p95_ms']:>8.1f} {r['p99_ms']:>8.1f}")
+    print(f"Picco di memoria: {memory['after_ingestion_mib']:.0f} MiB dopo l'ingestione, "
+          f"{memory['after_chat_mib']:.0f} MiB dopo il /chat.")
+
+    results = {
+        "timestamp": datetime.now().isoformat(timespec="seconds"),
+        "commit": git_commit(),
+        "config": {
+            "latency": args.latency, "latency_per_page": args.latency_per_page, "pdfs": len(paths),
+            "ingest_concurrency": args.ingest_concurrency, "levels": levels, "requests": args.requests,
+        },
+        "ingestion": ingestion,
+        "chat": chat,
+        "memory": memory,
+    }
+    output = args.output or os.path.join(RESULTS_DIR, f"e2e-{datetime.now():%Y%m%d-%H%M%S}.json")
+    os.makedirs(os.path.dirname(output) or ".", exist_ok=True)
+    with open(output, "w") as f:
+        json.dump(results, f, indent=2)
+    print(f"Risultati salvati in {output}.")
+    if args.compare:
+        compare(args.compare, results)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark end-to-end con servizi Azure simulati")
+    parser.add_argument("--pattern", default="data/*.pdf")
+    parser.add_argument("--latency", type=float, default=0.02, help="latenza simulata di ogni servizio (s)")
+    parser.add_argument("--latency-per-page", type=float, default=0.05, help="latenza di Document Intelligence per pagina (s)")
+    parser.add_argument("--ingest-concurrency", type=int, default=4)
+    parser.add_argument("--levels", default="1,8,32")
+    parser.add_argument("--requests", type=int, default=64)
+    parser.add_argument("--output", help="file json dei risultati (default: .cache/benchmarks/e2e-<data>.json)")
+    parser.add_argument("--compare", help="json di un'esecuzione precedente da confrontare")
+    run(parser.parse_args())
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,84 @@
+import argparse
+import glob
+import time
+import fitz
+from benchmarks import fakes
+
+# benchmark da extração com pymupdf (sem document intelligence): páginas/s nos pdfs de data/.
+# compara a leitura antiga (pdf aberto duas vezes, lista completa em memória) com a
+# extração em streaming, em processo único e com o pool
+#
+# uso: python -m benchmarks.extraction --workers 1,4
+
+
+# como era antes: uma passada para o texto, outra para as imagens, tudo numa lista
+def legacy_extract(file_bytes: bytes) -> list:
+    blocks = []
+    pdf_document = fitz.open(stream=file_bytes, filetype="pdf")
+    for page in pdf_document:
+        text = page.get_text("text")
+        if text.strip():
+            blocks.append(text.strip())
+    pdf_document.close()
+    pdf_document = fitz.open(stream=file_bytes, filetype="pdf")
+    for page in pdf_document:
+        for img_info in page.get_images(full=True):
+            blocks.append(pdf_document.extract_image(img_info[0])["image"])
+    pdf_document.close()
+    return blocks
+
+
+def measure(name: str, files: list, extract, repeat: int) -> dict:
+    pages = sum(page_count for _, _, page_count in files) * repeat
+    blocks = 0
+    started = time.perf_counter()
+    for _ in range(repeat):
+        for _, file_bytes, _ in files:
+            blocks += sum(1 for _ in extract(file_bytes))
+    elapsed = time.perf_counter() - started
+    return {"name": name, "pages": pages, "blocks": blocks, "seconds": elapsed, "pages_per_second": pages / elapsed}
+
+
+def run(pattern: str, workers: list, repeat: int, pages_per_task: int):
+    fakes.install_env()
+    from src import smart_doc
+
+    files = []
+    for path in sorted(glob.glob(pattern)):
+        with open(path, "rb") as f:
+            file_bytes = f.read()
+        with fitz.open(stream=file_bytes, filetype="pdf") as document:
+            files.append((path, file_bytes, document.page_count))
+    if not files:
+        print(f"Nessun PDF trovato in {pattern}.")
+        return
+    print(f"{len(files)} PDF, {sum(f[2] for f in files)} pagine.")
+
+    # o limite mínimo de páginas é zerado para o pool ser usado mesmo nos pdfs pequenos
+    smart_doc.EXTRACT_MIN_PAGES_FOR_POOL = 0
+    results = [measure("legacy (2 aperture)", files, legacy_extract, repeat)]
+    for count in workers:
+        results.append(measure(
+            f"streaming, {count} processi", files,
+            lambda file_bytes: smart_doc.iter_pdf_blocks(file_bytes, workers=count, pages_per_task=pages_per_task),
+            repeat,
+        ))
+
+    print(f"{'modalità':<24} {'pagine':>7} {'blocchi':>8} {'secondi':>8} {'pagine/s':>9}")
+    for r in results:
+        print(f"{r['name']:<24} {r['pages']:>7} {r['blocks']:>8} {r['seconds']:>8.2f} {r['pages_per_second']:>9.1f}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark dell'estrazione PyMuPDF")
+    parser.add_argument("--pattern", default="data/*.pdf")
+    parser.add_argument("--workers", default="1,4")
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument("--pages-per-task", type=int, default=8)
+    args = parser.parse_args()
+    workers = [int(w) for w in args.workers.split(",")]
+    run(args.pattern, workers, args.repeat, args.pages_per_task)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,438 @@
+import os
+import re
+import time
+import asyncio
+import hashlib
+import uuid
+import tempfile
+from types import SimpleNamespace
+import numpy as np
+
+# substitutos locais dos serviços do azure para benchmarks e testes de carga sem credenciais.
+# são objetos em memória com latência configurável que imitam a parte dos sdks usada pelo projeto
+
+EMBEDDING_DIMENSIONS = 1536
+
+
+# variáveis de ambiente fictícias para os módulos de src poderem ser importados sem rede
+def install_env():
+    cache_dir = tempfile.mkdtemp(prefix="rag-bench-")
+    defaults = {
+        "AZURE_OPENAI_KEY": "fake",
+        "AZURE_OPENAI_ENDPOINT": "https://fake.openai.azure.com",
+        "AZURE_OPENAI_DEPLOYMENT": "fake-chat",
+        "AZURE_OPENAI_EMBEDDING_DEPLOYMENT": "fake-embedding",
+        "AZURE_OPENAI_VISIONIMAGE_KEY": "fake",
+        "AZURE_OPENAI_VISIONIMAGE_ENDPOINT": "https://fake.openai.azure.com",
+        "AZURE_OPENAI_VISIONIMAGE_DEPLOYMENT": "fake-vision",
+        "AZURE_AISEARCH_ENDPOINT": "https://fake.search.windows.net",
+        "AZURE_AISEARCH_KEY": "fake",
+        "AZURE_AISEARCH_INDEX_NAME": "fake-index",
+        "AZURE_BLOB_CONNECT_STR": (
+            "DefaultEndpointsProtocol=https;AccountName=fake;AccountKey=ZmFrZQ==;EndpointSuffix=core.windows.net"
+        ),
+        "AZURE_BLOB_CONTAINER": "pdfs",
+        "AZURE_BLOB_LOGS_CONTAINER": "logs",
+        "AZURE_DOCUMENT_INTELLIGENCE_ENDPOINT": "https://fake.cognitiveservices.azure.com",
+        "AZURE_DOCUMENT_INTELLIGENCE_KEY": "fake",
+        "EMBEDDING_CACHE_PATH": os.path.join(cache_dir, "embeddings.sqlite"),
+        "INGEST_MANIFEST_PATH": os.path.join(cache_dir, "manifest.sqlite"),
+        "INGEST_JOBS_PATH": os.path.join(cache_dir, "jobs.sqlite"),
+        "CAPTION_CACHE_PATH": os.path.join(cache_dir, "captions.sqlite"),
+        "LAYOUT_CACHE_PATH": os.path.join(cache_dir, "layout.sqlite"),
+        "INGEST_ON_STARTUP": "",
+        # sem uma linha json por requisição na saída dos benchmarks
+        "TRACING_LOG": "false",
+    }
+    for key, value in defaults.items():
+        os.environ.setdefault(key, value)
+    return cache_dir
+
+
+# embedding determinístico: o mesmo texto gera sempre o mesmo vetor unitário. com dimensions
+# menor, o vetor é o começo do completo normalizado de novo, como nos text-embedding-3
+def fake_embedding(text: str, dimensions: int = None) -> list:
+    seed = int.from_bytes(hashlib.sha256(text.encode("utf-8")).digest()[:8], "little")
+    vector = np.random.default_rng(seed).standard_normal(EMBEDDING_DIMENSIONS).astype(np.float32)
+    vector = vector[:dimensions or EMBEDDING_DIMENSIONS]
+    vector /= np.linalg.norm(vector)
+    return vector.tolist()
+
+
+class FakeAsyncOpenAI:
+    def __init__(self, latency: float = 0.05, answer: str = "Risposta di prova."):
+        self.latency = latency
+        self.answer = answer
+        self.calls = {"embeddings": 0, "chat": 0}
+        self.embeddings = SimpleNamespace(create=self._create_embeddings)
+        self.chat = SimpleNamespace(completions=SimpleNamespace(create=self._create_completion))
+
+    async def _create_embeddings(self, model, input, dimensions=None, **kwargs):
+        self.calls["embeddings"] += 1
+        await asyncio.sleep(self.latency)
+        inputs = [input] if isinstance(input, str) else input
+        return SimpleNamespace(data=[
+            SimpleNamespace(index=i, embedding=fake_embedding(text, dimensions)) for i, text in enumerate(inputs)
+        ])
+
+    async def _create_completion(self, model, messages, stream=False, **kwargs):
+        self.calls["chat"] += 1
+        await asyncio.sleep(self.latency)
+        if stream:
+            return _FakeChatStream(self.answer.split(" "))
+        message = SimpleNamespace(content=self.answer)
+        return SimpleNamespace(choices=[SimpleNamespace(message=message)])
+
+
+# resposta em streaming: uma palavra por pedaço, como os deltas do sdk
+class _FakeChatStream:
+    def __init__(self, words: list):
+        self.words = words
+        self.response = SimpleNamespace(aclose=self._aclose)
+
+    async def _aclose(self):
+        pass
+
+    async def __aiter__(self):
+        for i, word in enumerate(self.words):
+            content = word if i == 0 else " " + word
+            yield SimpleNamespace(choices=[SimpleNamespace(delta=SimpleNamespace(content=content))])
+
+
+# versão síncrona, usada na ingestão (embeddings em lote) e nas legendas das imagens
+class FakeOpenAI:
+    def __init__(self, latency: float = 0.05, answer: str = "Risposta di prova."):
+        self.latency = latency
+        self.answer = answer
+        self.calls = {"embeddings": 0, "chat": 0}
+        self.embeddings = SimpleNamespace(create=self._create_embeddings)
+        self.chat = SimpleNamespace(completions=SimpleNamespace(create=self._create_completion))
+
+    # o sdk devolve uma cópia configurada; as opções não mudam nada aqui
+    def with_options(self, **kwargs):
+        return self
+
+    def _create_embeddings(self, model, input, dimensions=None, **kwargs):
+        self.calls["embeddings"] += 1
+        time.sleep(self.latency)
+        inputs = [input] if isinstance(input, str) else input
+        return SimpleNamespace(data=[
+            SimpleNamespace(index=i, embedding=fake_embedding(text, dimensions)) for i, text in enumerate(inputs)
+        ])
+
+    def _create_completion(self, model, messages, **kwargs):
+        self.calls["chat"] += 1
+        time.sleep(self.latency)
+        message = SimpleNamespace(content=self.answer)
+        return SimpleNamespace(choices=[SimpleNamespace(message=message)])
+
+
+# documentos de um índice em memória, compartilhados pelos clientes síncrono e assíncrono.
+# os termos e o vetor de cada documento são calculados uma vez, para o custo do substituto
+# não pesar na latência medida do /chat
+class FakeSearchIndex:
+    def __init__(self, documents: list = None):
+        self.documents = {}
+        self._features = {}
+        for doc in documents or []:
+            self.put(doc)
+
+    def put(self, doc: dict):
+        self.documents[doc["id"]] = dict(doc)
+        vector = doc.get("contentVector")
+        self._features[doc["id"]] = (
+            set(re.findall(r"\w+", (doc.get("content") or "").lower())),
+            np.asarray(vector, dtype=np.float32) if vector else None,
+        )
+
+    def remove(self, doc_id: str):
+        self.documents.pop(doc_id, None)
+        self._features.pop(doc_id, None)
+
+    def features(self, doc_id: str):
+        return self._features[doc_id]
+
+
+# fontes de um filtro "search.in(source, 'a|b', '|')", o único que o projeto usa
+def _filter_sources(filter: str):
+    if not filter:
+        return None
+    match = re.search(r"search\.in\(source, '(.*)', '\|'\)", filter)
+    return set(match.group(1).replace("''", "'").split("|")) if match else None
+
+
+# ordena os documentos como o azure faria, de forma simplificada: produto interno com o
+# vetor da consulta ou quantos termos da consulta aparecem no texto (só os que têm algum).
+# como no azure, só os campos de select voltam
+def _rank(index, search_text=None, vector_queries=None, filter=None, top=None, select=None):
+    sources = _filter_sources(filter)
+    candidates = [doc for doc in index.documents.values() if sources is None or doc.get("source") in sources]
+    if vector_queries:
+        query = np.asarray(vector_queries[0].vector, dtype=np.float32)
+        scored = []
+        for doc in candidates:
+            vector = index.features(doc["id"])[1]
+            scored.append((float(np.dot(query, vector)) if vector is not None else 0.0, doc))
+        top = top or vector_queries[0].k_nearest_neighbors
+    elif search_text and search_text != "*":
+        terms = set(re.findall(r"\w+", search_text.lower()))
+        scored = [(len(terms & index.features(doc["id"])[0]), doc) for doc in candidates]
+        scored = [(score, doc) for score, doc in scored if score]
+    else:
+        scored = [(1.0, doc) for doc in candidates]
+    scored.sort(key=lambda pair: pair[0], reverse=True)
+    return [
+        {**({field: doc[field] for field in select if field in doc} if select else doc), "@search.score": score}
+        for score, doc in scored[:top or 50]
+    ]
+
+
+class FakeSearchClient:
+    def __init__(self, index: FakeSearchIndex, latency: float = 0.03):
+        self.index = index
+        self.latency = latency
+        self.calls = 0
+
+    def upload_documents(self, documents):
+        time.sleep(self.latency)
+        for doc in documents:
+            self.index.put(doc)
+        return [SimpleNamespace(key=doc["id"], succeeded=True) for doc in documents]
+
+    def delete_documents(self, documents):
+        time.sleep(self.latency)
+        for doc in documents:
+            self.index.remove(doc["id"])
+
+    def search(self, search_text=None, vector_queries=None, select=None, top=None, filter=None, **kwargs):
+        self.calls += 1
+        time.sleep(self.latency)
+        return _rank(self.index, search_text, vector_queries, filter, top, select)
+
+
+class _AsyncResults:
+    def __init__(self, items):
+        self._items = items
+
+    def __aiter__(self):
+        self._iterator = iter(self._items)
+        return self
+
+    async def __anext__(self):
+        try:
+            return next(self._iterator)
+        except StopIteration:
+            raise StopAsyncIteration
+
+
+# sem index, busca em 20 trechos fixos; com o index de um FakeSearchClient, busca no que foi ingerido
+class FakeAsyncSearchClient:
+    def __init__(self, latency: float = 0.03, documents: list = None, index: FakeSearchIndex = None):
+        self.latency = latency
+        self.index = index or FakeSearchIndex(documents or [
+            {"id": f"doc-{i}", "content": f"Trecho de prova numero {i}."} for i in range(20)
+        ])
+        self.calls = 0
+
+    async def search(self, search_text=None, vector_queries=None, select=None, top=None, filter=None, **kwargs):
+        self.calls += 1
+        await asyncio.sleep(self.latency)
+        return _AsyncResults(_rank(self.index, search_text, vector_queries, filter, top, select))
+
+
+class _FakeAsyncDownload:
+    def __init__(self, data: bytes, etag: str, block_count: int, size: int = None):
+        self._data = data
+        # BlobProperties aceita tanto atributo quanto .get(); size é o tamanho do blob inteiro
+        values = {"etag": etag, "append_blob_committed_block_count": block_count,
+                  "size": len(data) if size is None else size}
+        self.properties = SimpleNamespace(**values, get=values.get)
+
+    async def readall(self):
+        return self._data
+
+
+# cada blob guardado é [dados, etag, blocos]; o etag muda a cada escrita, como no azure
+class _FakeAsyncBlobClient:
+    def __init__(self, store: dict, name: str, latency: float):
+        self._store = store
+        self._name = name
+        self._latency = latency
+
+    def _check(self, etag, match_condition):
+        from azure.core import MatchConditions
+        from azure.core.exceptions import ResourceModifiedError, ResourceExistsError
+        current = self._store.get(self._name)
+        if match_condition == MatchConditions.IfMissing and current is not None:
+            raise ResourceExistsError(f"{self._name} already exists")
+        if match_condition == MatchConditions.IfNotModified and (current is None or current[1] != etag):
+            raise ResourceModifiedError(f"{self._name} was modified")
+
+    def _write(self, data: bytes, blocks: int) -> dict:
+        etag = uuid.uuid4().hex
+        self._store[self._name] = [data, etag, blocks]
+        return {"etag": etag, "blob_committed_block_count": blocks}
+
+    async def get_blob_properties(self, **kwargs):
+        from azure.core.exceptions import ResourceNotFoundError
+        await asyncio.sleep(self._latency)
+        if self._name not in self._store:
+            raise ResourceNotFoundError(f"{self._name} not found")
+        data, etag, blocks = self._store[self._name]
+        return _FakeAsyncDownload(data, etag, blocks).properties
+
+    async def download_blob(self, offset=None, length=None, **kwargs):
+        from azure.core.exceptions import ResourceNotFoundError
+        await asyncio.sleep(self._latency)
+        if self._name not in self._store:
+            raise ResourceNotFoundError(f"{self._name} not found")
+        data, etag, blocks = self._store[self._name]
+        start = offset or 0
+        return _FakeAsyncDownload(data[start:start + length if length is not None else None], etag, blocks, len(data))
+
+    async def upload_blob(self, data, overwrite=False, **kwargs):
+        await asyncio.sleep(self._latency)
+        self._write(data.encode("utf-8") if isinstance(data, str) else bytes(data), 1)
+
+    async def stage_block(self, block_id, data, length=None, **kwargs):
+        await asyncio.sleep(self._latency)
+        self._store.setdefault(("blocks", self._name), {})[block_id] = bytes(data)
+
+    async def commit_block_list(self, block_list, **kwargs):
+        await asyncio.sleep(self._latency)
+        staged = self._store.pop(("blocks", self._name), {})
+        return self._write(b"".join(staged[block_id] for block_id in block_list), len(block_list))
+
+    async def create_append_blob(self, etag=None, match_condition=None, **kwargs):
+        await asyncio.sleep(self._latency)
+        self._check(etag, match_condition)
+        return self._write(b"", 0)
+
+    async def append_block(self, data, etag=None, match_condition=None, **kwargs):
+        await asyncio.sleep(self._latency)
+        self._check(etag, match_condition)
+        current, _, blocks = self._store[self._name]
+        return self._write(current + bytes(data), blocks + 1)
+
+
+class _FakeAsyncContainerClient:
+    def __init__(self, store: dict, latency: float):
+        self._store = store
+        self._latency = latency
+
+    def get_blob_client(self, name: str):
+        return _FakeAsyncBlobClient(self._store, name, self._latency)
+
+
+class FakeAsyncBlobServiceClient:
+    def __init__(self, latency: float = 0.02):
+        self.latency = latency
+        self.containers = {}
+
+    def get_container_client(self, name: str):
+        return _FakeAsyncContainerClient(self.containers.setdefault(name, {}), self.latency)
+
+
+class _FakeDownload:
+    def __init__(self, data: bytes):
+        self._data = data
+
+    def readall(self):
+        return self._data
+
+    def readinto(self, stream):
+        # escreve em pedaços, como o sdk faz com o download paralelo
+        for start in range(0, len(self._data), 4 * 1024 * 1024):
+            stream.write(self._data[start:start + 4 * 1024 * 1024])
+        return len(self._data)
+
+
+# blob síncrono (container dos pdfs): o suficiente para listar, ler propriedades e baixar
+class _FakeBlobClient:
+    def __init__(self, store: dict, name: str, latency: float):
+        self._store = store
+        self._name = name
+        self._latency = latency
+
+    def get_blob_properties(self):
+        time.sleep(self._latency)
+        return SimpleNamespace(name=self._name, etag=self._store[self._name][1])
+
+    def download_blob(self, **kwargs):
+        time.sleep(self._latency)
+        return _FakeDownload(self._store[self._name][0])
+
+    def upload_blob(self, data, overwrite=False, **kwargs):
+        time.sleep(self._latency)
+        data = data.read() if hasattr(data, "read") else data
+        self._store[self._name] = [bytes(data), uuid.uuid4().hex, 1]
+
+
+class FakeContainerClient:
+    def __init__(self, store: dict = None, latency: float = 0.02):
+        self.store = store if store is not None else {}
+        self.latency = latency
+
+    def get_blob_client(self, name: str):
+        return _FakeBlobClient(self.store, name, self.latency)
+
+    def list_blobs(self, name_starts_with=None, **kwargs):
+        return [
+            SimpleNamespace(name=name, etag=value[1]) for name, value in sorted(self.store.items())
+            if isinstance(name, str) and name.startswith(name_starts_with or "")
+        ]
+
+
+# páginas de uma faixa do document intelligence ("1-3,7"); None é o documento inteiro
+def _parse_pages(pages: str, page_count: int) -> list:
+    if not pages:
+        return list(range(1, page_count + 1))
+    selected = []
+    for part in pages.split(","):
+        start, _, end = part.partition("-")
+        selected.extend(range(int(start), int(end or start) + 1))
+    return [p for p in selected if 1 <= p <= page_count]
+
+
+class _FakePoller:
+    def __init__(self, result):
+        self._result = result
+
+    def result(self):
+        return self._result
+
+
+# substituto do DocumentIntelligenceClient: lê texto e tabelas com o pymupdf e espera
+# latency_per_page segundos por página analisada, como o serviço cobra e demora por página
+class FakeDocumentIntelligenceClient:
+    def __init__(self, latency_per_page: float = 0.2):
+        self.latency_per_page = latency_per_page
+        self.calls = 0
+        self.pages_analyzed = 0
+        self.bytes_received = 0
+
+    def begin_analyze_document(self, model_id, body, pages=None, features=None, **kwargs):
+        import time
+        import fitz
+        data = body.read() if hasattr(body, "read") else body
+        self.bytes_received += len(data)
+        paragraphs = []
+        tables = []
+        with fitz.open(stream=data, filetype="pdf") as document:
+            selected = _parse_pages(pages, document.page_count)
+            for page_number in selected:
+                page = document.load_page(page_number - 1)
+                region = [SimpleNamespace(page_number=page_number)]
+                for block in page.get_text("blocks"):
+                    if block[4].strip():
+                        paragraphs.append(SimpleNamespace(content=block[4].strip(), bounding_regions=region))
+                for table in page.find_tables().tables:
+                    cells = [
+                        SimpleNamespace(row_index=r, column_index=c, content=value or "")
+                        for r, row in enumerate(table.extract()) for c, value in enumerate(row)
+                    ]
+                    tables.append(SimpleNamespace(cells=cells, bounding_regions=region))
+        self.calls += 1
+        self.pages_analyzed += len(selected)
+        time.sleep(self.latency_per_page * len(selected))
+        return _FakePoller(SimpleNamespace(paragraphs=paragraphs, tables=tables))
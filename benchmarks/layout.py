@@ -0,0 +1,49 @@
+import argparse
+import glob
+import time
+from benchmarks import fakes
+
+# compara a análise de layout do pdf inteiro ("full") com a seletiva ("selective") usando o
+# substituto local do document intelligence: páginas enviadas, bytes enviados, chamadas e tempo. a segunda
+# passada seletiva mostra o efeito do cache de layout
+#
+# uso: python -m benchmarks.layout --latency-per-page 0.5
+
+
+def run(pattern: str, latency_per_page: float):
+    fakes.install_env()
+    from src import smart_doc, clients
+
+    fake = fakes.FakeDocumentIntelligenceClient(latency_per_page=latency_per_page)
+    clients.override("document_intelligence", fake)
+
+    print(f"{'pdf':<28} {'modalità':<16} {'pagine':>7} {'inviate':>8} {'MiB inviati':>12} {'chiamate':>9} {'secondi':>8}")
+    for path in sorted(glob.glob(pattern)):
+        with open(path, "rb") as f:
+            file_bytes = f.read()
+        for mode, label in (("full", "full"), ("selective", "selective"), ("selective", "selective+cache")):
+            smart_doc.SMART_DOC_DI_MODE = mode
+            fake.calls = fake.pages_analyzed = fake.bytes_received = 0
+            layout = {}
+            started = time.perf_counter()
+            # só a parte do layout: o texto de reserva e as imagens não entram na medida
+            if mode == "full":
+                smart_doc.analyze_layout(file_bytes, path)
+            else:
+                smart_doc.analyze_selective(file_bytes, path, layout)
+            elapsed = time.perf_counter() - started
+            total = layout.get("layout_pages_total", fake.pages_analyzed)
+            print(f"{path[-28:]:<28} {label:<16} {total:>7} {fake.pages_analyzed:>8} "
+                  f"{fake.bytes_received / 2**20:>12.2f} {fake.calls:>9} {elapsed:>8.2f}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark dell'analisi di layout selettiva")
+    parser.add_argument("--pattern", default="data/*.pdf")
+    parser.add_argument("--latency-per-page", type=float, default=0.5)
+    args = parser.parse_args()
+    run(args.pattern, args.latency_per_page)
+
+
+if __name__ == "__main__":
+    main()
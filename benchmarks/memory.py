@@ -0,0 +1,73 @@
+import argparse
+import os
+import subprocess
+import sys
+import tempfile
+import fitz
+from benchmarks import fakes
+
+# pico de memória (rss) da extração de um pdf em função do tamanho: o pdf inteiro em
+# memória ("bytes", como era antes) contra o arquivo no disco ("file"). cada medida roda
+# num processo novo, e os pdfs maiores são o pdf base repetido várias vezes
+#
+# uso: python -m benchmarks.memory --pdf data/O-Alienista.pdf --copies 1,8,32
+
+
+# pico de rss do processo em MiB. VmHWM e não ru_maxrss: este último herda o pico do
+# processo pai (no linux sobrevive ao exec)
+def peak_rss_mib() -> float:
+    with open("/proc/self/status") as f:
+        return next(int(line.split()[1]) for line in f if line.startswith("VmHWM")) / 1024
+
+
+# processo filho: extrai o pdf e imprime o pico de rss em MiB
+def child(mode: str, path: str):
+    fakes.install_env()
+    os.environ["SMART_DOC_DI_MODE"] = "off"
+    from src import smart_doc
+    if mode == "bytes":
+        with open(path, "rb") as f:
+            pdf = f.read()
+    else:
+        pdf = path
+    blocks = sum(1 for _ in smart_doc.iter_content_blocks(pdf, os.path.basename(path)))
+    print(blocks, peak_rss_mib())
+
+
+def build(base: str, copies: int, directory: str) -> str:
+    path = os.path.join(directory, f"x{copies}.pdf")
+    with fitz.open(base) as source, fitz.open() as document:
+        for _ in range(copies):
+            document.insert_pdf(source)
+        document.save(path)
+    return path
+
+
+def run(base: str, copies: list):
+    print(f"{'copie':>6} {'MiB pdf':>8} {'modalità':>9} {'blocchi':>8} {'RSS max MiB':>12}")
+    with tempfile.TemporaryDirectory() as directory:
+        for count in copies:
+            path = build(base, count, directory)
+            size = os.path.getsize(path) / 1024 / 1024
+            for mode in ("bytes", "file"):
+                output = subprocess.run(
+                    [sys.executable, "-m", "benchmarks.memory", "--child", mode, path],
+                    capture_output=True, text=True, check=True,
+                ).stdout.split()
+                print(f"{count:>6} {size:>8.1f} {mode:>9} {output[-2]:>8} {float(output[-1]):>12.1f}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Picco di memoria dell'estrazione per dimensione del PDF")
+    parser.add_argument("--pdf", default="data/O-Alienista.pdf")
+    parser.add_argument("--copies", default="1,8,32")
+    parser.add_argument("--child", nargs=2, metavar=("MODE", "PATH"), help=argparse.SUPPRESS)
+    args = parser.parse_args()
+    if args.child:
+        child(*args.child)
+    else:
+        run(args.pdf, [int(c) for c in args.copies.split(",")])
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,150 @@
+import argparse
+import asyncio
+import json
+import os
+import time
+from datetime import datetime
+import numpy as np
+from benchmarks import fakes
+
+# efeito da diversificação (mmr) no contexto do /chat: um corpus em que cada trecho aparece
+# várias vezes (como os parágrafos do layout repetidos no texto do pymupdf e as tabelas
+# repetidas) passa pela busca híbrida de verdade contra o substituto do azure search e pelo
+# prompt.pack_context. para cada lambda mede quantos trechos distintos chegam ao prompt, os
+# tokens do contexto, tokens por trecho distinto, a similaridade média com a consulta e o
+# tempo da busca. sem mmr é a linha "off".
+#
+# os vetores são gerados aqui (vetor do assunto + ruído pequeno para as cópias), porque o
+# embedding dos substitutos é um hash do texto e não aproxima textos parecidos. cada consulta
+# mistura alguns assuntos, com os termos deles no texto da pergunta
+#
+# uso: python -m benchmarks.mmr --topics 200 --copies 4 --lambdas 1,0.7,0.5,0.3
+
+RESULTS_DIR = ".cache/benchmarks"
+DIMENSIONS = 1536
+
+
+def normalize(vector: np.ndarray) -> np.ndarray:
+    return vector / np.linalg.norm(vector)
+
+
+# frases do trecho de um assunto; os termos "termN" identificam o assunto na busca textual
+def passage(topic: int, sentences: int) -> str:
+    return " ".join(
+        f"Il paragrafo term{topic} descrive la regola {topic}.{i} con valori, eccezioni e riferimenti alla tabella {topic}."
+        for i in range(sentences)
+    )
+
+
+# documentos do índice: cada assunto tem o trecho original e copies - 1 cópias quase iguais
+def build_corpus(topics: int, copies: int, sentences: int, noise: float, rng) -> tuple:
+    bases = rng.standard_normal((topics, DIMENSIONS)).astype(np.float32)
+    documents = []
+    for topic in range(topics):
+        text = passage(topic, sentences)
+        for copy in range(copies):
+            vector = normalize(normalize(bases[topic]) + noise * normalize(rng.standard_normal(DIMENSIONS)))
+            # as cópias mudam só a quebra de linha, como o texto extraído de outro jeito
+            content = text if copy == 0 else text.replace(". ", ".\n", copy)
+            documents.append({
+                "id": f"topic-{topic}-copy-{copy}", "content": content, "source": f"doc-{topic % 10}.pdf",
+                "contentVector": vector.tolist(),
+            })
+    return bases, documents
+
+
+def build_queries(bases: np.ndarray, count: int, mix: int, rng) -> list:
+    queries = []
+    for _ in range(count):
+        topics = rng.choice(len(bases), size=mix, replace=False)
+        weights = np.linspace(1.0, 0.6, mix)
+        vector = normalize(sum(weight * normalize(bases[t]) for weight, t in zip(weights, topics)))
+        text = "Quali regole per " + " e ".join(f"term{t}" for t in topics) + "?"
+        queries.append({"text": text, "vector": vector.tolist(), "topics": set(int(t) for t in topics)})
+    return queries
+
+
+def topic_of(result: dict) -> int:
+    return int(result["id"].split("-")[1])
+
+
+async def measure(index, queries: list, options: dict) -> dict:
+    from src import prompt, search_service
+    distinct, tokens, relevance, covered, latencies = [], [], [], [], []
+    for query in queries:
+        started = time.perf_counter()
+        results = await search_service.search_hybrid_async(query["text"], query_vector=query["vector"], **options)
+        latencies.append((time.perf_counter() - started) * 1000)
+        packed = prompt.pack_context(results)
+        topics = {topic_of(r) for r in packed["results"]}
+        distinct.append(len(topics))
+        covered.append(len(topics & query["topics"]) / len(query["topics"]))
+        tokens.append(packed["tokens"])
+        relevance.append(np.mean([np.dot(query["vector"], index.documents[r["id"]]["contentVector"])
+                                  for r in packed["results"]]))
+    p50, p95 = np.percentile(latencies, [50, 95])
+    return {
+        "distinct_passages": float(np.mean(distinct)),
+        "query_topics_covered": float(np.mean(covered)),
+        "context_tokens": float(np.mean(tokens)),
+        "tokens_per_distinct_passage": float(np.sum(tokens) / max(np.sum(distinct), 1)),
+        "mean_similarity": float(np.mean(relevance)),
+        "p50_ms": p50, "p95_ms": p95,
+    }
+
+
+async def run(args):
+    fakes.install_env()
+    from src import clients
+
+    rng = np.random.default_rng(42)
+    bases, documents = build_corpus(args.topics, args.copies, args.sentences, args.noise, rng)
+    index = fakes.FakeSearchIndex(documents)
+    clients.override("search_async", fakes.FakeAsyncSearchClient(latency=0, index=index))
+    queries = build_queries(bases, args.queries, args.mix, rng)
+    print(f"Corpus: {args.topics} argomenti x {args.copies} copie, {args.queries} query con {args.mix} argomenti.")
+
+    settings = [("off", {"mmr": False})] + [
+        (f"{value:g}", {"mmr": True, "mmr_lambda": value, "mmr_candidates": args.candidates})
+        for value in (float(v) for v in args.lambdas.split(","))
+    ]
+    rows = []
+    for label, options in settings:
+        await measure(index, queries[:5], {"top": args.top, **options})
+        rows.append({"lambda": label, **await measure(index, queries, {"top": args.top, **options})})
+
+    print(f"\n{'lambda':>6} {'distinti':>9} {'coperti':>8} {'token':>7} {'tok/dist':>9} {'sim':>6} {'p50 ms':>7} {'p95 ms':>7}")
+    for r in rows:
+        print(f"{r['lambda']:>6} {r['distinct_passages']:>9.2f} {r['query_topics_covered']:>8.2f} "
+              f"{r['context_tokens']:>7.0f} {r['tokens_per_distinct_passage']:>9.0f} {r['mean_similarity']:>6.3f} "
+              f"{r['p50_ms']:>7.2f} {r['p95_ms']:>7.2f}")
+
+    results = {
+        "timestamp": datetime.now().isoformat(timespec="seconds"),
+        "topics": args.topics, "copies": args.copies, "queries": args.queries, "top": args.top,
+        "candidates": args.candidates, "rows": rows,
+    }
+    output = args.output or os.path.join(RESULTS_DIR, f"mmr-{datetime.now():%Y%m%d-%H%M%S}.json")
+    os.makedirs(os.path.dirname(output) or ".", exist_ok=True)
+    with open(output, "w") as f:
+        json.dump(results, f, indent=2)
+    print(f"Risultati salvati in {output}.")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Passaggi distinti e token del contesto con e senza MMR")
+    parser.add_argument("--topics", type=int, default=200)
+    parser.add_argument("--copies", type=int, default=4, help="copie quasi uguali di ogni passaggio")
+    parser.add_argument("--sentences", type=int, default=6, help="frasi per passaggio")
+    parser.add_argument("--noise", type=float, default=0.15, help="rumore dei vettori delle copie")
+    parser.add_argument("--queries", type=int, default=100)
+    parser.add_argument("--mix", type=int, default=3, help="argomenti per query")
+    parser.add_argument("--top", type=int, default=5)
+    parser.add_argument("--candidates", type=int, default=20)
+    parser.add_argument("--lambdas", default="1,0.7,0.5,0.3")
+    parser.add_argument("--output", help="file json dei risultati")
+    asyncio.run(run(parser.parse_args()))
+
+
+if __name__ == "__main__":
+    main()
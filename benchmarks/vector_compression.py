@@ -0,0 +1,192 @@
+import argparse
+import json
+import os
+import shutil
+import sqlite3
+import tempfile
+import time
+from datetime import datetime
+import numpy as np
+from src.local_index import LocalVectorIndex
+
+# relatório de compressão dos vetores: para cada tamanho de vetor (dimensões reduzidas) e
+# quantização (nenhuma, int8, binária com vários oversampling), mede o recall@k em relação à
+# busca exata com os vetores completos, a latência p50/p95 da busca, os bytes por vetor que a
+# busca percorre, o tamanho em disco e os bytes de json enviados por vetor ao índice.
+# a quantização medida é a do índice local (SEARCH_BACKEND=local), a única que VECTOR_COMPRESSION
+# liga; no azure só as dimensões reduzidas e o envio valem.
+#
+# os vetores vêm do corpus já ingerido: do índice local (SEARCH_BACKEND=local) ou do cache de
+# embeddings. parte deles vira consulta e sai do índice. as dimensões reduzidas são o começo de
+# cada vetor normalizado de novo, que é o que o parâmetro dimensions dos text-embedding-3 devolve
+# (com modelos sem esse parâmetro, como o ada-002, só a linha das dimensões completas vale).
+# --source synthetic gera vetores aleatórios para medir tamanho e latência em escala; as
+# consultas são cópias com ruído de vetores do índice. sem a estrutura de embeddings reais,
+# o recall das dimensões reduzidas ali é o pior caso e não representa o corpus
+#
+# uso: python -m benchmarks.vector_compression --dimensions 1536,1024,512,256 --oversampling 1,4,10
+
+RESULTS_DIR = ".cache/benchmarks"
+
+
+def load_local_index(directory: str):
+    from src.search_backends import VECTOR_DIMENSIONS, LOCAL_INDEX_DTYPE
+    path = os.path.join(directory, "vectors")
+    if not os.path.isdir(path):
+        return None
+    index = LocalVectorIndex(path, VECTOR_DIMENSIONS, LOCAL_INDEX_DTYPE)
+    live = sorted(row for row in index.row_by_id.values() if row < index._matrix.shape[0])
+    return np.asarray(index._matrix[live], dtype=np.float32) if live else None
+
+
+# todos os vetores do cache de embeddings com o tamanho mais comum
+def load_embedding_cache(path: str):
+    if not os.path.exists(path):
+        return None
+    with sqlite3.connect(path) as connection:
+        blobs = [row[0] for row in connection.execute("SELECT vector FROM embeddings")]
+    if not blobs:
+        return None
+    sizes = [len(blob) for blob in blobs]
+    common = max(set(sizes), key=sizes.count)
+    return np.stack([np.frombuffer(blob, dtype=np.float32) for blob in blobs if len(blob) == common])
+
+
+def load_vectors(args):
+    if args.source in ("auto", "local"):
+        from src.search_backends import LOCAL_INDEX_DIR
+        vectors = load_local_index(args.local_index_dir or LOCAL_INDEX_DIR)
+        if vectors is not None or args.source == "local":
+            return vectors, "local"
+    if args.source in ("auto", "cache"):
+        from src.embedding_cache import cache_path
+        vectors = load_embedding_cache(args.cache_path or cache_path)
+        if vectors is not None or args.source == "cache":
+            return vectors, "cache"
+    rng = np.random.default_rng(42)
+    return rng.standard_normal((args.size, args.synthetic_dimensions), dtype=np.float32), "synthetic"
+
+
+def normalize(vectors: np.ndarray) -> np.ndarray:
+    norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+    return vectors / np.where(norms == 0, 1, norms)
+
+
+# vetores com as primeiras dimensions dimensões, normalizados de novo
+def reduce(vectors: np.ndarray, dimensions: int) -> np.ndarray:
+    return normalize(vectors[:, :dimensions])
+
+
+def exact_top(corpus: np.ndarray, queries: np.ndarray, k: int) -> list:
+    scores = queries @ corpus.T
+    return [set(np.argsort(-row)[:k].tolist()) for row in scores]
+
+
+# bytes de json de um vetor no envio ao índice (como o search_service manda)
+def upload_bytes(vectors: np.ndarray, decimals: int) -> float:
+    sample = vectors[:50]
+    encoded = json.dumps(np.round(sample.astype(np.float64), decimals).tolist())
+    return len(encoded) / len(sample)
+
+
+def build(directory: str, corpus: np.ndarray, quantization: str) -> LocalVectorIndex:
+    index = LocalVectorIndex(directory, corpus.shape[1], "float32", quantization)
+    for start in range(0, len(corpus), 50_000):
+        index.upsert([
+            {"id": str(start + i), "contentVector": vector}
+            for i, vector in enumerate(corpus[start:start + 50_000])
+        ])
+    return index
+
+
+def measure(index: LocalVectorIndex, queries: np.ndarray, truth: list, k: int, oversampling: float) -> dict:
+    index.search(queries[0], k, oversampling=oversampling)
+    latencies = []
+    hits = 0
+    for query, expected in zip(queries, truth):
+        started = time.perf_counter()
+        results = index.search(query, k, oversampling=oversampling)
+        latencies.append((time.perf_counter() - started) * 1000)
+        hits += len(expected & {int(r["id"]) for r in results})
+    p50, p95 = np.percentile(latencies, [50, 95])
+    return {"recall": hits / (k * len(queries)), "p50_ms": p50, "p95_ms": p95}
+
+
+def run(args):
+    vectors, source = load_vectors(args)
+    if vectors is None or len(vectors) <= args.queries:
+        raise SystemExit("Nessun vettore sufficiente: ingerisci il corpus oppure usa --source synthetic.")
+    vectors = normalize(vectors.astype(np.float32))
+    rng = np.random.default_rng(7)
+    order = rng.permutation(len(vectors))
+    if source == "synthetic":
+        corpus = vectors
+        noise = rng.standard_normal((args.queries, vectors.shape[1]), dtype=np.float32) / np.sqrt(vectors.shape[1])
+        queries = normalize(corpus[order[:args.queries]] + 0.5 * noise)
+    else:
+        queries, corpus = vectors[order[:args.queries]], vectors[order[args.queries:]]
+    native = vectors.shape[1]
+    k = min(args.k, len(corpus))
+    truth = exact_top(corpus, queries, k)
+    print(f"Vettori: {len(corpus)} nell'indice + {len(queries)} query, {native} dimensioni (fonte: {source}).")
+
+    dimensions = [d for d in (int(d) for d in args.dimensions.split(",")) if d <= native] or [native]
+    oversampling = [float(o) for o in args.oversampling.split(",")]
+    from src.search_service import VECTOR_UPLOAD_DECIMALS
+    rows = []
+    directory = tempfile.mkdtemp(prefix="vector-compression-")
+    try:
+        for size in dimensions:
+            reduced_corpus, reduced_queries = reduce(corpus, size), reduce(queries, size)
+            sent = upload_bytes(reduced_corpus, VECTOR_UPLOAD_DECIMALS)
+            for quantization in ("none", "int8", "binary"):
+                index = build(os.path.join(directory, f"{size}-{quantization}"), reduced_corpus, quantization)
+                storage = index.storage()
+                disk = sum(storage["bytes"][name] for name in storage["bytes"] if name != "log")
+                for factor in (oversampling if quantization != "none" else [1.0]):
+                    result = measure(index, reduced_queries, truth, k, factor)
+                    rows.append({
+                        "dimensions": size, "quantization": quantization, "oversampling": factor,
+                        **result, "scanned_bytes_per_vector": storage["scanned_bytes_per_vector"],
+                        "disk_bytes_per_vector": disk / len(reduced_corpus), "upload_bytes_per_vector": sent,
+                    })
+                shutil.rmtree(index.directory, ignore_errors=True)
+    finally:
+        shutil.rmtree(directory, ignore_errors=True)
+
+    print(f"\n{'dim':>5} {'quant':>7} {'overs':>6} {'recall@' + str(k):>10} {'p50 ms':>8} {'p95 ms':>8} "
+          f"{'B letti':>8} {'B disco':>8} {'B invio':>8}")
+    for r in rows:
+        print(f"{r['dimensions']:>5} {r['quantization']:>7} {r['oversampling']:>6g} {r['recall']:>10.3f} "
+              f"{r['p50_ms']:>8.2f} {r['p95_ms']:>8.2f} {r['scanned_bytes_per_vector']:>8.0f} "
+              f"{r['disk_bytes_per_vector']:>8.0f} {r['upload_bytes_per_vector']:>8.0f}")
+
+    results = {
+        "timestamp": datetime.now().isoformat(timespec="seconds"),
+        "source": source, "vectors": len(corpus), "queries": len(queries), "native_dimensions": native, "k": k,
+        "rows": rows,
+    }
+    output = args.output or os.path.join(RESULTS_DIR, f"vector-compression-{datetime.now():%Y%m%d-%H%M%S}.json")
+    os.makedirs(os.path.dirname(output) or ".", exist_ok=True)
+    with open(output, "w") as f:
+        json.dump(results, f, indent=2)
+    print(f"Risultati salvati in {output}.")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Recall, latenza e dimensione della compressione dei vettori")
+    parser.add_argument("--source", default="auto", choices=["auto", "local", "cache", "synthetic"])
+    parser.add_argument("--local-index-dir", help="cartella dell'indice locale (default: LOCAL_INDEX_DIR)")
+    parser.add_argument("--cache-path", help="cache degli embedding (default: EMBEDDING_CACHE_PATH)")
+    parser.add_argument("--size", type=int, default=100_000, help="vettori sintetici (--source synthetic)")
+    parser.add_argument("--synthetic-dimensions", type=int, default=1536)
+    parser.add_argument("--dimensions", default="1536,1024,512,256")
+    parser.add_argument("--oversampling", default="1,4,10")
+    parser.add_argument("--queries", type=int, default=100)
+    parser.add_argument("--k", type=int, default=10)
+    parser.add_argument("--output", help="file json dei risultati")
+    run(parser.parse_args())
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,66 @@
+import argparse
+import shutil
+import tempfile
+import time
+import numpy as np
+from src.local_index import LocalVectorIndex
+
+# benchmark do índice vetorial local: latência p50/p99 de consulta para vários tamanhos.
+# os vetores são gravados em lotes, então 1M x 1536 não precisa caber inteiro na memória
+# (em disco: ~6 GB em float32, ~3 GB em float16)
+#
+# uso: python -m benchmarks.vector_index --sizes 10000,100000,1000000 --dtype float16
+
+WRITE_BATCH = 50_000
+
+
+def build_index(directory: str, size: int, dimensions: int, dtype: str, rng) -> LocalVectorIndex:
+    index = LocalVectorIndex(directory, dimensions, dtype)
+    for start in range(0, size, WRITE_BATCH):
+        count = min(WRITE_BATCH, size - start)
+        vectors = rng.standard_normal((count, dimensions), dtype=np.float32)
+        index.upsert([
+            {"id": f"doc-{start + i}", "content": "", "contentVector": vectors[i]}
+            for i in range(count)
+        ])
+    return index
+
+
+def run(sizes: list, dimensions: int, dtype: str, queries: int, k: int):
+    rng = np.random.default_rng(42)
+    print(f"{'vettori':>10} {'dtype':>8} {'build s':>8} {'p50 ms':>8} {'p99 ms':>8}")
+    for size in sizes:
+        directory = tempfile.mkdtemp(prefix="vector-bench-")
+        try:
+            started = time.perf_counter()
+            index = build_index(directory, size, dimensions, dtype, rng)
+            build_seconds = time.perf_counter() - started
+
+            # aquece o cache de páginas antes de medir
+            index.search(rng.standard_normal(dimensions), k)
+            latencies = []
+            for _ in range(queries):
+                query = rng.standard_normal(dimensions)
+                started = time.perf_counter()
+                index.search(query, k)
+                latencies.append((time.perf_counter() - started) * 1000)
+
+            p50, p99 = np.percentile(latencies, [50, 99])
+            print(f"{size:>10} {dtype:>8} {build_seconds:>8.1f} {p50:>8.2f} {p99:>8.2f}")
+        finally:
+            shutil.rmtree(directory, ignore_errors=True)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark dell'indice vettoriale locale")
+    parser.add_argument("--sizes", default="10000,100000,1000000")
+    parser.add_argument("--dimensions", type=int, default=1536)
+    parser.add_argument("--dtype", default="float32", choices=["float32", "float16"])
+    parser.add_argument("--queries", type=int, default=100)
+    parser.add_argument("--k", type=int, default=20)
+    args = parser.parse_args()
+    run([int(s) for s in args.sizes.split(",")], args.dimensions, args.dtype, args.queries, args.k)
+
+
+if __name__ == "__main__":
+    main()
@@ -1,6 +1,10 @@
+import sys
+import json
+import time
 import requests
 
 API_URL = "http://127.0.0.1:8000/chat"
+STREAM_URL = "http://127.0.0.1:8000/chat/stream"
 
 # variável global para armazenar apenas o id da sessão
 global_session_id = None 
@@ -35,7 +39,53 @@ def send_question(question: str):
         return False
 
 
-def run_chat_cli():
+def send_question_stream(question: str):
+    #envia a pergunta para o endpoint sse e mostra a resposta enquanto ela é gerada
+    global global_session_id
+
+    payload = {
+        "question": question,
+        "session_id": global_session_id
+    }
+
+    try:
+        started = time.perf_counter()
+        first_token = None
+        with requests.post(STREAM_URL, json=payload, stream=True) as response:
+            response.raise_for_status()
+            print("Bot:")
+
+            event = None
+            for line in response.iter_lines(decode_unicode=True):
+                # cada evento sse tem uma linha "event:" e uma "data:"
+                if line.startswith("event:"):
+                    event = line[len("event:"):].strip()
+                elif line.startswith("data:"):
+                    data = json.loads(line[len("data:"):].strip())
+                    if event == "session":
+                        global_session_id = data.get("session_id")
+                    elif event == "delta":
+                        if first_token is None:
+                            first_token = time.perf_counter() - started
+                        print(data.get("content", ""), end="", flush=True)
+                    elif event == "done":
+                        global_session_id = data.get("session_id")
+                        # quando não houve streaming (ex. limite de contexto) mostra a resposta inteira
+                        if first_token is None:
+                            print(data.get("answer"), end="")
+
+        print()
+        if first_token is not None:
+            print(f"(primo token in {first_token * 1000:.0f} ms)")
+        print("-" * 50)
+        return True
+
+    except requests.exceptions.RequestException as e:
+        print(f"ERRO: {e}")
+        return False
+
+
+def run_chat_cli(stream: bool = False):
     print("🤖 Bot: Ciao! Come posso aiutarti oggi?") 
   
 
@@ -48,11 +98,15 @@ def run_chat_cli():
                 break
 
             if user_input.strip(): 
-                send_question(user_input)
+                if stream:
+                    send_question_stream(user_input)
+                else:
+                    send_question(user_input)
             
         except EOFError:
             #se der erro pare tudo
             break
 
 if __name__ == "__main__":
-    run_chat_cli()
\ No newline at end of file
+    # python chat.py --stream usa o endpoint /chat/stream
+    run_chat_cli(stream="--stream" in sys.argv)
\ No newline at end of file
@@ -1,16 +1,43 @@
 from dotenv import load_dotenv
 load_dotenv()
-from typing import Optional
+from typing import List, Optional
+import os
 import uuid
-from src.blob_storage import container_client
+import json
+import time
+import asyncio
+from contextlib import aclosing, asynccontextmanager
 import numpy as np
-from pydantic import BaseModel
-from fastapi import FastAPI
-from src import smart_doc, openai, search_service, blob_logs, image_captioning
+from pydantic import BaseModel, Field
+from fastapi import FastAPI, HTTPException, Request
+from fastapi.responses import StreamingResponse, PlainTextResponse
+from src import openai, prompt, search_service, jobs, metrics, answer_cache, ingest_manifest, session_store
+from src import tracing, embedding_cache, blob_storage, clients
 from fastapi.middleware.cors import CORSMiddleware
 
 
-app = FastAPI(title="RAG Chatbot")
+# pdfs colocados na fila de ingestão quando a api sobe; a ingestão em si roda no worker
+# (python worker.py run), uma única vez, independentemente de quantos processos da api existam
+STARTUP_INGEST_BLOBS = [b for b in os.getenv("INGEST_ON_STARTUP", "covid19.pdf").split(",") if b.strip()]
+
+
+# ciclo de vida da api: subir não cria clientes nem abre conexões (cada cliente nasce no
+# primeiro uso, em src/clients.py); no shutdown a fila de sessões é esvaziada e os clientes
+# e pools de conexões são fechados
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    for blob_name in STARTUP_INGEST_BLOBS:
+        jobs.enqueue(jobs.INGEST_BLOB, {"blob_name": blob_name.strip()})
+    # grava os turnos das sessões em segundo plano enquanto a api está no ar
+    session_store.start()
+    try:
+        yield
+    finally:
+        await session_store.stop()
+        await clients.aclose_all()
+
+
+app = FastAPI(title="RAG Chatbot", lifespan=lifespan)
 
 origin = [
     "http://localhost:5173"
@@ -27,119 +54,266 @@ app.add_middleware(
 
 # limite de tokens que o modelo pode receber de uma vez
 MAX_CONTEXT_TOKENS = 8000
+# quando o histórico não cabe no limite, os turnos mais antigos são resumidos (true)
+# ou simplesmente descartados (false)
+HISTORY_SUMMARY = os.getenv("HISTORY_SUMMARY", "true").lower() == "true"
 
-# garante que o índice vetorial já exista no azure search
-search_service.create_vector_index()
+# parâmetros opcionais da busca híbrida por requisição (os ausentes usam o padrão)
+class RetrievalOptions(BaseModel):
+    top: Optional[int] = Field(None, ge=1)
+    vector_k: Optional[int] = Field(None, ge=1)
+    text_k: Optional[int] = Field(None, ge=1)
+    vector_weight: Optional[float] = Field(None, ge=0)
+    text_weight: Optional[float] = Field(None, ge=0)
+    rrf_k: Optional[int] = Field(None, ge=0)
+    # restringe a busca aos chunks desses documentos (nomes dos pdfs)
+    sources: Optional[List[str]] = None
+    # diversificação dos trechos (mmr): liga/desliga, peso da relevância e candidatos considerados
+    mmr: Optional[bool] = None
+    mmr_lambda: Optional[float] = Field(None, ge=0, le=1)
+    mmr_candidates: Optional[int] = Field(None, ge=1)
 
-# carrega o pdf nome do pdf dentro do container pdfs
-blob_name = "covid19.pdf"
-blob_client = container_client.get_blob_client(blob_name)
+# define modelo Pydantic para a entrada
+class Question(BaseModel):
+    question: str
+    session_id: Optional[str] = None
+    retrieval: Optional[RetrievalOptions] = None
+    # None: usa o cache de respostas só quando a sessão ainda não tem histórico
+    use_cache: Optional[bool] = None
 
-# baixa o arquivo diretamente da nuvem bytes
-pdf_bytes = blob_client.download_blob().readall()
+# escopo do cache de respostas: índice + versão dos documentos + parâmetros da busca,
+# assim uma nova ingestão ou outra configuração de busca não reaproveitam respostas antigas
+def answer_cache_scope(options: dict) -> str:
+    return f"{search_service.index_name}|v{ingest_manifest.corpus_version()}|{json.dumps(options, sort_keys=True)}"
 
-# extrai o conteúdo estruturado texto, metadados de imagens/tabelas
-print("Iniciando extração estruturada do PDF...")
-content_blocks = smart_doc.extract_all_content(pdf_bytes, blob_name)
+# fontes usadas na resposta (sem o texto dos chunks)
+def describe_sources(results: list) -> list:
+    return [{"id": r["id"], "source": r["source"], "score": r["score"]} for r in results]
 
-# cria um array de embeddings para cada chunk
-docs_to_upload = []
+# prepara um turno do chat: histórico, embedding da pergunta, cache de respostas e contexto rag.
+# devolve um dict com "history" (já cortado para caber em MAX_CONTEXT_TOKENS), "sources" e,
+# conforme o caso, "cached" (resposta do cache), "messages" e "prompt_tokens" (o prompt que
+# vai para o modelo e os tokens de cada parte) e "scope" (para guardar a resposta)
+async def prepare_turn(question: str, session_id: str, retrieval: Optional[RetrievalOptions] = None,
+                       use_cache: Optional[bool] = None):
+    options = {k: v for k, v in (retrieval.model_dump() if retrieval else {}).items() if v is not None}
 
-# id base para o documento original
-source_doc_id = blob_name.replace('.', '-')
+    # o histórico carrega enquanto o embedding é gerado e a busca roda
+    history_task = asyncio.create_task(tracing.traced("chat.session_load", session_store.get_history(session_id)))
+    query_vector = await tracing.traced("chat.embedding", openai.get_embedding_async(question))
+    search_task = asyncio.create_task(tracing.traced(
+        "chat.search", search_service.search_hybrid_async(question, query_vector=query_vector, **options)
+    ))
+    history = await history_task
+    turn = {"history": history, "query_vector": query_vector, "scope": None, "cached": None,
+            "messages": None, "prompt_tokens": None}
 
-# contador incremental para os pedaços
-chunk_index_counter = 0
+    # turnos que dependem do histórico ficam fora do cache, a menos que o cliente peça
+    if use_cache if use_cache is not None else not history:
+        turn["scope"] = answer_cache_scope(options)
+        with tracing.span("chat.answer_cache"):
+            cached = answer_cache.lookup(turn["scope"], query_vector)
+        if cached is not None:
+            search_task.cancel()
+            turn["cached"] = cached["answer"]
+            turn["sources"] = cached["sources"]
+            return turn
 
-# itera sobre cada bloco para criar embeddings
-for block in content_blocks:
-    if block.type == 'text':
-        text_content = block.content
+    results = await search_task
 
-        # divide o texto em pedaços menores para embeddings
-        chunks = [text_content[i:i+1000] for i in range(0, len(text_content), 1000)]
+    # o contexto fica com até PROMPT_CONTEXT_TOKENS e o histórico com o que sobra do limite;
+    # os tokens do histórico já estão contados na sessão, então só o contexto é codificado
+    with tracing.span("chat.context"):
+        base = prompt.base_tokens(question)
+        packed = prompt.pack_context(results, min(prompt.PROMPT_CONTEXT_TOKENS, max(MAX_CONTEXT_TOKENS - base, 0)))
+    history_budget = MAX_CONTEXT_TOKENS - base - packed["tokens"]
+    # inclui o resumo dos turnos antigos quando o histórico não cabe
+    history, history_tokens = await tracing.traced("chat.history_window", session_store.get_window(
+        session_id, max(history_budget, 0), openai.summarize_history_async if HISTORY_SUMMARY else None
+    ))
+    built = prompt.build_prompt(packed["context"], question, history, history_tokens)
 
-        for chunk in chunks:
-            chunk_embedding = openai.get_embedding(chunk)
-            if chunk_embedding:
-                doc = {
-                    "id": f"{source_doc_id}-{chunk_index_counter}",
-                    "content": chunk,
-                    "contentVector": chunk_embedding,
-                }
-                docs_to_upload.append(doc)
-                chunk_index_counter += 1
+    turn["history"] = history
+    turn["sources"] = describe_sources(packed["results"])
+    turn["messages"] = built["messages"]
+    turn["prompt_tokens"] = {**built["tokens"], "context": packed["tokens"]}
+    metrics.observe("chat_prompt_tokens", built["tokens"]["total"])
+    return turn
 
-    elif block.type == 'image' and block.image_bytes:
-        # gera legenda da imagem
-        caption_text = image_captioning.generate_caption_for_rag(
-            block.image_bytes, source_doc_id, block.page_number
+# guarda a resposta nova no cache semântico, se o turno usa o cache
+def remember_answer(turn: dict, question: str, answer: str, started: float):
+    if turn["scope"] is not None and answer:
+        answer_cache.store(
+            turn["scope"], turn["query_vector"], question, answer, turn["sources"],
+            time.perf_counter() - started
         )
 
-        if caption_text:
-            caption_embedding = openai.get_embedding(caption_text)
-            if caption_embedding:
-                doc = {
-                    "id": f"{source_doc_id}-img-{chunk_index_counter}",
-                    "content": caption_text,
-                    "contentVector": caption_embedding,
-                }
-                docs_to_upload.append(doc)
-                chunk_index_counter += 1
-
-# se nenhum embedding foi criado, lança erro
-if len(docs_to_upload) == 0:
-    raise ValueError(
-        "Nenhum embedding válido foi gerado. Verifique o PDF e a função get_embedding."
-    )
-
-# envia todos os embeddings gerados de texto e imagens e salva no azure search pronta para a ricerca sem.
-search_service.upload_documents(docs_to_upload)
-""" print(f"{len(docs_to_upload)} blocos enviados para o índice com sucesso!") """
-
-# define modelo Pydantic para a entrada
-class Question(BaseModel):
-    question: str
-    session_id: Optional[str] = None
-
 @app.post("/chat")
 async def chat(request: Question):
+    started = time.perf_counter()
     # recebe a pergunta do usuario
     question = request.question
     session_id = request.session_id or str(uuid.uuid4())
-    # carrega a cronologia 
-    history = blob_logs.load_session_history(session_id)
-    # recupera os documentos mais relevantes
-    context_docs = search_service.search_hibryd(question)
-    context = " ".join(context_docs)
-
-    system_message = {
-        "role": "system",
-        "content": (
-            "CRITICAL RULE: If the user message is a simple greeting in ANY language, respond with a polite greeting and short question. "
-            "Ignore RAG instructions for this turn.\n\n"
-            f"You are a RAG assistant. Respond ONLY based on the following context. "
-            f"If the answer is not explicitly in context, respond: 'The information was not found in the document.'\n\n"
-            f"Use conversation chronology:\n\n{context}"
-        )
+    with tracing.request("chat", session_id=session_id) as trace:
+        turn = await prepare_turn(question, session_id, request.retrieval, request.use_cache)
+
+        if turn["cached"] is not None:
+            answer = turn["cached"]
+        else:
+            # envia o contexto e todo o resto para chat gerar a resposta
+            answer = await tracing.traced("chat.completion", openai.chat_completion_async(turn["messages"]))
+            remember_answer(turn, question, answer, started)
+
+        # acrescenta o turno à sessão; só as mensagens novas vão para o blob storage
+        await tracing.traced("chat.session_save", session_store.append_turn(session_id, [
+            {"role": "user", "content": question},
+            {"role": "assistant", "content": answer},
+        ]))
+        trace["cached"] = turn["cached"] is not None
+        trace["prompt_tokens"] = (turn["prompt_tokens"] or {}).get("total")
+
+    return {
+        "answer": answer,
+        "session_id": session_id,
+        "sources": turn["sources"],
+        "cached": turn["cached"] is not None,
+        "prompt_tokens": turn["prompt_tokens"],
     }
 
-    current_tokens = openai.count_tokens([system_message] + history)
-    if current_tokens >= MAX_CONTEXT_TOKENS:
-        new_session_id = str(uuid.uuid4())
-        return {
-            "answer": "Limite de contexto alcançado. Inicie um novo chat. Histórico salvo.",
-            "session_id": new_session_id
-        }
-
-    # envia o contexto e todo o resto para chat gerar a resposta
-    answer = openai.chat_with_context(context, question, history)
-    history.append({"role": "user", "content": question})
-    history.append({"role": "assistant", "content": answer})
-    # salva o log da sessao mesmo nao tendo um banco de dados
-    blob_logs.save_session_and_log(session_id, history)
-
-    return {"answer": answer, "session_id": session_id}
+# formata um evento no padrão server-sent events
+def sse_event(event: str, data: dict) -> str:
+    return f"event: {event}\ndata: {json.dumps(data, ensure_ascii=False)}\n\n"
+
+# gera os pedaços da resposta: do cache vem tudo de uma vez, senão vem do modelo em streaming
+async def _answer_deltas(turn: dict):
+    if turn["cached"] is not None:
+        yield turn["cached"]
+        return
+    # se o cliente desconectar, o starlette cancela o gerador e o aclosing fecha
+    # a requisição ao azure openai, que para de gerar tokens
+    async with aclosing(openai.stream_chat_completion(turn["messages"])) as deltas:
+        async for delta in deltas:
+            yield delta
+
+# mesma lógica do /chat, mas a resposta é enviada em pedaços (sse) enquanto é gerada.
+# eventos: "session" (id da sessão), "delta" (texto) e "done" (resposta completa + tempos)
+@app.post("/chat/stream")
+async def chat_stream(request: Question, http_request: Request):
+    question = request.question
+    session_id = request.session_id or str(uuid.uuid4())
+
+    async def event_stream():
+        started = time.perf_counter()
+        with tracing.request("chat_stream", session_id=session_id) as trace:
+            turn = await prepare_turn(question, session_id, request.retrieval, request.use_cache)
+            trace["cached"] = turn["cached"] is not None
+            trace["prompt_tokens"] = (turn["prompt_tokens"] or {}).get("total")
+
+            yield sse_event("session", {"session_id": session_id, "sources": turn["sources"]})
+
+            parts = []
+            time_to_first_token = None
+            # o span da resposta inclui o envio dos pedaços ao cliente
+            completion_started = time.perf_counter()
+            with tracing.span("chat.completion", streaming=True):
+                async with aclosing(_answer_deltas(turn)) as deltas:
+                    async for delta in deltas:
+                        if time_to_first_token is None:
+                            time_to_first_token = time.perf_counter() - started
+                            metrics.observe("chat_time_to_first_token_seconds", time_to_first_token)
+                            tracing.record("chat.first_token", time.perf_counter() - completion_started)
+                        parts.append(delta)
+                        yield sse_event("delta", {"content": delta})
+                        if await http_request.is_disconnected():
+                            print(f"Client disconnesso, sessione {session_id} annullata.")
+                            trace["disconnected"] = True
+                            return
+
+            # com a resposta completa, salva a sessão como no /chat
+            answer = "".join(parts)
+            if turn["cached"] is None:
+                remember_answer(turn, question, answer, started)
+                openai.record_chat_tokens(trace["prompt_tokens"] or turn["messages"], answer)
+            await tracing.traced("chat.session_save", session_store.append_turn(session_id, [
+                {"role": "user", "content": question},
+                {"role": "assistant", "content": answer},
+            ]))
+
+            total = time.perf_counter() - started
+            metrics.observe("chat_stream_total_seconds", total)
+            yield sse_event("done", {
+                "answer": answer,
+                "session_id": session_id,
+                "cached": turn["cached"] is not None,
+                "prompt_tokens": turn["prompt_tokens"],
+                "time_to_first_token_ms": round((time_to_first_token or total) * 1000, 1),
+                "total_ms": round(total * 1000, 1),
+            })
+
+    return StreamingResponse(
+        event_stream(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    )
+
+# métricas do processo (tempo até o primeiro token, cache de respostas, etc.)
+@app.get("/stats")
+async def stats():
+    return {**metrics.summary(), "answer_cache": answer_cache.stats()}
+
+# as mesmas métricas no formato do prometheus: tempos por etapa (rag_stage_seconds), tokens,
+# chamadas ao openai, repetições e caches
+@app.get("/metrics")
+async def prometheus_metrics():
+    caches = {"answer": answer_cache.stats(), "embedding": embedding_cache.stats()}
+    return PlainTextResponse(metrics.render_prometheus(caches), media_type="text/plain; version=0.0.4")
+
+class IngestRequest(BaseModel):
+    blob_name: str
+
+# coloca um pdf do container na fila de ingestão
+@app.post("/ingest")
+async def submit_ingest(request: IngestRequest):
+    job = jobs.enqueue(jobs.INGEST_BLOB, {"blob_name": request.blob_name})
+    return job
+
+# tamanho máximo aceito no upload (padrão 1 GiB)
+UPLOAD_MAX_BYTES = int(os.getenv("UPLOAD_MAX_BYTES", str(1024 * 1024 * 1024)))
+
+# recebe um pdf no corpo da requisição (curl --data-binary @arquivo.pdf) e o envia ao container
+# enquanto ele chega, em blocos, sem guardar o arquivo na memória; depois coloca a ingestão na fila
+@app.post("/upload/{file_name}")
+async def upload_pdf(file_name: str, request: Request):
+    if not file_name.lower().endswith(".pdf"):
+        raise HTTPException(status_code=400, detail="Nome di file non valido: è accettato solo un PDF")
+
+    async def body():
+        received = 0
+        header = b""
+        async for chunk in request.stream():
+            received += len(chunk)
+            if received > UPLOAD_MAX_BYTES:
+                raise HTTPException(status_code=413, detail="File troppo grande")
+            if len(header) < 5:
+                header += chunk[:5 - len(header)]
+                if len(header) == 5 and header != b"%PDF-":
+                    raise HTTPException(status_code=400, detail="Il contenuto non è un PDF")
+            yield chunk
+        if len(header) < 5:
+            raise HTTPException(status_code=400, detail="Il contenuto non è un PDF")
+
+    uploaded = await blob_storage.upload_pdf_stream(file_name, body())
+    # o etag no payload faz cada versão enviada virar um job próprio, mesmo com outro em andamento
+    job = jobs.enqueue(jobs.INGEST_BLOB, {"blob_name": file_name, "etag": uploaded["etag"]})
+    return {**uploaded, "job": job}
+
+# consulta o estado de um job de ingestão
+@app.get("/ingest/{job_id}")
+async def ingest_status(job_id: str):
+    job = jobs.get(job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail="Job non trovato")
+    return job
 
 @app.get("/list_pdfs")
 async def list_pdfs():
@@ -0,0 +1,127 @@
+import os
+import time
+import threading
+from collections import OrderedDict
+import numpy as np
+from src import metrics
+
+# cache semântico de respostas: perguntas com embedding muito parecido (cosseno acima do
+# limiar) reaproveitam a resposta já gerada. as entradas ficam separadas por escopo
+# (índice + versão dos documentos), então uma nova ingestão invalida as respostas antigas
+ANSWER_CACHE_THRESHOLD = float(os.getenv("ANSWER_CACHE_THRESHOLD", "0.95"))
+ANSWER_CACHE_TTL_SECONDS = float(os.getenv("ANSWER_CACHE_TTL_SECONDS", "3600"))
+ANSWER_CACHE_MAX_ENTRIES = int(os.getenv("ANSWER_CACHE_MAX_ENTRIES", "1000"))
+
+_lock = threading.Lock()
+# escopo -> OrderedDict(chave -> entrada), na ordem lru (mais antiga primeiro)
+_scopes = {}
+# escopo -> (chaves, matriz de embeddings normalizados) reconstruída quando o escopo muda
+_matrices = {}
+_total_entries = 0
+_stats = {"hits": 0, "misses": 0, "saved_seconds": 0.0}
+
+
+def _normalize(embedding) -> np.ndarray:
+    vector = np.asarray(embedding, dtype=np.float32)
+    norm = np.linalg.norm(vector)
+    return vector / norm if norm else vector
+
+
+def _matrix(scope: str):
+    cached = _matrices.get(scope)
+    if cached is None:
+        entries = _scopes.get(scope) or {}
+        keys = list(entries.keys())
+        matrix = np.stack([entries[k]["embedding"] for k in keys]) if keys else None
+        cached = _matrices[scope] = (keys, matrix)
+    return cached
+
+
+def _remove(scope: str, key):
+    global _total_entries
+    entries = _scopes.get(scope)
+    if entries and key in entries:
+        del entries[key]
+        _total_entries -= 1
+        _matrices.pop(scope, None)
+        if not entries:
+            del _scopes[scope]
+
+
+# procura uma resposta para uma pergunta parecida; devolve a entrada ou None
+def lookup(scope: str, embedding, threshold: float = ANSWER_CACHE_THRESHOLD):
+    if embedding is None:
+        return None
+    query = _normalize(embedding)
+    now = time.time()
+
+    with _lock:
+        keys, matrix = _matrix(scope)
+        entry = None
+        if matrix is not None:
+            similarities = matrix @ query
+            best = int(np.argmax(similarities))
+            if similarities[best] >= threshold:
+                key = keys[best]
+                candidate = _scopes[scope][key]
+                if now - candidate["created_at"] > ANSWER_CACHE_TTL_SECONDS:
+                    _remove(scope, key)
+                else:
+                    _scopes[scope].move_to_end(key)
+                    candidate["last_used"] = now
+                    entry = candidate
+
+        if entry is None:
+            _stats["misses"] += 1
+        else:
+            _stats["hits"] += 1
+            _stats["saved_seconds"] += entry["latency"]
+
+    if entry is None:
+        metrics.increment("answer_cache_misses")
+        return None
+    metrics.increment("answer_cache_hits")
+    metrics.increment("answer_cache_saved_seconds", entry["latency"])
+    return entry
+
+
+# guarda a resposta gerada; latency é o tempo que ela custou (economizado em cada acerto)
+def store(scope: str, embedding, question: str, answer: str, sources: list, latency: float):
+    global _total_entries
+    if embedding is None:
+        return
+    with _lock:
+        entries = _scopes.setdefault(scope, OrderedDict())
+        key = question
+        if key in entries:
+            _remove(scope, key)
+            entries = _scopes.setdefault(scope, OrderedDict())
+        entries[key] = {
+            "embedding": _normalize(embedding),
+            "question": question,
+            "answer": answer,
+            "sources": sources,
+            "latency": latency,
+            "created_at": time.time(),
+            "last_used": time.time(),
+        }
+        _total_entries += 1
+        _matrices.pop(scope, None)
+
+        # evicção lru: remove a entrada usada há mais tempo entre todos os escopos.
+        # escopos de versões antigas dos documentos nunca mais são usados e saem primeiro
+        while _total_entries > ANSWER_CACHE_MAX_ENTRIES:
+            oldest_scope = min(
+                _scopes, key=lambda s: next(iter(_scopes[s].values()))["last_used"]
+            )
+            _remove(oldest_scope, next(iter(_scopes[oldest_scope])))
+
+
+def stats() -> dict:
+    with _lock:
+        lookups = _stats["hits"] + _stats["misses"]
+        return {
+            **_stats,
+            "hit_rate": _stats["hits"] / lookups if lookups else 0.0,
+            "entries": _total_entries,
+        }
@@ -1,32 +1,44 @@
-from azure.storage.blob import BlobServiceClient
 from azure.core.exceptions import ResourceNotFoundError
 import os, json
 from datetime import datetime, timezone
-
-blob_connection_string = os.getenv("AZURE_BLOB_CONNECT_STR")
-blob_service_client = BlobServiceClient.from_connection_string(blob_connection_string)
+# blob_storage registra os clientes do serviço ("blob" e "blob_async")
+from src import blob_storage, clients
 
 # container onde você quer guardar as respostas do chatbot
 log_container_name = os.getenv("AZURE_BLOB_LOGS_CONTAINER")
 
-#salva o histórico completo da sessão como o arquivo de memória e loga cada interação
-def save_session_and_log(session_id: str, history: list):
-    container_client = blob_service_client.get_container_client(log_container_name)
-    
-    # cria o nome do blob de memoria, usando o id da sessão
-    blob_name = f"session_memory/{session_id}.json"
-    blob_client = container_client.get_blob_client(blob_name)
-    
-    # prepara o objeto completo para salvar
+# referências ao container de logs, criadas uma vez sobre os clientes do serviço de blob_storage
+clients.register("blob_logs_container", lambda: clients.get("blob").get_container_client(log_container_name))
+clients.register("blob_logs_container_async", lambda: clients.get("blob_async").get_container_client(log_container_name))
+
+
+def container_client():
+    return clients.get("blob_logs_container")
+
+
+# versão assíncrona, usada pelo /chat e pelo session_store
+def async_container_client():
+    return clients.get("blob_logs_container_async")
+
+# prepara o objeto completo da sessão para salvar
+def _session_payload(session_id: str, history: list) -> str:
     log_data = {
         "timestamp": datetime.now(timezone.utc).isoformat(),
         "session_id": session_id,
         "history": history
     }
+    return json.dumps(log_data, indent=2)
+
+#salva o histórico completo da sessão como o arquivo de memória e loga cada interação
+def save_session_and_log(session_id: str, history: list):
+    
+    # cria o nome do blob de memoria, usando o id da sessão
+    blob_name = f"session_memory/{session_id}.json"
+    blob_client = container_client().get_blob_client(blob_name)
 
     # salva o estado atual da sessão isto garante a persistência
     try:
-        blob_client.upload_blob(json.dumps(log_data, indent=2), overwrite=True)
+        blob_client.upload_blob(_session_payload(session_id, history), overwrite=True)
         print(f"Sessione salvata e mantenuta: {blob_name}")
     except Exception as e:
         print(f"Errore durante il salvataggio della sessione in Blob Storage: {e}")
@@ -37,9 +49,8 @@ def load_session_history(session_id: str) -> list:
     if not session_id:
         return []
         
-    container_client = blob_service_client.get_container_client(log_container_name)
     blob_name = f"session_memory/{session_id}.json"
-    blob_client = container_client.get_blob_client(blob_name)
+    blob_client = container_client().get_blob_client(blob_name)
     
     try:
         # tenta baixar o conteúdo do blob
@@ -55,4 +66,35 @@ def load_session_history(session_id: str) -> list:
         return []
     except Exception as e:
         print(f"Errore durante il caricamento della sessione {session_id}: {e}")
-        return []
\ No newline at end of file
+        return []
+
+
+# versões assíncronas usadas pelo /chat
+async def save_session_and_log_async(session_id: str, history: list):
+    blob_name = f"session_memory/{session_id}.json"
+    blob_client = async_container_client().get_blob_client(blob_name)
+
+    try:
+        await blob_client.upload_blob(_session_payload(session_id, history), overwrite=True)
+        print(f"Sessione salvata e mantenuta: {blob_name}")
+    except Exception as e:
+        print(f"Errore durante il salvataggio della sessione in Blob Storage: {e}")
+
+
+async def load_session_history_async(session_id: str) -> list:
+    if not session_id:
+        return []
+
+    blob_name = f"session_memory/{session_id}.json"
+    blob_client = async_container_client().get_blob_client(blob_name)
+
+    try:
+        download_stream = await blob_client.download_blob()
+        data = json.loads((await download_stream.readall()).decode('utf-8'))
+        return data.get("history", [])
+    except ResourceNotFoundError:
+        print(f"Sessione {session_id} non trovato. Avvio di una nuova sessione.")
+        return []
+    except Exception as e:
+        print(f"Errore durante il caricamento della sessione {session_id}: {e}")
+        return []
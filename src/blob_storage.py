@@ -1,44 +1,117 @@
 from dotenv import load_dotenv
 load_dotenv()
 import os
-from azure.storage.blob import BlobServiceClient
+import base64
+import asyncio
+from azure.storage.blob import BlobServiceClient, ContentSettings
+from azure.storage.blob.aio import BlobServiceClient as AsyncBlobServiceClient
 from azure.core.exceptions import ResourceExistsError
+from src import clients
 
 
 # parte responsavel por controlar tudo da storage
 blob_connection = os.getenv("AZURE_BLOB_CONNECT_STR")
 blob_container = os.getenv("AZURE_BLOB_CONTAINER")
 
-blob_service_client = BlobServiceClient.from_connection_string(blob_connection)
-# tenta criar o container se ele não existir
-try:
-    container_client = blob_service_client.create_container(blob_container)
-    print(f"contenitore '{blob_container}' creato con successo o già esistente.")
-except ResourceExistsError:
-    # se já existir, apenas obtém a referência
-    container_client = blob_service_client.get_container_client(blob_container)
-    print(f"contenitore '{blob_container}' esiste già. Connessione stabilita.")
-except Exception as e:
-    print(f"Errore durante la connessione o la creazione del contenitore: {e}")
-    # se houver outro erro, o código principal irá falhar.
-    raise
+# envio em blocos: tamanho de cada bloco e quantos blocos sobem ao mesmo tempo
+BLOB_BLOCK_SIZE = int(os.getenv("BLOB_BLOCK_SIZE", str(4 * 1024 * 1024)))
+BLOB_UPLOAD_CONCURRENCY = int(os.getenv("BLOB_UPLOAD_CONCURRENCY", "4"))
+
+# clientes do serviço (também usados por blob_logs), criados no primeiro uso (src/clients.py)
+clients.register("blob", lambda: BlobServiceClient.from_connection_string(
+    blob_connection, transport=clients.azure_transport()))
+clients.register("blob_async", lambda: AsyncBlobServiceClient.from_connection_string(
+    blob_connection, transport=clients.azure_async_transport()))
+
+
+# cria o container se ele não existir e devolve a referência
+def _ensure_container(name: str):
+    blob_service_client = clients.get("blob")
+    try:
+        container_client = blob_service_client.create_container(name)
+        print(f"contenitore '{name}' creato con successo o già esistente.")
+    except ResourceExistsError:
+        # se já existir, apenas obtém a referência
+        container_client = blob_service_client.get_container_client(name)
+        print(f"contenitore '{name}' esiste già. Connessione stabilita.")
+    except Exception as e:
+        print(f"Errore durante la connessione o la creazione del contenitore: {e}")
+        # se houver outro erro, o código principal irá falhar.
+        raise
+    return container_client
+
+clients.register("blob_container", lambda: _ensure_container(blob_container))
+clients.register("blob_chunk_container", lambda: _ensure_container("chunk"))
+
+
+# container dos pdfs; criado (se preciso) na primeira vez que é usado
+def container_client():
+    return clients.get("blob_container")
 
 #função responsavel por enviar o arquivo pdf do computador para a pasta container no azure 
 def upload_pdf(file_name: str, data: bytes):
-    blob_client = container_client.get_blob_client(file_name)
+    blob_client = container_client().get_blob_client(file_name)
     blob_client.upload_blob(data, overwrite=True)
     return f"Uploaded {file_name}"
 
+# envia um arquivo que chega aos pedaços (iterador assíncrono de bytes, ex.: o corpo da
+# requisição) como blob de blocos: cada bloco de BLOB_BLOCK_SIZE sobe assim que fica completo,
+# até BLOB_UPLOAD_CONCURRENCY ao mesmo tempo, e a lista de blocos é confirmada no fim. a
+# memória usada fica em torno de (BLOB_UPLOAD_CONCURRENCY + 1) blocos, seja qual for o tamanho
+async def upload_pdf_stream(file_name: str, chunks) -> dict:
+    blob_client = clients.get("blob_async").get_blob_client(blob_container, file_name)
+    slots = asyncio.Semaphore(BLOB_UPLOAD_CONCURRENCY)
+    block_ids = []
+    uploads = []
+    buffer = bytearray()
+    size = 0
+
+    async def stage(block_id: str, data: bytes):
+        try:
+            await blob_client.stage_block(block_id, data, length=len(data))
+        finally:
+            slots.release()
+
+    async def submit(data: bytes):
+        await slots.acquire()
+        # um bloco que falhou interrompe o envio em vez de esperar o arquivo inteiro chegar
+        for upload in uploads:
+            if upload.done() and upload.exception():
+                slots.release()
+                raise upload.exception()
+        # os ids dos blocos precisam ter o mesmo tamanho dentro do blob
+        block_id = base64.b64encode(f"{len(block_ids):08d}".encode()).decode()
+        block_ids.append(block_id)
+        uploads.append(asyncio.create_task(stage(block_id, data)))
+
+    try:
+        async for chunk in chunks:
+            buffer += chunk
+            size += len(chunk)
+            while len(buffer) >= BLOB_BLOCK_SIZE:
+                await submit(bytes(buffer[:BLOB_BLOCK_SIZE]))
+                del buffer[:BLOB_BLOCK_SIZE]
+        if buffer:
+            await submit(bytes(buffer))
+        await asyncio.gather(*uploads)
+    except BaseException:
+        # blocos não confirmados são descartados pelo serviço; o blob anterior fica intacto
+        for upload in uploads:
+            upload.cancel()
+        raise
+
+    result = await blob_client.commit_block_list(
+        block_ids, content_settings=ContentSettings(content_type="application/pdf")
+    )
+    print(f"Caricato {file_name}: {size} byte in {len(block_ids)} blocchi.")
+    return {"blob_name": file_name, "size": size, "blocks": len(block_ids), "etag": result.get("etag")}
+
 # função para salvar um chunk no container 'chunk'
 def upload_chunk(file_name: str, data: bytes):
     try:
-        # conecta no container 'chunk', cria se não existir
-        chunk_container_name = "chunk"
-        try:
-            chunk_container_client = blob_service_client.create_container(chunk_container_name)
-        except ResourceExistsError:
-            chunk_container_client = blob_service_client.get_container_client(chunk_container_name)
-        
+        # container 'chunk', criado na primeira vez que é usado
+        chunk_container_client = clients.get("blob_chunk_container")
+
         # cria o blob client e faz o upload
         blob_client = chunk_container_client.get_blob_client(file_name)
         blob_client.upload_blob(data, overwrite=True)
@@ -52,4 +125,11 @@ def upload_chunk(file_name: str, data: bytes):
 
 #mostra arquivos que se encontram no container 
 def list_pdfs():
-    return [b.name for b in container_client.list_blobs()]
\ No newline at end of file
+    return [b.name for b in container_client().list_blobs()]
+
+
+# pdfs do container (opcionalmente só os que começam com prefix) com o etag de cada um
+def list_pdf_blobs(prefix: str = None):
+    for blob in container_client().list_blobs(name_starts_with=prefix):
+        if blob.name.lower().endswith(".pdf"):
+            yield blob.name, blob.etag
@@ -0,0 +1,307 @@
+import os
+import re
+import json
+import math
+import pickle
+import threading
+import unicodedata
+from array import array
+from collections import Counter
+import numpy as np
+from src.file_lock import file_lock
+
+# índice invertido bm25 local para a busca por palavras-chave.
+# as postings de cada termo são dois arrays compactos (ids das linhas em uint32 e
+# frequências em uint16); o estado é salvo num snapshot + um log de operações incremental,
+# compartilhados entre o processo que escreve (o worker) e os que buscam (a api)
+
+K1 = 1.2
+B = 0.75
+# quantas operações no log antes de gravar um novo snapshot
+SNAPSHOT_EVERY = 5000
+
+# palavras muito frequentes em português, italiano e inglês, sem acentos (como o tokenizador as deixa)
+STOPWORDS = set("""
+a o e é as os um uma uns umas de do da dos das no na nos nas em por para com sem que se
+ao aos ou mas como mais menos ja nao sim sua seu suas seus ele ela eles elas isso este esta
+il lo la i gli le un uno una di del della dei degli delle nel nella nei nelle con per tra fra
+che non si ma come piu anche sono e' ed al alla ai agli alle dal dalla dai questo questa
+the an of and or to in on at for with by from is are was were be been it its this that these
+those as not but if then than so such into about
+""".split())
+
+_TOKEN_PATTERN = re.compile(r"[a-z0-9]+")
+
+
+# minúsculas, sem acentos (ação -> acao, città -> citta), sem stopwords
+def tokenize(text: str) -> list:
+    normalized = unicodedata.normalize("NFKD", text.lower())
+    normalized = "".join(c for c in normalized if not unicodedata.combining(c))
+    return [
+        token for token in _TOKEN_PATTERN.findall(normalized)
+        if token not in STOPWORDS and (len(token) > 1 or token.isdigit())
+    ]
+
+
+class BM25Index:
+    def __init__(self, directory: str):
+        self.directory = directory
+        self.snapshot_path = os.path.join(directory, "bm25.pkl")
+        self.log_path = os.path.join(directory, "bm25.jsonl")
+        # trocado a cada snapshot (que também recomeça o log): quem lê recarrega tudo
+        self.generation_path = os.path.join(directory, "bm25.generation")
+        self.lock_path = os.path.join(directory, "bm25.lock")
+        self._lock = threading.RLock()
+        self._reset()
+        self.generation = None
+        self._log_stat = None           # (inode, tamanho, mtime) do log na última leitura
+        os.makedirs(directory, exist_ok=True)
+        with self._lock, file_lock(self.lock_path, shared=True):
+            self._catch_up()
+
+    def _reset(self):
+        self.rows = []                  # metadados por linha (None quando removida)
+        self.row_by_id = {}
+        self.doc_lengths = array("I")
+        self.deleted = bytearray()      # 1 para as linhas removidas (tombstones)
+        self.postings = {}              # termo -> (array("I") linhas, array("H") frequências)
+        # termo -> linhas vivas com o termo; as postings guardam também as removidas até a
+        # compactação, e o idf conta só as vivas
+        self.document_frequency = Counter()
+        self.total_length = 0           # soma dos tamanhos das linhas vivas
+        self._log_entries = 0
+        self._log_offset = 0            # bytes do log já aplicados
+
+    # como no índice vetorial, o worker escreve e a api lê: quem escreve segura a trava
+    # exclusiva do arquivo; quem lê confere o log com um stat antes de cada busca e aplica só
+    # as linhas novas, sem esperar se houver uma escrita em andamento
+    def _refresh(self):
+        try:
+            stat = os.stat(self.log_path)
+            current = (stat.st_ino, stat.st_size, stat.st_mtime_ns)
+        except FileNotFoundError:
+            current = None
+        if current == self._log_stat:
+            return
+        with self._lock, file_lock(self.lock_path, shared=True, blocking=False) as locked:
+            if locked:
+                self._catch_up()
+
+    # aplica o que mudou desde a última leitura; chamado com a trava do arquivo
+    def _catch_up(self):
+        generation = self._read_generation()
+        try:
+            stat = os.stat(self.log_path)
+        except FileNotFoundError:
+            stat = None
+        previous = self._log_stat
+        if generation != self.generation or stat is None or previous is None or \
+                stat.st_ino != previous[0] or stat.st_size < self._log_offset:
+            # snapshot novo, índice apagado ou primeira leitura: recomeça do snapshot
+            self._reset()
+            self._load_snapshot()
+            self.generation = generation
+        if stat is not None and stat.st_size > self._log_offset:
+            with open(self.log_path, "rb") as log:
+                log.seek(self._log_offset)
+                data = log.read(stat.st_size - self._log_offset)
+            # só linhas completas; uma linha pela metade fica para a próxima leitura
+            complete = data[:data.rfind(b"\n") + 1]
+            for line in complete.splitlines():
+                if not line.strip():
+                    continue
+                entry = json.loads(line)
+                if entry["op"] == "add":
+                    self._add(entry["doc"])
+                elif entry["op"] == "del":
+                    self._remove(entry["id"])
+                self._log_entries += 1
+            self._log_offset += len(complete)
+        self._log_stat = (stat.st_ino, stat.st_size, stat.st_mtime_ns) if stat is not None else None
+
+    def _load_snapshot(self):
+        if not os.path.exists(self.snapshot_path):
+            return
+        with open(self.snapshot_path, "rb") as snapshot:
+            state = pickle.load(snapshot)
+        self.rows = state["rows"]
+        self.doc_lengths = state["doc_lengths"]
+        self.postings = state["postings"]
+        self.deleted = bytearray(1 if doc is None else 0 for doc in self.rows)
+        self.row_by_id = {doc["id"]: row for row, doc in enumerate(self.rows) if doc is not None}
+        self.total_length = sum(self.doc_lengths[row] for row in self.row_by_id.values())
+        deleted = np.frombuffer(bytes(self.deleted), dtype=bool)
+        self.document_frequency = Counter({
+            term: count for term, (row_ids, _) in self.postings.items()
+            if (count := int(np.count_nonzero(~deleted[np.frombuffer(row_ids, dtype=np.uint32)])))
+        })
+
+    def _read_generation(self) -> int:
+        try:
+            with open(self.generation_path, "r") as f:
+                return int(f.read().strip() or 0)
+        except (FileNotFoundError, ValueError):
+            return 0
+
+    def __len__(self):
+        return len(self.row_by_id)
+
+    def _add(self, doc: dict):
+        self._remove(doc["id"])
+        row = len(self.rows)
+        terms = Counter(tokenize(doc.get("content") or ""))
+        for term, frequency in terms.items():
+            entry = self.postings.get(term)
+            if entry is None:
+                entry = self.postings[term] = (array("I"), array("H"))
+            entry[0].append(row)
+            entry[1].append(min(frequency, 65535))
+        self.document_frequency.update(terms.keys())
+        length = sum(terms.values())
+        self.rows.append(doc)
+        self.row_by_id[doc["id"]] = row
+        self.doc_lengths.append(length)
+        self.deleted.append(0)
+        self.total_length += length
+
+    def _remove(self, doc_id: str):
+        row = self.row_by_id.pop(doc_id, None)
+        if row is None:
+            return False
+        self.document_frequency.subtract(set(tokenize(self.rows[row].get("content") or "")))
+        self.rows[row] = None
+        self.deleted[row] = 1
+        self.total_length -= self.doc_lengths[row]
+        return True
+
+    # grava as operações no log com a trava exclusiva, depois de alcançar o que outros
+    # processos escreveram; o estado em memória é atualizado relendo o próprio log
+    def _write(self, make_entries):
+        with self._lock, file_lock(self.lock_path):
+            self._catch_up()
+            entries = make_entries()
+            if not entries:
+                return
+            with open(self.log_path, "a", encoding="utf-8") as log:
+                log.write("".join(json.dumps(entry, ensure_ascii=False) + "\n" for entry in entries))
+            self._catch_up()
+            if self._log_entries >= SNAPSHOT_EVERY:
+                self._save()
+
+    # grava o snapshot completo e recomeça o log
+    def save(self):
+        with self._lock, file_lock(self.lock_path):
+            self._catch_up()
+            self._save()
+
+    # com a trava exclusiva: snapshot e log vazio entram por os.replace (quem ainda lê os
+    # arquivos antigos não é afetado) e a geração nova avisa os outros processos. se o processo
+    # cair entre os passos, as operações do log são reaplicadas sobre o snapshot sem efeito
+    def _save(self):
+        temporary = self.snapshot_path + ".tmp"
+        with open(temporary, "wb") as snapshot:
+            pickle.dump(
+                {"rows": self.rows, "doc_lengths": self.doc_lengths, "postings": self.postings},
+                snapshot, protocol=pickle.HIGHEST_PROTOCOL
+            )
+        os.replace(temporary, self.snapshot_path)
+        open(self.log_path + ".tmp", "w").close()
+        os.replace(self.log_path + ".tmp", self.log_path)
+        generation = self._read_generation() + 1
+        with open(self.generation_path + ".tmp", "w") as f:
+            f.write(str(generation))
+        os.replace(self.generation_path + ".tmp", self.generation_path)
+        # o estado em memória já é o do snapshot: só passa a acompanhar o log novo
+        stat = os.stat(self.log_path)
+        self.generation = generation
+        self._log_entries = self._log_offset = 0
+        self._log_stat = (stat.st_ino, stat.st_size, stat.st_mtime_ns)
+
+    # adiciona (ou substitui, pelo id) documentos; só o texto e os metadados são usados
+    def upsert(self, docs: list):
+        self._write(lambda: [
+            {"op": "add", "doc": {k: v for k, v in doc.items() if k != "contentVector"}} for doc in docs
+        ])
+
+    def delete(self, ids):
+        self._write(lambda: [
+            {"op": "del", "id": doc_id} for doc_id in dict.fromkeys(ids) if doc_id in self.row_by_id
+        ])
+
+    # reconstrói as postings só com as linhas vivas
+    def compact(self):
+        with self._lock, file_lock(self.lock_path):
+            self._catch_up()
+            docs = [doc for doc in self.rows if doc is not None]
+            self.rows, self.row_by_id, self.doc_lengths = [], {}, array("I")
+            self.deleted = bytearray()
+            self.postings, self.document_frequency, self.total_length = {}, Counter(), 0
+            for doc in docs:
+                self._add(doc)
+            self._save()
+
+    def tombstone_ratio(self) -> float:
+        return 1 - len(self.row_by_id) / len(self.rows) if self.rows else 0.0
+
+    # top k por bm25. os termos são processados do mais para o menos relevante (limite
+    # superior idf * (k1 + 1)); quando nem a soma dos termos restantes consegue colocar um
+    # documento ainda não visto no top k, os termos restantes só atualizam os candidatos.
+    # com filtro a terminação antecipada é desligada, já que o top k depende do filtro
+    def search(self, query: str, top: int = 5, filter_fn=None) -> list:
+        self._refresh()
+        with self._lock:
+            rows = self.rows
+            live = len(self.row_by_id)
+            if live == 0:
+                return []
+            lengths = np.frombuffer(self.doc_lengths, dtype=np.uint32)[:len(rows)].astype(np.float32)
+            average_length = self.total_length / live if live else 1.0
+
+            terms = []
+            for term in set(tokenize(query)):
+                entry = self.postings.get(term)
+                frequency = self.document_frequency.get(term, 0)
+                if entry is None or frequency <= 0:
+                    continue
+                idf = math.log(1 + (live - frequency + 0.5) / (frequency + 0.5))
+                terms.append((idf * (K1 + 1), idf, entry))
+            if not terms:
+                return []
+            terms.sort(key=lambda t: t[0], reverse=True)
+
+            deleted = np.frombuffer(bytes(self.deleted), dtype=bool)
+            scores = np.zeros(len(rows), dtype=np.float32)
+            seen = np.zeros(len(rows), dtype=bool)
+            norm = K1 * (1 - B + B * lengths / max(average_length, 1e-9))
+            remaining = sum(t[0] for t in terms)
+            only_seen = False
+
+            for bound, idf, (row_ids, frequencies) in terms:
+                remaining -= bound
+                ids = np.frombuffer(row_ids, dtype=np.uint32)
+                tf = np.frombuffer(frequencies, dtype=np.uint16).astype(np.float32)
+                if only_seen:
+                    keep = seen[ids]
+                    ids, tf = ids[keep], tf[keep]
+                scores[ids] += idf * tf * (K1 + 1) / (tf + norm[ids])
+                seen[ids] = True
+
+                # terminação antecipada: o k-ésimo melhor já supera tudo que falta somar
+                if filter_fn is None and not only_seen and remaining > 0:
+                    live_scores = scores[seen & ~deleted]
+                    if len(live_scores) >= top:
+                        kth = np.partition(live_scores, -top)[-top]
+                        only_seen = kth > remaining
+                # libera as views sobre os arrays das postings, que precisam continuar redimensionáveis
+                del ids, tf
+
+            candidates = np.flatnonzero(seen & ~deleted)
+            if filter_fn is not None:
+                candidates = np.array([row for row in candidates if filter_fn(rows[row])], dtype=np.int64)
+            if len(candidates) == 0:
+                return []
+            candidate_scores = scores[candidates]
+            take = min(top, len(candidates))
+            best = np.argpartition(-candidate_scores, take - 1)[:take]
+            best = best[np.argsort(-candidate_scores[best])]
+            return [{**rows[candidates[i]], "score": float(candidate_scores[i])} for i in best]
@@ -0,0 +1,72 @@
+import os
+import glob
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from src import blob_storage, ingest
+
+# ingestão em massa: todos os pdfs de um container (ou de uma pasta local) passam pelo
+# pipeline download -> extração -> chunks -> embeddings -> envio, vários documentos ao mesmo
+# tempo. os limites de cada etapa ficam em ingest.STAGE_LIMITS; aqui só se limita quantos
+# documentos estão em andamento. é retomável: documentos já ingeridos com o mesmo etag são
+# pulados pelo manifesto, então uma execução interrompida continua de onde parou
+BULK_INGEST_CONCURRENCY = int(os.getenv("BULK_INGEST_CONCURRENCY", "4"))
+
+
+# pdfs do container: (source, função que ingere o documento)
+def iter_container_sources(prefix: str = None):
+    for name, etag in blob_storage.list_pdf_blobs(prefix):
+        yield name, lambda name=name, etag=etag: ingest.ingest_blob(name, etag)
+
+
+# pdfs de uma pasta local (inclusive subpastas); o source é o caminho relativo à pasta
+def iter_local_sources(directory: str):
+    for path in sorted(glob.glob(os.path.join(directory, "**", "*.pdf"), recursive=True)):
+        source = os.path.relpath(path, directory).replace(os.sep, "/")
+        yield source, lambda path=path, source=source: ingest.ingest_file(path, source)
+
+
+# ingere todas as fontes e imprime o progresso de cada documento e a vazão total
+def run_bulk(sources, concurrency: int = None) -> dict:
+    sources = list(sources)
+    total = len(sources)
+    summary = {"documents": total, "updated": 0, "unchanged": 0, "failed": 0, "pages": 0, "chunks": 0,
+               "stages": {}}
+    failures = []
+    print(f"Ingestione di {total} PDF ({concurrency or BULK_INGEST_CONCURRENCY} documenti in parallelo)...")
+
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency or BULK_INGEST_CONCURRENCY) as executor:
+        futures = {executor.submit(task): source for source, task in sources}
+        for done, future in enumerate(as_completed(futures), start=1):
+            source = futures[future]
+            try:
+                report = future.result()
+            except Exception as e:
+                summary["failed"] += 1
+                failures.append({"source": source, "error": str(e)})
+                print(f"[{done}/{total}] {source}: errore: {e}")
+                continue
+            summary[report["status"]] += 1
+            summary["pages"] += report.get("pages", 0)
+            summary["chunks"] += report["upserted"]
+            for stage, seconds in report.get("stages", {}).items():
+                summary["stages"][stage] = summary["stages"].get(stage, 0.0) + seconds
+            print(f"[{done}/{total}] {source}: {report['status']}, {report.get('pages', 0)} pagine, "
+                  f"{report['upserted']} chunk in {report['seconds']:.1f}s")
+    elapsed = time.perf_counter() - started
+
+    summary.update({
+        "seconds": elapsed,
+        "pages_per_second": summary["pages"] / elapsed if elapsed else 0.0,
+        "chunks_per_second": summary["chunks"] / elapsed if elapsed else 0.0,
+        "failures": failures,
+    })
+    print(f"Ingestione completata in {elapsed:.1f}s: {summary['updated']} aggiornati, "
+          f"{summary['unchanged']} invariati, {summary['failed']} errori; "
+          f"{summary['pages_per_second']:.1f} pagine/s, {summary['chunks_per_second']:.1f} chunk/s.")
+    if summary["stages"]:
+        # somas entre documentos: com documentos em paralelo podem passar do tempo total
+        print("Tempo per fase: " + ", ".join(
+            f"{stage} {seconds:.1f}s" for stage, seconds in sorted(summary["stages"].items())
+        ) + ".")
+    return summary
@@ -0,0 +1,34 @@
+import os
+import hashlib
+from src.sqlite_cache import SqliteCache
+
+# cache persistente das legendas geradas pelo modelo de visão, endereçado pelo hash da
+# imagem + versão do prompt + deployment. a mesma imagem em outra ingestão ou em outro
+# pdf reaproveita a legenda; mudar o prompt (versão) gera legendas novas
+cache_path = os.getenv("CAPTION_CACHE_PATH", ".cache/captions.sqlite")
+# tamanho máximo das legendas guardadas, acima disso as menos usadas recentemente são removidas
+cache_max_bytes = int(os.getenv("CAPTION_CACHE_MAX_BYTES", str(64 * 1024 * 1024)))
+
+_cache = SqliteCache(cache_path, "captions", "caption", cache_max_bytes)
+
+
+def image_hash(image_bytes: bytes) -> str:
+    return hashlib.sha256(image_bytes).hexdigest()
+
+
+# chave do cache: deployment + versão do prompt + hash da imagem
+def make_key(deployment: str, prompt_version: str, digest: str) -> str:
+    return f"{deployment}:{prompt_version}:{digest}"
+
+
+def get(key: str):
+    return _cache.get(key)
+
+
+def put(key: str, caption: str):
+    _cache.put(key, caption)
+
+
+# estatísticas de acerto/erro e tamanho do cache
+def stats() -> dict:
+    return _cache.stats()
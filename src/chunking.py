@@ -0,0 +1,138 @@
+import os
+import re
+from src import openai
+
+# divisão dos blocos extraídos do pdf em chunks para o índice. blocos de texto vizinhos da
+# mesma página são juntados até CHUNK_TARGET_TOKENS; blocos maiores são cortados em fim de
+# frase, repetindo as últimas frases (CHUNK_OVERLAP_TOKENS) no começo do chunk seguinte
+CHUNK_TARGET_TOKENS = int(os.getenv("CHUNK_TARGET_TOKENS", "400"))
+CHUNK_OVERLAP_TOKENS = int(os.getenv("CHUNK_OVERLAP_TOKENS", "50"))
+# versão da regra de divisão: entra na impressão digital do manifesto, então mudar a
+# regra ou os tamanhos faz os documentos serem divididos de novo na próxima ingestão
+CHUNKING_VERSION = "2"
+
+_SENTENCE_END = re.compile(r"(?<=[.!?;:])\s+|\n+")
+
+
+def split_sentences(text: str) -> list:
+    return [s for s in _SENTENCE_END.split(text) if s.strip()]
+
+
+# identifica a configuração atual da divisão
+def signature() -> str:
+    return f"chunking-v{CHUNKING_VERSION}-{CHUNK_TARGET_TOKENS}-{CHUNK_OVERLAP_TOKENS}"
+
+
+# corta uma frase maior que o alvo em pedaços de palavras inteiras
+def _split_long(sentence: str, target: int):
+    words = sentence.split()
+    piece = []
+    piece_tokens = 0
+    for word in words:
+        tokens = openai.text_tokens(word) + 1
+        if piece and piece_tokens + tokens > target:
+            yield " ".join(piece), piece_tokens
+            piece = []
+            piece_tokens = 0
+        piece.append(word)
+        piece_tokens += tokens
+    if piece:
+        yield " ".join(piece), piece_tokens
+
+
+# unidades (texto, tokens) de um bloco: o bloco inteiro se couber no alvo, senão suas frases
+def _units(text: str, target: int):
+    tokens = openai.text_tokens(text)
+    if tokens <= target:
+        yield text, tokens
+        return
+    for sentence in split_sentences(text):
+        sentence_tokens = openai.text_tokens(sentence)
+        if sentence_tokens <= target:
+            yield sentence, sentence_tokens
+        else:
+            yield from _split_long(sentence, target)
+
+
+# unidades são (texto, tokens, separador): frases do mesmo bloco ficam na mesma linha
+# e cada bloco começa numa linha nova
+def _chunk(units: list, page_number: int, block_type: str) -> dict:
+    return {
+        "content": "".join(sep + text for text, _, sep in units).strip(),
+        "tokens": sum(unit[1] for unit in units),
+        "page_number": page_number,
+        "type": block_type,
+    }
+
+
+# gerador de chunks {"content", "tokens", "page_number", "type"} a partir dos blocos de
+# texto e tabela, na ordem em que chegam (imagens são ignoradas aqui). tabelas não são
+# misturadas com texto, para que o cabeçalho fique junto do conteúdo
+def chunk_blocks(blocks, target: int = CHUNK_TARGET_TOKENS, overlap: int = CHUNK_OVERLAP_TOKENS):
+    units = []
+    units_tokens = 0
+    page_number = None
+
+    for block in blocks:
+        if block.type not in ("text", "table") or not block.content.strip():
+            continue
+
+        # mudou de página ou chegou uma tabela: fecha o chunk atual sem sobreposição
+        if units and (block.page_number != page_number or block.type == "table"):
+            yield _chunk(units, page_number, "text")
+            units = []
+            units_tokens = 0
+        page_number = block.page_number
+
+        if block.type == "table":
+            table_units = []
+            table_tokens = 0
+            for text, tokens in _units(block.content.strip(), target):
+                if table_units and table_tokens + tokens > target:
+                    yield _chunk(table_units, page_number, "table")
+                    table_units = []
+                    table_tokens = 0
+                # linhas da tabela continuam em linhas separadas
+                table_units.append((text, tokens, "\n"))
+                table_tokens += tokens
+            if table_units:
+                yield _chunk(table_units, page_number, "table")
+            continue
+
+        for i, (text, tokens) in enumerate(_units(block.content.strip(), target)):
+            if units and units_tokens + tokens > target:
+                yield _chunk(units, page_number, "text")
+                # repete as últimas unidades até overlap tokens, sem repetir o chunk inteiro
+                kept = []
+                kept_tokens = 0
+                for unit in reversed(units[1:]):
+                    if kept_tokens + unit[1] > overlap:
+                        break
+                    kept.insert(0, unit)
+                    kept_tokens += unit[1]
+                units = kept
+                units_tokens = kept_tokens
+            units.append((text, tokens, "\n" if i == 0 else " "))
+            units_tokens += tokens
+
+    if units:
+        yield _chunk(units, page_number, "text")
+
+
+# quantidade e distribuição de tamanho (em tokens) dos chunks de um documento
+def chunk_report(sizes: list) -> dict:
+    if not sizes:
+        return {"chunks": 0}
+    ordered = sorted(sizes)
+
+    def percentile(p: float) -> int:
+        return ordered[min(len(ordered) - 1, int(p * len(ordered)))]
+
+    return {
+        "chunks": len(ordered),
+        "tokens_total": sum(ordered),
+        "tokens_min": ordered[0],
+        "tokens_p50": percentile(0.5),
+        "tokens_p95": percentile(0.95),
+        "tokens_max": ordered[-1],
+    }
@@ -0,0 +1,148 @@
+import os
+import inspect
+import threading
+from typing import Callable
+
+# registro dos clientes externos (openai, search, blob, document intelligence). importar os
+# módulos não cria nada nem abre conexões: cada cliente é criado no primeiro get(), guardado
+# e reaproveitado, e fechado em close_all()/aclose_all() (shutdown da api, fim do worker).
+# todos os clientes de uma mesma biblioteca http dividem um único pool de conexões com
+# keep-alive, então as conexões tls abertas por um cliente servem aos outros
+#
+# conexões mantidas por host e no total, e por quanto tempo uma conexão ociosa fica aberta
+HTTP_POOL_MAXSIZE = int(os.getenv("HTTP_POOL_MAXSIZE", "32"))
+HTTP_MAX_CONNECTIONS = int(os.getenv("HTTP_MAX_CONNECTIONS", "100"))
+HTTP_KEEPALIVE_SECONDS = float(os.getenv("HTTP_KEEPALIVE_SECONDS", "60"))
+
+_lock = threading.RLock()
+_factories = {}
+# clientes já criados, na ordem de criação (fechados na ordem inversa)
+_instances = {}
+
+
+# registra como criar um cliente; chamado pelos módulos na importação, sem custo
+def register(name: str, factory: Callable):
+    _factories[name] = factory
+
+
+# o cliente com esse nome, criado na primeira chamada
+def get(name: str):
+    instance = _instances.get(name)
+    if instance is not None:
+        return instance
+    with _lock:
+        if name not in _instances:
+            _instances[name] = _factories[name]()
+        return _instances[name]
+
+
+# troca um cliente por outro objeto (substitutos dos benchmarks)
+def override(name: str, instance):
+    with _lock:
+        _instances[name] = instance
+
+
+# sessão do requests usada pelos clientes síncronos do azure, com o adaptador e a política
+# de repetições que o azure-core usaria (as repetições ficam com o pipeline do sdk)
+def _requests_session():
+    import requests
+    from urllib3.util.retry import Retry
+    try:
+        # o adaptador do azure-core lê o corpo em blocos de 32 KiB
+        from azure.core.pipeline.transport._bigger_block_size_http_adapters import BiggerBlockSizeHTTPAdapter as Adapter
+    except ImportError:
+        from requests.adapters import HTTPAdapter as Adapter
+    session = requests.Session()
+    adapter = Adapter(pool_connections=HTTP_POOL_MAXSIZE, pool_maxsize=HTTP_POOL_MAXSIZE,
+                      max_retries=Retry(total=False, redirect=False, raise_on_status=False))
+    session.mount("http://", adapter)
+    session.mount("https://", adapter)
+    return session
+
+
+# sessão do aiohttp dos clientes assíncronos do azure; criada dentro do event loop que a usa
+def _aiohttp_session():
+    import aiohttp
+    connector = aiohttp.TCPConnector(limit=HTTP_MAX_CONNECTIONS, limit_per_host=HTTP_POOL_MAXSIZE,
+                                     keepalive_timeout=HTTP_KEEPALIVE_SECONDS)
+    # mesmas opções da sessão que o azure-core criaria: sem cookies e sem descompressão
+    return aiohttp.ClientSession(connector=connector, trust_env=True, cookie_jar=aiohttp.DummyCookieJar(),
+                                 auto_decompress=False)
+
+
+def _httpx_limits():
+    import httpx
+    return httpx.Limits(max_connections=HTTP_MAX_CONNECTIONS, max_keepalive_connections=HTTP_POOL_MAXSIZE,
+                        keepalive_expiry=HTTP_KEEPALIVE_SECONDS)
+
+
+def _httpx_client():
+    import httpx
+    return httpx.Client(limits=_httpx_limits(), timeout=httpx.Timeout(600.0, connect=5.0))
+
+
+def _httpx_async_client():
+    import httpx
+    return httpx.AsyncClient(limits=_httpx_limits(), timeout=httpx.Timeout(600.0, connect=5.0))
+
+
+register("http.requests", _requests_session)
+register("http.aiohttp", _aiohttp_session)
+register("http.httpx", _httpx_client)
+register("http.httpx_async", _httpx_async_client)
+
+
+# transporte do pipeline do azure sobre a sessão compartilhada (cada cliente tem o seu, mas
+# a sessão e as conexões são as mesmas e não são fechadas junto com o cliente)
+def azure_transport():
+    from azure.core.pipeline.transport import RequestsTransport
+    return RequestsTransport(session=get("http.requests"), session_owner=False)
+
+
+def azure_async_transport():
+    from azure.core.pipeline.transport import AioHttpTransport
+    return AioHttpTransport(session=get("http.aiohttp"), session_owner=False)
+
+
+# clientes http para o sdk da openai
+def http_client():
+    return get("http.httpx")
+
+
+def async_http_client():
+    return get("http.httpx_async")
+
+
+def _pop_all() -> list:
+    with _lock:
+        instances = list(_instances.items())
+        _instances.clear()
+    # clientes primeiro, os pools compartilhados por último
+    return [instance for name, instance in reversed(instances) if not name.startswith("http.")] + \
+           [instance for name, instance in reversed(instances) if name.startswith("http.")]
+
+
+# fecha os clientes síncronos (processos sem event loop, como o worker)
+def close_all():
+    for instance in _pop_all():
+        close = getattr(instance, "close", None)
+        if close is None or inspect.iscoroutinefunction(close):
+            continue
+        try:
+            close()
+        except Exception as e:
+            print(f"Errore durante la chiusura del client {type(instance).__name__}: {e}")
+
+
+# fecha todos os clientes, síncronos e assíncronos (shutdown da api)
+async def aclose_all():
+    for instance in _pop_all():
+        close = getattr(instance, "aclose", None) or getattr(instance, "close", None)
+        if close is None:
+            continue
+        try:
+            result = close()
+            if inspect.isawaitable(result):
+                await result
+        except Exception as e:
+            print(f"Errore durante la chiusura del client {type(instance).__name__}: {e}")
@@ -0,0 +1,46 @@
+import os
+import hashlib
+import numpy as np
+from src.sqlite_cache import SqliteCache
+
+# cache persistente de embeddings em disco, endereçado pelo conteúdo (deployment + texto).
+# os vetores ficam guardados como blobs float32 no sqlite, e não como listas json
+cache_path = os.getenv("EMBEDDING_CACHE_PATH", ".cache/embeddings.sqlite")
+# tamanho máximo dos vetores guardados, acima disso os menos usados recentemente são removidos
+cache_max_bytes = int(os.getenv("EMBEDDING_CACHE_MAX_BYTES", str(512 * 1024 * 1024)))
+
+_cache = SqliteCache(cache_path, "embeddings", "vector", cache_max_bytes)
+
+
+# chave do cache: hash do deployment junto com o texto
+def make_key(deployment: str, text: str) -> str:
+    return hashlib.sha256(f"{deployment}\0{text}".encode("utf-8")).hexdigest()
+
+
+# devolve {chave: embedding} para as chaves encontradas; erros do banco viram faltas
+def get_many(keys: list) -> dict:
+    return {key: np.frombuffer(vector, dtype=np.float32).tolist() for key, vector in _cache.get_many(keys).items()}
+
+
+def get(key: str):
+    return get_many([key]).get(key)
+
+
+# os vetores do endpoint vêm em float64; quem chamou recebe sempre os valores arredondados
+# para float32, iguais aos que voltam do cache, para uma falta e um acerto darem o mesmo vetor
+def normalize(embedding) -> list:
+    return np.asarray(embedding, dtype=np.float32).tolist()
+
+
+# grava vários embeddings de uma vez e aplica a evicção por tamanho
+def put_many(items: dict):
+    _cache.put_many({key: np.asarray(embedding, dtype=np.float32).tobytes() for key, embedding in items.items()})
+
+
+def put(key: str, embedding):
+    put_many({key: embedding})
+
+
+# estatísticas de acerto/erro e tamanho do cache
+def stats() -> dict:
+    return _cache.stats()
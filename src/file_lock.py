@@ -0,0 +1,33 @@
+import os
+from contextlib import contextmanager
+
+try:
+    import fcntl
+except ImportError:
+    # sem fcntl (windows) não há trava entre processos; vale só a trava de threads de cada índice
+    fcntl = None
+
+# trava de arquivo entre processos (flock) para os índices locais, que são escritos pelo
+# worker e lidos pela api ao mesmo tempo. escritas usam a trava exclusiva; leituras, a
+# compartilhada. com blocking=False devolve False em vez de esperar quando a trava está
+# ocupada. a trava é da descrição do arquivo aberto, então não é reentrante: quem já tem a
+# trava não deve pedi-la de novo
+
+
+@contextmanager
+def file_lock(path: str, shared: bool = False, blocking: bool = True):
+    if fcntl is None:
+        yield True
+        return
+    os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+    with open(path, "a+") as handle:
+        flags = (fcntl.LOCK_SH if shared else fcntl.LOCK_EX) | (0 if blocking else fcntl.LOCK_NB)
+        try:
+            fcntl.flock(handle, flags)
+        except BlockingIOError:
+            yield False
+            return
+        try:
+            yield True
+        finally:
+            fcntl.flock(handle, fcntl.LOCK_UN)
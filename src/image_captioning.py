@@ -1,36 +1,110 @@
 from dotenv import load_dotenv
 load_dotenv()
-from openai import AzureOpenAI
+from openai import AzureOpenAI, RateLimitError, APITimeoutError, APIConnectionError, InternalServerError
 import os
+import time
 import base64
+import random
+from io import BytesIO
+from concurrent.futures import ThreadPoolExecutor
+from PIL import Image
+from src import caption_cache, clients, metrics
 
-client = AzureOpenAI(
-    api_key=os.getenv("AZURE_OPENAI_VISIONIMAGE_KEY"),
-    azure_endpoint=os.getenv("AZURE_OPENAI_VISIONIMAGE_ENDPOINT"),
-    api_version = "2024-12-01-preview"
-)
+# cliente do modelo de visão, criado no primeiro uso (src/clients.py)
+def _create_client():
+    return AzureOpenAI(
+        api_key=os.getenv("AZURE_OPENAI_VISIONIMAGE_KEY"),
+        azure_endpoint=os.getenv("AZURE_OPENAI_VISIONIMAGE_ENDPOINT"),
+        api_version = "2024-12-01-preview",
+        http_client=clients.http_client()
+    )
+
+clients.register("vision", _create_client)
 
 VISION_DEPLOYMENT = os.getenv("AZURE_OPENAI_VISIONIMAGE_DEPLOYMENT") 
 
-#Usa o modelo de visão para gerar uma descrição/legenda detalhada para uma imagem, focando em dados, tabelas ou gráficos
-def generate_caption_for_rag(image_bytes: bytes, filename: str, page_number: int) -> str:
-    
-    # se a imagem estiver vazia, retorna uma string vazia
-    if not image_bytes:
-        return ""
-    
+# chamadas simultâneas ao modelo de visão e repetições em caso de limite de taxa (429)
+CAPTION_MAX_CONCURRENCY = int(os.getenv("CAPTION_MAX_CONCURRENCY", "4"))
+CAPTION_MAX_RETRIES = int(os.getenv("CAPTION_MAX_RETRIES", "5"))
+# lado maior (px) e qualidade jpeg das imagens enviadas para legenda
+CAPTION_MAX_SIDE = int(os.getenv("CAPTION_MAX_SIDE", "1024"))
+CAPTION_JPEG_QUALITY = int(os.getenv("CAPTION_JPEG_QUALITY", "85"))
+
+# formatos aceitos pelo modelo de visão e o mime correspondente
+_SUPPORTED_FORMATS = {"JPEG": "image/jpeg", "PNG": "image/png", "GIF": "image/gif", "WEBP": "image/webp"}
+
+# versão do prompt de legenda; faz parte da chave do cache de legendas
+CAPTION_PROMPT_VERSION = "2"
+
+# o prompt é o mesmo para qualquer pdf e página (assim a legenda pode ser reaproveitada);
+# o prefixo com arquivo e página é acrescentado localmente por label_caption
+CAPTION_PROMPT = (
+    "Analyze the visual content of this image, which may be a graph, "
+    "a table or a figure. Extract and describe the main information "
+    "and relevant data. If it's a graph, mention peaks, "
+    "notable trends or values. Your answer will be used as context "
+    "for a RAG chatbot. "
+    "Não gere nada além da descrição do conteúdo visual."
+)
+
+
+def label_caption(caption: str, filename: str, page_number: int) -> str:
+    return f"Image of {filename} on the page {page_number}: {caption}"
+
+
+# redimensiona a imagem para no máximo CAPTION_MAX_SIDE pixels no lado maior e recomprime:
+# fotos viram jpeg, imagens com transparência ou poucas cores (gráficos) viram png.
+# devolve (bytes, mime); se o pillow não conseguir abrir, manda os bytes originais
+def prepare_image(image_bytes: bytes):
+    try:
+        image = Image.open(BytesIO(image_bytes))
+        image.load()
+    except Exception:
+        return image_bytes, _guess_mime(image_bytes)
+
+    original_format = (image.format or "").upper()
+    if max(image.size) <= CAPTION_MAX_SIDE and original_format in _SUPPORTED_FORMATS:
+        # já é pequena e num formato aceito: só corrige o mime
+        return image_bytes, _SUPPORTED_FORMATS[original_format]
+
+    image.thumbnail((CAPTION_MAX_SIDE, CAPTION_MAX_SIDE))
+    output = BytesIO()
+    if image.mode in ("RGBA", "LA", "P", "1", "L") and original_format != "JPEG":
+        if image.mode not in ("RGBA", "LA", "L", "1"):
+            image = image.convert("RGBA")
+        image.save(output, format="PNG", optimize=True)
+        return output.getvalue(), "image/png"
+    if image.mode != "RGB":
+        image = image.convert("RGB")
+    image.save(output, format="JPEG", quality=CAPTION_JPEG_QUALITY, optimize=True)
+    return output.getvalue(), "image/jpeg"
+
+
+def _guess_mime(image_bytes: bytes) -> str:
+    if image_bytes.startswith(b"\x89PNG"):
+        return "image/png"
+    if image_bytes[:6] in (b"GIF87a", b"GIF89a"):
+        return "image/gif"
+    if image_bytes[:4] == b"RIFF" and image_bytes[8:12] == b"WEBP":
+        return "image/webp"
+    return "image/jpeg"
+
+
+# espera antes de repetir: usa o retry-after do azure quando vem no erro 429
+def _retry_delay(error: Exception, attempt: int) -> float:
+    response = getattr(error, "response", None)
+    retry_after = response.headers.get("retry-after") if response is not None else None
+    try:
+        return float(retry_after)
+    except (TypeError, ValueError):
+        return min(30.0, 1.0 * 2 ** attempt) + random.uniform(0, 0.5)
+
+
+# uma chamada ao modelo de visão, repetida com backoff em 429, timeout e erro 5xx
+def _request_caption(image_bytes: bytes, max_retries: int) -> str:
+    data, mime = prepare_image(image_bytes)
     # converte os bytes da imagem para Base64
-    base64_image = base64.b64encode(image_bytes).decode('utf-8')
-    
-    # cria o prompt que será enviado ao modelo
-    prompt = (
-        "Analyze the visual content of this image, which may be a graph,"
-        "a table or a figure. Extract and describe the main information "
-        "and relevant data. If it's a graph, mention peaks, "
-        "notable trends or values. Your answer will be used as context "
-        "for a RAG chatbot. Start with 'Image of {filename} on the page {page_number}: '. "
-        "Não gere nada além da descrição do conteúdo visual."
-    ).format(filename=filename, page_number=page_number)
+    base64_image = base64.b64encode(data).decode('utf-8')
 
     # monta a mensagem no formato aceito pelo modelo multimodal
     # o modelo de visão recebe um array messages, onde cada item pode conter texto e imagens
@@ -38,27 +112,77 @@ def generate_caption_for_rag(image_bytes: bytes, filename: str, page_number: int
         {
             "role": "user",
             "content": [
-                {"type": "text", "text": prompt},
+                {"type": "text", "text": CAPTION_PROMPT},
                 {
                     "type": "image_url",
                     "image_url": {
                         # envia a imagem diretamente como base64, simulando uma URL de imagem
-                        "url": f"data:image/jpeg;base64,{base64_image}"
+                        "url": f"data:{mime};base64,{base64_image}"
                     }
                 }
             ]
         }
     ]
 
-    try:
-        # envia o prompt + imagem para o modelo
-        response = client.chat.completions.create(
-            model=VISION_DEPLOYMENT, 
-            messages=messages,
-            max_tokens=500 
-        )
-        # retorna apenas o texto gerando a legenda
-        return response.choices[0].message.content
-    except Exception as e:
-        print(f"Errore durante la generazione della didascalia per l'immagine: {e}")
-        return ""
\ No newline at end of file
+    for attempt in range(max_retries + 1):
+        try:
+            # envia o prompt + imagem para o modelo; as repetições são controladas aqui
+            metrics.increment("openai_caption_requests_total")
+            response = clients.get("vision").with_options(max_retries=0).chat.completions.create(
+                model=VISION_DEPLOYMENT,
+                messages=messages,
+                max_tokens=500
+            )
+            return response.choices[0].message.content or ""
+        except (RateLimitError, APITimeoutError, APIConnectionError, InternalServerError) as e:
+            if attempt >= max_retries:
+                print(f"Errore durante la generazione della didascalia per l'immagine: {e}")
+                return ""
+            metrics.increment("openai_retries_total", labels={"operation": "caption"})
+            time.sleep(_retry_delay(e, attempt))
+        except Exception as e:
+            print(f"Errore durante la generazione della didascalia per l'immagine: {e}")
+            return ""
+    return ""
+
+
+# legendas de várias imagens (sem o prefixo), com até max_concurrency chamadas ao modelo ao
+# mesmo tempo. consulta o cache antes e manda cada imagem repetida uma vez só.
+# devolve uma lista alinhada com a entrada de (legenda, veio_do_cache); legenda vazia se falhar
+def caption_images(images: list, max_concurrency: int = CAPTION_MAX_CONCURRENCY,
+                   max_retries: int = CAPTION_MAX_RETRIES) -> list:
+    results = [("", False)] * len(images)
+    to_caption = {}
+    for i, image_bytes in enumerate(images):
+        # se a imagem estiver vazia, retorna uma string vazia
+        if not image_bytes:
+            continue
+        key = caption_cache.make_key(VISION_DEPLOYMENT, CAPTION_PROMPT_VERSION, caption_cache.image_hash(image_bytes))
+        cached = caption_cache.get(key)
+        if cached is not None:
+            results[i] = (cached, True)
+        else:
+            to_caption.setdefault(key, []).append(i)
+    if not to_caption:
+        return results
+
+    keys = list(to_caption)
+    with ThreadPoolExecutor(max_workers=max(1, min(max_concurrency, len(keys)))) as executor:
+        captions = executor.map(lambda key: _request_caption(images[to_caption[key][0]], max_retries), keys)
+        for key, caption in zip(keys, captions):
+            if caption:
+                caption_cache.put(key, caption)
+            for i in to_caption[key]:
+                results[i] = (caption, False)
+    return results
+
+
+# legenda de uma imagem sem o prefixo; devolve (legenda, veio_do_cache)
+def caption_image(image_bytes: bytes):
+    return caption_images([image_bytes])[0]
+
+
+#Usa o modelo de visão para gerar uma descrição/legenda detalhada para uma imagem, focando em dados, tabelas ou gráficos
+def generate_caption_for_rag(image_bytes: bytes, filename: str, page_number: int) -> str:
+    caption, _ = caption_image(image_bytes)
+    return label_caption(caption, filename, page_number) if caption else ""
@@ -0,0 +1,280 @@
+import os
+import re
+import time
+import tempfile
+import threading
+from contextlib import contextmanager, nullcontext, ExitStack
+from src import blob_storage, smart_doc, openai, search_service, image_captioning, ingest_manifest, chunking, metrics, tracing
+
+
+# quantos chunks novos se acumulam antes de embedar e enviar um lote
+INGEST_FLUSH_DOCS = int(os.getenv("INGEST_FLUSH_DOCS", "256"))
+# quantas imagens novas se acumulam antes de pedir as legendas em paralelo
+INGEST_CAPTION_BATCH = int(os.getenv("INGEST_CAPTION_BATCH", "16"))
+# pasta dos pdfs baixados durante a ingestão (padrão: a pasta temporária do sistema)
+INGEST_TEMP_DIR = os.getenv("INGEST_TEMP_DIR") or None
+# conexões paralelas usadas para baixar um blob grande
+INGEST_BLOB_DOWNLOAD_CONCURRENCY = int(os.getenv("INGEST_BLOB_DOWNLOAD_CONCURRENCY", "4"))
+
+
+# impressão digital guardada no manifesto: conteúdo do pdf + configuração da divisão em chunks
+def _fingerprint(pdf_hash: str) -> str:
+    return f"{pdf_hash}/{chunking.signature()}"
+
+
+# limites de concorrência por etapa, compartilhados por todos os documentos sendo ingeridos
+# ao mesmo tempo (ingestão em massa): enquanto um documento embeda, outro pode estar extraindo
+STAGE_LIMITS = {
+    "download": int(os.getenv("INGEST_DOWNLOAD_CONCURRENCY", "4")),
+    "extract": int(os.getenv("INGEST_EXTRACT_CONCURRENCY", "2")),
+    "caption": int(os.getenv("INGEST_CAPTION_CONCURRENCY", "2")),
+    "embed": int(os.getenv("INGEST_EMBED_CONCURRENCY", "2")),
+    "upload": int(os.getenv("INGEST_UPLOAD_CONCURRENCY", "4")),
+}
+_stages = {name: threading.BoundedSemaphore(limit) for name, limit in STAGE_LIMITS.items()}
+
+
+# ocupa uma vaga da etapa e soma o tempo gasto nela (sem a espera pela vaga) em timings
+@contextmanager
+def _stage(name: str, timings: dict):
+    with _stages[name]:
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            timings[name] = timings.get(name, 0.0) + time.perf_counter() - started
+
+
+# consome um gerador segurando a etapa só enquanto cada item é produzido
+def _staged(iterator, stage: str, timings: dict):
+    iterator = iter(iterator)
+    while True:
+        with _stage(stage, timings):
+            try:
+                item = next(iterator)
+            except StopIteration:
+                return
+        yield item
+
+
+# ingere um pdf do container de forma incremental e idempotente:
+# - etag igual ao do manifesto: nada é baixado, embedado ou escrito
+# - conteúdo igual (mesmo hash): só o etag do manifesto é atualizado
+# - conteúdo diferente: só os chunks novos são embedados/enviados e os antigos são apagados
+def ingest_blob(blob_name: str, etag: str = None) -> dict:
+    blob_client = blob_storage.container_client().get_blob_client(blob_name)
+    if etag is None:
+        etag = blob_client.get_blob_properties().etag
+    return ingest_document(blob_name, etag, lambda: _download_to_temp(blob_client))
+
+
+# baixa o blob em pedaços direto para um arquivo temporário, apagado ao sair do with.
+# o pdf nunca fica inteiro na memória: a extração lê as páginas do arquivo
+@contextmanager
+def _download_to_temp(blob_client):
+    handle = tempfile.NamedTemporaryFile(suffix=".pdf", dir=INGEST_TEMP_DIR, delete=False)
+    try:
+        with handle:
+            blob_client.download_blob(max_concurrency=INGEST_BLOB_DOWNLOAD_CONCURRENCY).readinto(handle)
+        yield handle.name
+    finally:
+        os.remove(handle.name)
+
+
+# versão de um arquivo local usada no lugar do etag do blob
+def file_etag(path: str) -> str:
+    info = os.stat(path)
+    return f"{info.st_mtime_ns:x}-{info.st_size:x}"
+
+
+# ingere um pdf do disco; source é o nome gravado nos chunks (padrão: nome do arquivo)
+def ingest_file(path: str, source: str = None) -> dict:
+    return ingest_document(source or os.path.basename(path), file_etag(path), lambda: nullcontext(path))
+
+
+# ingestão de um documento qualquer: source identifica o documento no manifesto e nos
+# chunks (campo "source", filtrável na busca), etag é a versão e fetch() devolve um
+# context manager com o caminho do pdf no disco
+def ingest_document(source: str, etag: str, fetch) -> dict:
+    # um registro de tempos por documento; as etapas entram em rag_stage_seconds{stage="ingest.*"}
+    with tracing.request("ingest", source=source) as trace:
+        report = _ingest_document(source, etag, fetch)
+        for stage, seconds in report["stages"].items():
+            tracing.record(f"ingest.{stage}", seconds)
+        trace.update(status=report["status"], pages=report["pages"], upserted=report["upserted"])
+    metrics.increment("ingest_documents_total", labels={"status": report["status"]})
+    metrics.increment("ingest_pages_total", report["pages"])
+    metrics.increment("ingest_chunks_upserted_total", report["upserted"])
+    return report
+
+
+def _ingest_document(source: str, etag: str, fetch) -> dict:
+    started = time.perf_counter()
+    blob_name = source
+    # stages: segundos gastos em cada etapa (download, extract, caption, embed, upload)
+    report = {"source": blob_name, "status": "unchanged", "upserted": 0, "deleted": 0, "unchanged": 0, "pages": 0,
+              "stages": {}}
+    record = ingest_manifest.get_document(blob_name)
+
+    # um documento só é pulado se também foi dividido com a configuração atual
+    if record and record["etag"] == etag and record["content_hash"].endswith(chunking.signature()):
+        print(f"{blob_name} invariato (etag), nessuna reindicizzazione.")
+        report["seconds"] = time.perf_counter() - started
+        return report
+
+    with ExitStack() as stack:
+        # baixa o arquivo da nuvem para o disco (um arquivo local é usado no lugar)
+        with _stage("download", report["stages"]):
+            pdf_path = stack.enter_context(fetch())
+        digest = smart_doc.pdf_hash(pdf_path)
+        content_hash = _fingerprint(digest)
+
+        if record and record["content_hash"] == content_hash:
+            ingest_manifest.update_etag(blob_name, etag)
+            print(f"{blob_name} invariato (hash), nessuna reindicizzazione.")
+            report["seconds"] = time.perf_counter() - started
+            return report
+
+        return _index_pdf(blob_name, etag, pdf_path, digest, content_hash, report, started)
+
+
+# extrai, divide, embeda e envia o conteúdo de um pdf já no disco e troca os chunks antigos
+# do documento pelos novos no índice e no manifesto
+def _index_pdf(blob_name: str, etag: str, pdf_path: str, digest: str, content_hash: str,
+               report: dict, started: float) -> dict:
+    # id base para o documento original; só letras, dígitos, "_", "-" e "=" são aceitos nas
+    # chaves do azure search (nomes com pastas, "a/b.pdf", viram "a-b-pdf")
+    source_doc_id = re.sub(r"[^A-Za-z0-9_=-]", "-", blob_name)
+    existing_ids = ingest_manifest.get_chunk_ids(blob_name)
+
+    # extrai o conteúdo estruturado texto, metadados de imagens/tabelas
+    print(f"Iniziando estrazione strutturata del PDF {blob_name}...")
+    # contagens das imagens: as que foram para o modelo de visão e as que foram evitadas
+    vision = {"images": 0, "duplicate_images": 0, "small_images": 0, "already_indexed": 0,
+              "cache_hits": 0, "vision_calls": 0}
+    layout = {}
+    content_blocks = _staged(
+        smart_doc.iter_content_blocks(pdf_path, blob_name, stats=vision, layout_stats=layout, digest=digest),
+        "extract", report["stages"]
+    )
+
+    current_ids = set()
+    pending_docs = []
+    chunk_sizes = []
+    counts = {"blocks": 0, "upserted": 0}
+
+    # embeda e envia o que já foi produzido, enquanto o pool continua extraindo as próximas páginas
+    def flush():
+        # poucas requisições com muitos inputs em vez de uma requisição por pedaço
+        with _stage("embed", report["stages"]):
+            embeddings = openai.get_embeddings_batch([doc["content"] for doc in pending_docs])
+        docs_to_upload = []
+        for doc, embedding in zip(pending_docs, embeddings):
+            if embedding:
+                doc["contentVector"] = embedding
+                docs_to_upload.append(doc)
+            else:
+                # sem embedding o chunk não entra no manifesto e será tentado na próxima ingestão
+                current_ids.discard(doc["id"])
+        if docs_to_upload:
+            with _stage("upload", report["stages"]):
+                search_service.upload_documents(docs_to_upload, source_doc_id)
+        counts["upserted"] += len(docs_to_upload)
+        pending_docs.clear()
+
+    def add_doc(chunk_id: str, content: str):
+        current_ids.add(chunk_id)
+        pending_docs.append({"id": chunk_id, "content": content, "source": blob_name})
+        if len(pending_docs) >= INGEST_FLUSH_DOCS:
+            flush()
+
+    # imagens novas esperando legenda: (chunk_id, bytes, página)
+    pending_images = []
+
+    # legenda as imagens acumuladas em paralelo (e libera seus bytes)
+    def caption_pending():
+        with _stage("caption", report["stages"]):
+            results = image_captioning.caption_images([image_bytes for _, image_bytes, _ in pending_images])
+        for (chunk_id, _, page_number), (caption, cached) in zip(pending_images, results):
+            vision["cache_hits" if cached else "vision_calls"] += 1
+            if caption:
+                add_doc(chunk_id, image_captioning.label_caption(caption, source_doc_id, page_number))
+        pending_images.clear()
+
+    # as imagens vão para a fila de legendas assim que chegam; texto e tabelas seguem para o chunker
+    def text_blocks():
+        queued = set()
+        for block in content_blocks:
+            counts["blocks"] += 1
+            if block.type != 'image':
+                yield block
+                continue
+            if not block.image_bytes:
+                continue
+            # o id da imagem vem dos bytes, então imagens já indexadas não são legendadas de novo
+            chunk_id = search_service.make_chunk_id(source_doc_id, block.image_bytes, prefix="img-")
+            if chunk_id in current_ids or chunk_id in queued:
+                # mesma imagem com outro xref (mesmos bytes)
+                vision["duplicate_images"] += 1
+                continue
+            if chunk_id in existing_ids:
+                vision["already_indexed"] += 1
+                current_ids.add(chunk_id)
+                continue
+
+            queued.add(chunk_id)
+            pending_images.append((chunk_id, block.image_bytes, block.page_number))
+            if len(pending_images) >= INGEST_CAPTION_BATCH:
+                caption_pending()
+
+    # blocos de texto e tabela viram chunks de tamanho parecido (em tokens)
+    for chunk in chunking.chunk_blocks(text_blocks()):
+        chunk_sizes.append(chunk["tokens"])
+        chunk_id = search_service.make_chunk_id(source_doc_id, chunk["content"])
+        if chunk_id in current_ids:
+            continue
+        if chunk_id in existing_ids:
+            current_ids.add(chunk_id)
+        else:
+            add_doc(chunk_id, chunk["content"])
+    caption_pending()
+    flush()
+
+    # se nenhum embedding foi criado, lança erro
+    if not current_ids:
+        raise ValueError(
+            "Nenhum embedding válido foi gerado. Verifique o PDF e a função get_embedding."
+        )
+
+    stale_ids = existing_ids - current_ids
+    if stale_ids:
+        search_service.delete_documents(stale_ids)
+    ingest_manifest.save_document(blob_name, etag, content_hash, current_ids)
+
+    report.update({
+        "status": "updated",
+        "pages": vision.pop("pages", 0),
+        "upserted": counts["upserted"],
+        "deleted": len(stale_ids),
+        "unchanged": len(current_ids) - counts["upserted"],
+        "seconds": time.perf_counter() - started,
+        "chunking": chunking.chunk_report(chunk_sizes),
+        "vision": {**vision, "vision_calls_saved": vision["images"] - vision["vision_calls"]},
+        "layout": layout,
+    })
+    print(f"{blob_name}: {report['upserted']} blocchi inviati, {report['deleted']} rimossi, "
+          f"{report['unchanged']} invariati.")
+    sizes = report["chunking"]
+    if sizes["chunks"]:
+        print(f"{blob_name}: {counts['blocks']} blocchi estratti -> {sizes['chunks']} chunk di testo "
+              f"(token min {sizes['tokens_min']}, p50 {sizes['tokens_p50']}, "
+              f"p95 {sizes['tokens_p95']}, max {sizes['tokens_max']}).")
+    if layout.get("layout_pages_total"):
+        print(f"{blob_name}: {layout['layout_pages_sent']}/{layout['layout_pages_total']} pagine inviate "
+              f"a Document Intelligence in {layout['layout_ranges']} intervalli.")
+    if vision["images"]:
+        print(f"{blob_name}: {vision['images']} immagini, {vision['vision_calls']} chiamate al modello di visione, "
+              f"{report['vision']['vision_calls_saved']} evitate (duplicate {vision['duplicate_images']}, "
+              f"decorative {vision['small_images']}, già indicizzate {vision['already_indexed']}, "
+              f"cache {vision['cache_hits']}).")
+    return report
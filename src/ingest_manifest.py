@@ -0,0 +1,116 @@
+import os
+import sqlite3
+import threading
+from datetime import datetime, timezone
+
+# manifesto da ingestão: para cada documento de origem guarda o etag/hash do blob
+# e os ids dos chunks que foram gerados a partir dele e estão no índice
+manifest_path = os.getenv("INGEST_MANIFEST_PATH", ".cache/manifest.sqlite")
+
+_lock = threading.Lock()
+_connection = None
+
+
+def _connect():
+    global _connection
+    if _connection is None:
+        directory = os.path.dirname(manifest_path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        _connection = sqlite3.connect(manifest_path, check_same_thread=False)
+        _connection.execute("PRAGMA journal_mode=WAL")
+        _connection.execute(
+            "CREATE TABLE IF NOT EXISTS documents ("
+            "source TEXT PRIMARY KEY, etag TEXT, content_hash TEXT, updated_at TEXT)"
+        )
+        _connection.execute(
+            "CREATE TABLE IF NOT EXISTS chunks ("
+            "source TEXT NOT NULL, chunk_id TEXT NOT NULL, PRIMARY KEY (source, chunk_id))"
+        )
+        # versão do conjunto de documentos, incrementada a cada mudança no índice
+        _connection.execute("CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value INTEGER NOT NULL)")
+        _connection.commit()
+    return _connection
+
+
+# devolve o registro do documento ou None se ele nunca foi ingerido
+def get_document(source: str):
+    with _lock:
+        row = _connect().execute(
+            "SELECT etag, content_hash, updated_at FROM documents WHERE source = ?", (source,)
+        ).fetchone()
+    if not row:
+        return None
+    return {"source": source, "etag": row[0], "content_hash": row[1], "updated_at": row[2]}
+
+
+# ids dos chunks atualmente no índice para esse documento
+def get_chunk_ids(source: str) -> set:
+    with _lock:
+        rows = _connect().execute("SELECT chunk_id FROM chunks WHERE source = ?", (source,)).fetchall()
+    return {row[0] for row in rows}
+
+
+# atualiza só o etag (o blob foi regravado mas o conteúdo é o mesmo)
+def update_etag(source: str, etag: str):
+    with _lock:
+        connection = _connect()
+        connection.execute(
+            "UPDATE documents SET etag = ?, updated_at = ? WHERE source = ?",
+            (etag, datetime.now(timezone.utc).isoformat(), source)
+        )
+        connection.commit()
+
+
+# grava o estado do documento e troca o conjunto de chunks numa única transação
+def save_document(source: str, etag: str, content_hash: str, chunk_ids: set):
+    with _lock:
+        connection = _connect()
+        with connection:
+            connection.execute(
+                "INSERT OR REPLACE INTO documents (source, etag, content_hash, updated_at) VALUES (?, ?, ?, ?)",
+                (source, etag, content_hash, datetime.now(timezone.utc).isoformat())
+            )
+            connection.execute("DELETE FROM chunks WHERE source = ?", (source,))
+            connection.executemany(
+                "INSERT INTO chunks (source, chunk_id) VALUES (?, ?)",
+                [(source, chunk_id) for chunk_id in chunk_ids]
+            )
+            connection.execute(
+                "INSERT INTO meta (key, value) VALUES ('corpus_version', 1) "
+                "ON CONFLICT(key) DO UPDATE SET value = value + 1"
+            )
+
+
+# versão atual do conjunto de documentos; caches de respostas usam como parte da chave
+def corpus_version() -> int:
+    with _lock:
+        row = _connect().execute("SELECT value FROM meta WHERE key = 'corpus_version'").fetchone()
+    return row[0] if row else 0
+
+
+# lista todos os documentos conhecidos pelo manifesto, com a quantidade de chunks de cada um
+def list_documents() -> list:
+    with _lock:
+        rows = _connect().execute(
+            "SELECT d.source, d.etag, d.content_hash, d.updated_at, COUNT(c.chunk_id) FROM documents d "
+            "LEFT JOIN chunks c ON c.source = d.source GROUP BY d.source ORDER BY d.source"
+        ).fetchall()
+    return [
+        {"source": r[0], "etag": r[1], "content_hash": r[2], "updated_at": r[3], "chunks": r[4]}
+        for r in rows
+    ]
+
+
+# esquece todos os documentos (o índice foi recriado vazio): a próxima ingestão de cada um
+# refaz tudo. a versão do corpus sobe, invalidando o cache de respostas
+def clear():
+    with _lock:
+        connection = _connect()
+        with connection:
+            connection.execute("DELETE FROM chunks")
+            connection.execute("DELETE FROM documents")
+            connection.execute(
+                "INSERT INTO meta (key, value) VALUES ('corpus_version', 1) "
+                "ON CONFLICT(key) DO UPDATE SET value = value + 1"
+            )
@@ -0,0 +1,161 @@
+import os
+import json
+import sqlite3
+import time
+import uuid
+from contextlib import contextmanager
+
+# fila de jobs de ingestão guardada num sqlite local, compartilhada entre a api e o worker.
+# cada operação abre a própria conexão para funcionar entre processos diferentes
+jobs_path = os.getenv("INGEST_JOBS_PATH", ".cache/jobs.sqlite")
+# tempo que um worker segura um job sem renovar o lease (heartbeat) antes dele voltar para
+# a fila. o worker renova a cada JOB_HEARTBEAT_SECONDS enquanto o job roda, então o lease só
+# expira quando o worker morre ou trava, e não numa ingestão longa
+JOB_LEASE_SECONDS = int(os.getenv("INGEST_JOB_LEASE_SECONDS", "300"))
+JOB_HEARTBEAT_SECONDS = float(os.getenv("INGEST_JOB_HEARTBEAT_SECONDS", "60"))
+JOB_MAX_ATTEMPTS = int(os.getenv("INGEST_JOB_MAX_ATTEMPTS", "3"))
+
+# tipo de job que ingere um pdf do container
+INGEST_BLOB = "ingest_blob"
+
+QUEUED = "queued"
+RUNNING = "running"
+DONE = "done"
+FAILED = "failed"
+
+
+@contextmanager
+def _connect():
+    directory = os.path.dirname(jobs_path)
+    if directory:
+        os.makedirs(directory, exist_ok=True)
+    connection = sqlite3.connect(jobs_path, timeout=30, isolation_level=None)
+    try:
+        connection.execute("PRAGMA journal_mode=WAL")
+        connection.execute(
+            "CREATE TABLE IF NOT EXISTS jobs ("
+            "id TEXT PRIMARY KEY, kind TEXT NOT NULL, payload TEXT NOT NULL, dedupe_key TEXT NOT NULL, "
+            "status TEXT NOT NULL, attempts INTEGER NOT NULL DEFAULT 0, result TEXT, error TEXT, "
+            "created_at REAL NOT NULL, updated_at REAL NOT NULL, lease_until REAL)"
+        )
+        connection.execute("CREATE INDEX IF NOT EXISTS idx_jobs_status ON jobs(status, created_at)")
+        yield connection
+    finally:
+        connection.close()
+
+
+def _row_to_job(row) -> dict:
+    if not row:
+        return None
+    return {
+        "id": row[0],
+        "kind": row[1],
+        "payload": json.loads(row[2]),
+        "status": row[3],
+        "attempts": row[4],
+        "result": json.loads(row[5]) if row[5] else None,
+        "error": row[6],
+        "created_at": row[7],
+        "updated_at": row[8],
+    }
+
+
+_COLUMNS = "id, kind, payload, status, attempts, result, error, created_at, updated_at"
+
+
+# coloca um job na fila; se já existe um job igual pendente ou rodando, devolve esse
+# em vez de criar outro, assim vários processos da api não duplicam a mesma ingestão
+def enqueue(kind: str, payload: dict) -> dict:
+    dedupe_key = f"{kind}:{json.dumps(payload, sort_keys=True)}"
+    now = time.time()
+    with _connect() as connection:
+        connection.execute("BEGIN IMMEDIATE")
+        row = connection.execute(
+            f"SELECT {_COLUMNS} FROM jobs WHERE dedupe_key = ? AND status IN (?, ?)",
+            (dedupe_key, QUEUED, RUNNING)
+        ).fetchone()
+        if row:
+            connection.execute("COMMIT")
+            return _row_to_job(row)
+
+        job_id = str(uuid.uuid4())
+        connection.execute(
+            "INSERT INTO jobs (id, kind, payload, dedupe_key, status, created_at, updated_at) "
+            "VALUES (?, ?, ?, ?, ?, ?, ?)",
+            (job_id, kind, json.dumps(payload), dedupe_key, QUEUED, now, now)
+        )
+        connection.execute("COMMIT")
+    return get(job_id)
+
+
+# pega o job mais antigo da fila (ou um cujo worker morreu e o lease expirou).
+# a transação imediata garante que só um worker consegue pegar cada job. um lease expirado
+# conta como tentativa perdida: sem tentativas sobrando o job falha, e não volta a derrubar
+# workers para sempre
+def claim():
+    now = time.time()
+    with _connect() as connection:
+        connection.execute("BEGIN IMMEDIATE")
+        connection.execute(
+            "UPDATE jobs SET status = ?, error = ?, updated_at = ?, lease_until = NULL "
+            "WHERE status = ? AND lease_until < ? AND attempts >= ?",
+            (FAILED, "lease scaduto: il worker si è interrotto durante il job", now, RUNNING, now, JOB_MAX_ATTEMPTS)
+        )
+        row = connection.execute(
+            "SELECT id FROM jobs WHERE status = ? OR (status = ? AND lease_until < ? AND attempts < ?) "
+            "ORDER BY created_at LIMIT 1",
+            (QUEUED, RUNNING, now, JOB_MAX_ATTEMPTS)
+        ).fetchone()
+        if not row:
+            connection.execute("COMMIT")
+            return None
+        connection.execute(
+            "UPDATE jobs SET status = ?, attempts = attempts + 1, updated_at = ?, lease_until = ? WHERE id = ?",
+            (RUNNING, now, now + JOB_LEASE_SECONDS, row[0])
+        )
+        connection.execute("COMMIT")
+    return get(row[0])
+
+
+# renova o lease de um job que ainda está rodando; False se ele não está mais com o worker
+def heartbeat(job_id: str) -> bool:
+    now = time.time()
+    with _connect() as connection:
+        cursor = connection.execute(
+            "UPDATE jobs SET lease_until = ?, updated_at = ? WHERE id = ? AND status = ?",
+            (now + JOB_LEASE_SECONDS, now, job_id, RUNNING)
+        )
+    return cursor.rowcount > 0
+
+
+def complete(job_id: str, result: dict):
+    with _connect() as connection:
+        connection.execute(
+            "UPDATE jobs SET status = ?, result = ?, error = NULL, updated_at = ?, lease_until = NULL WHERE id = ?",
+            (DONE, json.dumps(result), time.time(), job_id)
+        )
+
+
+# marca a falha; enquanto houver tentativas o job volta para a fila
+def fail(job_id: str, error: str):
+    job = get(job_id)
+    status = QUEUED if job and job["attempts"] < JOB_MAX_ATTEMPTS else FAILED
+    with _connect() as connection:
+        connection.execute(
+            "UPDATE jobs SET status = ?, error = ?, updated_at = ?, lease_until = NULL WHERE id = ?",
+            (status, error, time.time(), job_id)
+        )
+
+
+def get(job_id: str):
+    with _connect() as connection:
+        row = connection.execute(f"SELECT {_COLUMNS} FROM jobs WHERE id = ?", (job_id,)).fetchone()
+    return _row_to_job(row)
+
+
+def list_jobs(limit: int = 50) -> list:
+    with _connect() as connection:
+        rows = connection.execute(
+            f"SELECT {_COLUMNS} FROM jobs ORDER BY created_at DESC LIMIT ?", (limit,)
+        ).fetchall()
+    return [_row_to_job(row) for row in rows]
@@ -0,0 +1,30 @@
+import os
+import json
+from src.sqlite_cache import SqliteCache
+
+# cache persistente das análises de layout do document intelligence, por hash do pdf +
+# faixa de páginas + modelo/recursos. reprocessar o mesmo pdf não chama o serviço de novo
+cache_path = os.getenv("LAYOUT_CACHE_PATH", ".cache/layout.sqlite")
+# tamanho máximo das análises guardadas (json), acima disso as menos usadas recentemente são removidas
+cache_max_bytes = int(os.getenv("LAYOUT_CACHE_MAX_BYTES", str(1024 * 1024 * 1024)))
+
+_cache = SqliteCache(cache_path, "layouts", "result", cache_max_bytes)
+
+
+# chave do cache: hash do pdf + faixa de páginas ("all" para o documento inteiro) + modelo
+def make_key(pdf_hash: str, pages: str, model: str) -> str:
+    return f"{pdf_hash}:{pages or 'all'}:{model}"
+
+
+def get(key: str):
+    result = _cache.get(key)
+    return json.loads(result) if result is not None else None
+
+
+def put(key: str, result: dict):
+    _cache.put(key, json.dumps(result, ensure_ascii=False))
+
+
+# estatísticas de acerto/erro e tamanho do cache
+def stats() -> dict:
+    return _cache.stats()
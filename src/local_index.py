@@ -0,0 +1,450 @@
+import os
+import json
+import math
+import threading
+from contextlib import contextmanager, nullcontext
+import numpy as np
+from src.file_lock import file_lock
+
+# índice vetorial local: os vetores (normalizados) ficam numa matriz contígua em disco,
+# lida via memmap, e a busca é um produto matriz-vetor em blocos + argpartition para o top k.
+# os metadados ficam num log jsonl só de acréscimos; remoções viram tombstones até a compactação.
+# um processo escreve (o worker) enquanto outros buscam (a api): veja _refresh
+#
+# com quantização, cada vetor também é guardado comprimido e a busca percorre só a versão
+# comprimida: "int8" (1 byte por dimensão + uma escala por vetor, 4x menor que float32) ou
+# "binary" (o sinal de cada dimensão, 1 bit, 32x menor, comparado pela distância de hamming).
+# os k * oversampling melhores candidatos são então repontuados com os vetores originais
+
+# quantas linhas da matriz são pontuadas por vez (limita a memória usada na busca)
+SEARCH_BLOCK_ROWS = 65536
+QUANTIZATIONS = ("none", "int8", "binary")
+
+
+# int8 com escala por vetor: v ~= codes * scale
+def quantize_int8(vectors: np.ndarray):
+    scales = np.abs(vectors).max(axis=1) / 127
+    codes = np.rint(vectors / np.where(scales == 0, 1, scales)[:, None]).astype(np.int8)
+    return codes, scales.astype(np.float32)
+
+
+# um bit por dimensão (positiva ou não), em palavras de 64 bits (completadas com zeros)
+def quantize_binary(vectors: np.ndarray) -> np.ndarray:
+    bits = np.packbits(vectors > 0, axis=1)
+    padding = -bits.shape[1] % 8
+    if padding:
+        bits = np.pad(bits, ((0, 0), (0, padding)))
+    return np.ascontiguousarray(bits).view(np.uint64)
+
+
+def _popcount(bits: np.ndarray) -> np.ndarray:
+    if hasattr(np, "bitwise_count"):
+        return np.bitwise_count(bits)
+    return _POPCOUNT_TABLE[bits]
+
+
+_POPCOUNT_TABLE = np.array([bin(i).count("1") for i in range(256)], dtype=np.uint8)
+
+
+class LocalVectorIndex:
+    def __init__(self, directory: str, dimensions: int = 1536, dtype: str = "float32",
+                 quantization: str = "none", oversampling: float = 4.0):
+        if quantization not in QUANTIZATIONS:
+            raise ValueError(f"Quantizzazione sconosciuta: {quantization} (valori: {', '.join(QUANTIZATIONS)}).")
+        self.directory = directory
+        self.dimensions = dimensions
+        self.dtype = np.dtype(dtype)
+        self.quantization = quantization
+        self.oversampling = oversampling
+        # cada compactação grava os arquivos de uma geração nova e só então troca o número
+        # guardado em "generation"; quem lê percebe a troca e recarrega tudo
+        self.generation_path = os.path.join(directory, "generation")
+        self.lock_path = os.path.join(directory, "index.lock")
+        self._lock = threading.RLock()
+        self._matrix = None
+        self._codes = None
+        self._scales = None
+        self.rows = []          # metadados por linha da matriz (None quando removida)
+        self.row_by_id = {}     # id do documento -> linha viva
+        self.deleted = np.zeros(0, dtype=bool)
+        self.generation = None
+        self._use_generation(0)
+        self._log_offset = 0    # bytes do log já aplicados
+        self._log_stat = None   # (inode, tamanho, mtime) do log na última leitura
+        os.makedirs(directory, exist_ok=True)
+        with self._lock, file_lock(self.lock_path, shared=True):
+            self._catch_up()
+        # quantização ligada num índice já existente: os códigos são criados uma vez, pelo
+        # escritor, a partir dos vetores originais, sem recalcular nenhum embedding
+        if self.quantization != "none" and self._codes is None and self.rows:
+            with self._writing():
+                pass
+
+    # arquivos de uma geração (a 0 mantém os nomes sem sufixo)
+    def _generation_files(self, generation: int) -> dict:
+        suffix = f"-{generation}" if generation else ""
+        files = {
+            "vectors": os.path.join(self.directory, f"vectors{suffix}.bin"),
+            "log": os.path.join(self.directory, f"documents{suffix}.jsonl"),
+            "scales": os.path.join(self.directory, f"scales-int8{suffix}.bin"),
+        }
+        for quantization in QUANTIZATIONS[1:]:
+            files[quantization] = os.path.join(self.directory, f"codes-{quantization}{suffix}.bin")
+        return files
+
+    def _use_generation(self, generation: int):
+        self._files = self._generation_files(generation)
+        self.vectors_path = self._files["vectors"]
+        self.log_path = self._files["log"]
+        self.scales_path = self._files["scales"]
+        self.codes_path = self._files.get(self.quantization)
+
+    def _codes_path(self, quantization: str) -> str:
+        return self._files[quantization]
+
+    # o log e a matriz são escritos por um processo (o worker) e lidos por outros (a api).
+    # quem escreve segura a trava exclusiva do arquivo durante toda a escrita e grava vetores
+    # e códigos antes da linha do log; quem lê aplica só as linhas novas do log, com a trava
+    # compartilhada, e nunca mexe nos arquivos. antes de cada busca um stat do log diz se há
+    # algo novo; se a trava estiver ocupada a busca usa o estado que já tem
+    def _refresh(self):
+        try:
+            stat = os.stat(self.log_path)
+            current = (stat.st_ino, stat.st_size, stat.st_mtime_ns)
+        except FileNotFoundError:
+            current = None
+        if current == self._log_stat:
+            return
+        with self._lock, file_lock(self.lock_path, shared=True, blocking=False) as locked:
+            if locked:
+                self._catch_up()
+
+    # aplica o que mudou no log desde a última leitura; chamado com a trava do arquivo
+    def _catch_up(self):
+        generation = self._read_generation()
+        if generation != self.generation:
+            self._use_generation(generation)
+        try:
+            stat = os.stat(self.log_path)
+        except FileNotFoundError:
+            stat = None
+        previous = self._log_stat
+        if generation != self.generation or stat is None or previous is None or \
+                stat.st_ino != previous[0] or stat.st_size < self._log_offset:
+            # compactação, índice apagado ou primeira leitura: recomeça do zero
+            self.rows = []
+            self.row_by_id = {}
+            self.deleted = np.zeros(0, dtype=bool)
+            self._log_offset = 0
+            self.generation = generation
+        if stat is not None and stat.st_size > self._log_offset:
+            with open(self.log_path, "rb") as log:
+                log.seek(self._log_offset)
+                data = log.read(stat.st_size - self._log_offset)
+            # só linhas completas; uma linha pela metade fica para a próxima leitura
+            complete = data[:data.rfind(b"\n") + 1]
+            for line in complete.splitlines():
+                if line.strip():
+                    self._apply(json.loads(line))
+            self._log_offset += len(complete)
+        self._log_stat = (stat.st_ino, stat.st_size, stat.st_mtime_ns) if stat is not None else None
+        self._remap()
+
+    def _apply(self, entry: dict):
+        if entry["op"] == "add":
+            self._register(entry["doc"])
+        elif entry["op"] == "del":
+            self._tombstone(entry["row"])
+
+    def _read_generation(self) -> int:
+        try:
+            with open(self.generation_path, "r") as f:
+                return int(f.read().strip() or 0)
+        except (FileNotFoundError, ValueError):
+            return 0
+
+    # trava exclusiva para escrever: alcança o que outros processos escreveram, corta restos
+    # de escritas interrompidas e garante os códigos antes de acrescentar qualquer coisa
+    @contextmanager
+    def _writing(self):
+        with self._lock, file_lock(self.lock_path):
+            self._catch_up()
+            self._repair()
+            yield
+            self._catch_up()
+
+    # quantizações cujos códigos são mantidos: a deste processo e as que já têm arquivo
+    # (outro processo pode buscar com elas)
+    def _maintained(self) -> list:
+        return [q for q in QUANTIZATIONS[1:] if q == self.quantization or os.path.exists(self._codes_path(q))]
+
+    def _code_width(self, quantization: str = None) -> int:
+        quantization = quantization or self.quantization
+        return self.dimensions if quantization == "int8" else (self.dimensions + 63) // 64 * 8
+
+    # só o escritor (com a trava exclusiva) repara: descarta vetores e códigos gravados sem a
+    # linha correspondente no log e refaz códigos que não acompanham a matriz. os leitores só
+    # mapeiam as linhas do log, então cortar o que passa delas não afeta ninguém
+    def _repair(self):
+        count = len(self.rows)
+        expected = count * self.dimensions * self.dtype.itemsize
+        if os.path.exists(self.vectors_path) and os.path.getsize(self.vectors_path) > expected:
+            self._matrix = None
+            os.truncate(self.vectors_path, expected)
+        for quantization in self._maintained():
+            width = self._code_width(quantization)
+            files = [(self._codes_path(quantization), count * width)]
+            if quantization == "int8":
+                files.append((self.scales_path, count * 4))
+            sizes = [os.path.getsize(path) if os.path.exists(path) else 0 for path, _ in files]
+            if any(size < size_expected for size, (_, size_expected) in zip(sizes, files)):
+                self._rebuild_codes(quantization, self._matrix)
+            else:
+                for path, size_expected in files:
+                    if os.path.exists(path) and os.path.getsize(path) > size_expected:
+                        os.truncate(path, size_expected)
+        self._remap()
+
+    # reescreve os códigos de uma quantização a partir de vetores (já normalizados) em arquivos
+    # novos que substituem os antigos; quem ainda mapeia os antigos não é afetado
+    def _rebuild_codes(self, quantization: str, vectors):
+        codes_path = self._codes_path(quantization)
+        self._codes = self._scales = None
+        self._write_codes(vectors, quantization, codes_path + ".tmp", self.scales_path + ".tmp", mode="wb")
+        if quantization == "int8":
+            os.replace(self.scales_path + ".tmp", self.scales_path)
+        os.replace(codes_path + ".tmp", codes_path)
+
+    def _register(self, doc: dict):
+        row = len(self.rows)
+        previous = self.row_by_id.get(doc["id"])
+        if previous is not None:
+            self._tombstone(previous)
+        self.rows.append(doc)
+        self.row_by_id[doc["id"]] = row
+        if len(self.deleted) <= row:
+            self.deleted = np.concatenate([self.deleted, np.zeros(max(1024, row + 1 - len(self.deleted)), dtype=bool)])
+        return row
+
+    def _tombstone(self, row: int):
+        doc = self.rows[row]
+        if doc is not None and self.row_by_id.get(doc["id"]) == row:
+            del self.row_by_id[doc["id"]]
+        self.rows[row] = None
+        self.deleted[row] = True
+
+    # mapeia as linhas do log que já têm vetor no arquivo (o escritor grava o vetor antes)
+    def _remap(self):
+        row_bytes = self.dimensions * self.dtype.itemsize
+        available = os.path.getsize(self.vectors_path) // row_bytes if os.path.exists(self.vectors_path) else 0
+        count = min(len(self.rows), available)
+        if count == 0:
+            self._matrix = np.zeros((0, self.dimensions), dtype=self.dtype)
+        else:
+            self._matrix = np.memmap(self.vectors_path, dtype=self.dtype, mode="r", shape=(count, self.dimensions))
+        if self.quantization != "none":
+            self._remap_codes(count)
+
+    # códigos das mesmas linhas; sem códigos suficientes (ainda não criados pelo escritor)
+    # a busca usa os vetores originais
+    def _remap_codes(self, count: int):
+        width = self._code_width()
+        def size(path):
+            return os.path.getsize(path) if os.path.exists(path) else 0
+        self._codes = self._scales = None
+        if size(self.codes_path) < count * width or \
+                (self.quantization == "int8" and size(self.scales_path) < count * 4):
+            return
+        if self.quantization == "int8":
+            dtype, columns = np.int8, width
+        else:
+            dtype, columns = np.uint64, width // 8
+        if count == 0:
+            self._codes = np.zeros((0, columns), dtype=dtype)
+            self._scales = np.zeros(0, dtype=np.float32)
+            return
+        self._codes = np.memmap(self.codes_path, dtype=dtype, mode="r", shape=(count, columns))
+        if self.quantization == "int8":
+            self._scales = np.memmap(self.scales_path, dtype=np.float32, mode="r", shape=(count,))
+
+    # grava os códigos dos vetores (já normalizados), em blocos
+    def _write_codes(self, vectors, quantization: str, codes_path: str, scales_path: str, mode: str = "ab"):
+        with open(codes_path, mode) as codes_file, \
+                (open(scales_path, mode) if quantization == "int8" else nullcontext()) as scales_file:
+            for start in range(0, len(vectors), SEARCH_BLOCK_ROWS):
+                block = np.asarray(vectors[start:start + SEARCH_BLOCK_ROWS], dtype=np.float32)
+                if quantization == "int8":
+                    codes, scales = quantize_int8(block)
+                    scales_file.write(scales.tobytes())
+                else:
+                    codes = quantize_binary(block)
+                codes_file.write(codes.tobytes())
+
+    def __len__(self):
+        return len(self.row_by_id)
+
+    # acrescenta (ou substitui, pelo id) documentos com o vetor em "contentVector"
+    def upsert(self, docs: list):
+        if not docs:
+            return
+        vectors = np.asarray([doc["contentVector"] for doc in docs], dtype=np.float32)
+        if vectors.shape[1] != self.dimensions:
+            raise ValueError(f"Dimensione del vettore {vectors.shape[1]} diversa da {self.dimensions}.")
+        norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+        vectors = vectors / np.where(norms == 0, 1, norms)
+
+        with self._writing():
+            with open(self.vectors_path, "ab") as data:
+                data.write(vectors.astype(self.dtype).tobytes())
+            for quantization in self._maintained():
+                self._write_codes(vectors, quantization, self._codes_path(quantization), self.scales_path)
+            # o log por último: as linhas só ficam visíveis com vetor e códigos já gravados
+            with open(self.log_path, "a", encoding="utf-8") as log:
+                log.write("".join(
+                    json.dumps({"op": "add", "doc": {k: v for k, v in doc.items() if k != "contentVector"}},
+                               ensure_ascii=False) + "\n"
+                    for doc in docs
+                ))
+
+    # marca os documentos como removidos (tombstone)
+    def delete(self, ids):
+        with self._writing():
+            rows = [self.row_by_id[doc_id] for doc_id in dict.fromkeys(ids) if doc_id in self.row_by_id]
+            if rows:
+                with open(self.log_path, "a", encoding="utf-8") as log:
+                    log.write("".join(json.dumps({"op": "del", "row": row}) + "\n" for row in rows))
+
+    # reescreve matriz, códigos e log só com as linhas vivas nos arquivos da geração seguinte
+    # e troca a geração de uma vez: uma compactação interrompida deixa a geração antiga
+    # intacta. os outros processos seguem com os arquivos antigos (já abertos) até recarregar
+    def compact(self):
+        with self._writing():
+            live = [row for row in range(self._matrix.shape[0]) if self.rows[row] is not None]
+            generation = self.generation + 1
+            files = self._generation_files(generation)
+            # restos de uma compactação interrompida
+            for path in files.values():
+                if os.path.exists(path):
+                    os.remove(path)
+            with open(files["vectors"], "wb") as data, open(files["log"], "w", encoding="utf-8") as log:
+                for start in range(0, len(live), SEARCH_BLOCK_ROWS):
+                    part = live[start:start + SEARCH_BLOCK_ROWS]
+                    data.write(np.ascontiguousarray(self._matrix[part]).tobytes())
+                    for row in part:
+                        log.write(json.dumps({"op": "add", "doc": self.rows[row]}, ensure_ascii=False) + "\n")
+            compacted = np.memmap(files["vectors"], dtype=self.dtype, mode="r", shape=(len(live), self.dimensions)) \
+                if live else np.zeros((0, self.dimensions), dtype=self.dtype)
+            for quantization in self._maintained():
+                self._write_codes(compacted, quantization, files[quantization], files["scales"], mode="wb")
+            del compacted
+
+            with open(self.generation_path + ".tmp", "w") as f:
+                f.write(str(generation))
+            os.replace(self.generation_path + ".tmp", self.generation_path)
+            # os arquivos da geração antiga saem do diretório; quem ainda os mapeia continua lendo
+            for path in set(self._files.values()):
+                if os.path.exists(path):
+                    os.remove(path)
+
+    # fração de linhas removidas, usada para decidir quando compactar
+    def tombstone_ratio(self) -> float:
+        return 1 - len(self.row_by_id) / len(self.rows) if self.rows else 0.0
+
+    # pontuação aproximada de um bloco de linhas pelos códigos comprimidos
+    def _code_scores(self, codes, scales, start: int, end: int, query, query_bits) -> np.ndarray:
+        if self.quantization == "int8":
+            # o einsum converte os códigos durante a soma, sem uma cópia float32 do bloco
+            return np.einsum("ij,j->i", codes[start:end], query, dtype=np.float32) * scales[start:end]
+        # binário: quanto menos bits diferentes do sinal da consulta, mais parecido
+        distance = _popcount(codes[start:end] ^ query_bits).sum(axis=1, dtype=np.int32)
+        return (self.dimensions - 2 * distance).astype(np.float32)
+
+    # top k por similaridade de cosseno; devolve [{"id", "content", ..., "score"}].
+    # com quantização a busca percorre os códigos, guarda k * oversampling candidatos e
+    # repontua só esses com os vetores originais
+    def search(self, query_vector, k: int = 20, filter_fn=None, oversampling: float = None) -> list:
+        if query_vector is None:
+            return []
+        query = np.asarray(query_vector, dtype=np.float32)
+        norm = np.linalg.norm(query)
+        if norm == 0:
+            return []
+        query = query / norm
+
+        self._refresh()
+        with self._lock:
+            matrix = self._matrix
+            codes, scales = self._codes, self._scales
+            count = matrix.shape[0]
+            deleted = self.deleted[:count]
+            rows = self.rows
+
+        # sem códigos (ainda não criados pelo escritor) a busca usa os vetores originais
+        quantized = self.quantization != "none" and codes is not None
+        keep = max(k, math.ceil(k * (oversampling or self.oversampling))) if quantized else k
+        query_bits = quantize_binary(query[None, :])[0] if self.quantization == "binary" else None
+
+        best_rows = []
+        best_scores = []
+        for start in range(0, count, SEARCH_BLOCK_ROWS):
+            end = min(start + SEARCH_BLOCK_ROWS, count)
+            if quantized:
+                scores = self._code_scores(codes, scales, start, end, query, query_bits)
+            else:
+                scores = matrix[start:end].astype(np.float32, copy=False) @ query
+            mask = deleted[start:end]
+            if filter_fn is not None:
+                mask = mask | np.fromiter(
+                    (rows[start + i] is None or not filter_fn(rows[start + i]) for i in range(len(scores))),
+                    dtype=bool, count=len(scores)
+                )
+            scores[mask] = -np.inf
+            take = min(keep, len(scores))
+            top = np.argpartition(-scores, take - 1)[:take]
+            best_rows.append(top + start)
+            best_scores.append(scores[top])
+
+        if not best_rows:
+            return []
+        candidate_rows = np.concatenate(best_rows)
+        candidate_scores = np.concatenate(best_scores)
+        if quantized:
+            # repontuação: só os candidatos válidos, lidos em ordem de linha do arquivo
+            valid = candidate_scores != -np.inf
+            candidate_rows = np.sort(candidate_rows[valid])
+            candidate_scores = matrix[candidate_rows].astype(np.float32, copy=False) @ query
+        order = np.argsort(-candidate_scores)[:k]
+
+        results = []
+        for position in order:
+            score = float(candidate_scores[position])
+            if score == -np.inf:
+                break
+            doc = rows[int(candidate_rows[position])]
+            if doc is not None:
+                results.append({**doc, "score": score})
+        return results
+
+    # vetores (normalizados) dos documentos, na ordem dos ids; linha de zeros para ids ausentes
+    def get_vectors(self, ids: list) -> np.ndarray:
+        self._refresh()
+        with self._lock:
+            matrix = self._matrix
+            rows = [self.row_by_id.get(doc_id) for doc_id in ids]
+        vectors = np.zeros((len(ids), self.dimensions), dtype=np.float32)
+        found = [i for i, row in enumerate(rows) if row is not None and row < matrix.shape[0]]
+        if found:
+            vectors[found] = matrix[[rows[i] for i in found]]
+        return vectors
+
+    # bytes em disco por arquivo e quantos bytes por vetor a busca percorre
+    def storage(self) -> dict:
+        files = {"vectors": self.vectors_path, "log": self.log_path}
+        if self.quantization != "none":
+            files["codes"] = self.codes_path
+            if self.quantization == "int8":
+                files["scales"] = self.scales_path
+        sizes = {name: os.path.getsize(path) if os.path.exists(path) else 0 for name, path in files.items()}
+        scanned = self.dimensions * self.dtype.itemsize if self.quantization == "none" else \
+            self._code_width() + (4 if self.quantization == "int8" else 0)
+        return {"bytes": sizes, "scanned_bytes_per_vector": scanned}
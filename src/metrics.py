@@ -0,0 +1,142 @@
+import re
+import threading
+from collections import deque
+
+# métricas simples em memória do processo: contadores e séries de tempos (em segundos).
+# cada série guarda as últimas observações para calcular percentis. contadores e séries
+# podem ter rótulos (labels={"stage": "search"}), como no prometheus
+MAX_SAMPLES = 2048
+# prefixo dos nomes no formato do prometheus (/metrics)
+PROMETHEUS_PREFIX = "rag_"
+
+_lock = threading.Lock()
+_counters = {}
+_series = {}
+
+
+# chave interna: nome + rótulos ordenados
+def _key(name: str, labels: dict = None) -> tuple:
+    return name, tuple(sorted((labels or {}).items()))
+
+
+def _labels_text(labels: tuple, extra: tuple = ()) -> str:
+    pairs = list(labels) + list(extra)
+    if not pairs:
+        return ""
+    escaped = (str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n") for _, value in pairs)
+    return "{" + ",".join(f'{name}="{value}"' for (name, _), value in zip(pairs, escaped)) + "}"
+
+
+def _display(key: tuple) -> str:
+    return key[0] + _labels_text(key[1])
+
+
+def increment(name: str, value: float = 1, labels: dict = None):
+    key = _key(name, labels)
+    with _lock:
+        _counters[key] = _counters.get(key, 0) + value
+
+
+def observe(name: str, value: float, labels: dict = None):
+    key = _key(name, labels)
+    with _lock:
+        series = _series.get(key)
+        if series is None:
+            series = _series[key] = {"count": 0, "sum": 0.0, "samples": deque(maxlen=MAX_SAMPLES)}
+        series["count"] += 1
+        series["sum"] += value
+        series["samples"].append(value)
+
+
+def _percentile(ordered: list, fraction: float) -> float:
+    if not ordered:
+        return 0.0
+    position = min(len(ordered) - 1, int(round(fraction * (len(ordered) - 1))))
+    return ordered[position]
+
+
+# resumo de todos os contadores e séries com p50/p95/p99
+def summary() -> dict:
+    with _lock:
+        result = {"counters": {_display(key): value for key, value in _counters.items()}, "timings": {}}
+        for key, series in _series.items():
+            ordered = sorted(series["samples"])
+            result["timings"][_display(key)] = {
+                "count": series["count"],
+                "mean": series["sum"] / series["count"] if series["count"] else 0.0,
+                "p50": _percentile(ordered, 0.50),
+                "p95": _percentile(ordered, 0.95),
+                "p99": _percentile(ordered, 0.99),
+            }
+    return result
+
+
+def _metric_name(name: str) -> str:
+    return PROMETHEUS_PREFIX + re.sub(r"[^a-zA-Z0-9_]", "_", name)
+
+
+# todas as métricas no formato de texto do prometheus: contadores como "counter", séries
+# como "summary" (quantis das últimas observações + _sum e _count). caches recebe
+# {nome do cache: stats()} e vira gauges rag_cache_<campo>{cache="nome"}
+def render_prometheus(caches: dict = None) -> str:
+    lines = []
+    with _lock:
+        counters = sorted(_counters.items())
+        series = sorted((key, value["count"], value["sum"], sorted(value["samples"])) for key, value in _series.items())
+
+    declared = set()
+    for (name, labels), value in counters:
+        metric = _metric_name(name)
+        if metric not in declared:
+            declared.add(metric)
+            lines.append(f"# TYPE {metric} counter")
+        lines.append(f"{metric}{_labels_text(labels)} {value}")
+
+    for (name, labels), count, total, ordered in series:
+        metric = _metric_name(name)
+        if metric not in declared:
+            declared.add(metric)
+            lines.append(f"# TYPE {metric} summary")
+        for quantile in (0.5, 0.95, 0.99):
+            value = _percentile(ordered, quantile)
+            lines.append(f"{metric}{_labels_text(labels, (('quantile', quantile),))} {value}")
+        lines.append(f"{metric}_sum{_labels_text(labels)} {total}")
+        lines.append(f"{metric}_count{_labels_text(labels)} {count}")
+
+    gauges = {}
+    for cache, stats in (caches or {}).items():
+        for field, value in stats.items():
+            if isinstance(value, (int, float)) and not isinstance(value, bool):
+                gauges.setdefault(_metric_name(f"cache_{field}"), []).append((cache, value))
+    for metric, values in sorted(gauges.items()):
+        lines.append(f"# TYPE {metric} gauge")
+        for cache, value in values:
+            lines.append(f"{metric}{_labels_text((('cache', cache),))} {value}")
+    return "\n".join(lines) + "\n"
+
+
+# serve o /metrics numa thread, para processos sem a api (o worker). caches é uma função
+# que devolve o dict passado para render_prometheus a cada coleta
+def start_http_server(port: int, caches=None):
+    from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+    class Handler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            if self.path.split("?")[0] != "/metrics":
+                self.send_error(404)
+                return
+            body = render_prometheus(caches() if caches else None).encode("utf-8")
+            self.send_response(200)
+            self.send_header("Content-Type", "text/plain; version=0.0.4")
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        # sem uma linha de log a cada coleta
+        def log_message(self, format, *args):
+            pass
+
+    server = ThreadingHTTPServer(("0.0.0.0", port), Handler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    print(f"Metriche Prometheus su http://0.0.0.0:{port}/metrics")
+    return server
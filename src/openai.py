@@ -1,32 +1,85 @@
 from dotenv import load_dotenv
 load_dotenv()
-from openai import AzureOpenAI
+from openai import AzureOpenAI, AsyncAzureOpenAI
+import asyncio
 import os
+import time
 import tiktoken
+from concurrent.futures import ThreadPoolExecutor
+from src import clients, embedding_cache, metrics
 
-client = AzureOpenAI(
-    api_key=os.getenv("AZURE_OPENAI_KEY"),
-    azure_endpoint=os.getenv("AZURE_OPENAI_ENDPOINT"),
-    api_version = "2024-12-01-preview"
-)
+# os clientes são criados no primeiro uso (src/clients.py) e dividem o pool de conexões
+def _create_client():
+    return AzureOpenAI(
+        api_key=os.getenv("AZURE_OPENAI_KEY"),
+        azure_endpoint=os.getenv("AZURE_OPENAI_ENDPOINT"),
+        api_version = "2024-12-01-preview",
+        http_client=clients.http_client()
+    )
+
+# cliente assíncrono usado pelo caminho de requisição do /chat, para não bloquear o event loop
+def _create_async_client():
+    return AsyncAzureOpenAI(
+        api_key=os.getenv("AZURE_OPENAI_KEY"),
+        azure_endpoint=os.getenv("AZURE_OPENAI_ENDPOINT"),
+        api_version = "2024-12-01-preview",
+        http_client=clients.async_http_client()
+    )
+
+clients.register("openai", _create_client)
+clients.register("openai_async", _create_async_client)
 
 embedding_deployment = os.getenv("AZURE_OPENAI_EMBEDDING_DEPLOYMENT")
 deployment = os.getenv("AZURE_OPENAI_DEPLOYMENT")
+# tamanho dos embeddings: vazio usa o tamanho nativo do modelo. valores menores só valem para
+# modelos que aceitam o parâmetro dimensions (text-embedding-3-*), e o índice precisa ter o
+# mesmo tamanho (VECTOR_DIMENSIONS em search_backends usa este valor por padrão)
+EMBEDDING_DIMENSIONS = int(os.getenv("EMBEDDING_DIMENSIONS", "0")) or None
+_embedding_options = {"dimensions": EMBEDDING_DIMENSIONS} if EMBEDDING_DIMENSIONS else {}
+# modelo usado na chave do cache: vetores de tamanhos diferentes não se misturam
+_embedding_cache_model = f"{embedding_deployment}@{EMBEDDING_DIMENSIONS}" if EMBEDDING_DIMENSIONS else embedding_deployment
+
+# limites por requisição do endpoint de embeddings (o azure aceita até 2048 inputs,
+# mas o limite de tokens por requisição é o que costuma pesar primeiro)
+EMBEDDING_BATCH_MAX_INPUTS = int(os.getenv("EMBEDDING_BATCH_MAX_INPUTS", "256"))
+EMBEDDING_BATCH_MAX_TOKENS = int(os.getenv("EMBEDDING_BATCH_MAX_TOKENS", "100000"))
+# limite de tokens de um único input aceito pelo modelo de embedding
+EMBEDDING_MAX_INPUT_TOKENS = 8191
+# quantos lotes podem estar em voo ao mesmo tempo
+EMBEDDING_MAX_CONCURRENCY = int(os.getenv("EMBEDDING_MAX_CONCURRENCY", "4"))
+EMBEDDING_MAX_RETRIES = int(os.getenv("EMBEDDING_MAX_RETRIES", "3"))
  
+_encoding = None
+_encoding_loaded = False
+
+# encoder do tiktoken carregado uma única vez por processo. get_encoding pode baixar o
+# arquivo do bpe na primeira vez; se falhar (sem rede), a falha também fica guardada
+# e as contagens passam a usar uma estimativa
+def get_encoding():
+    global _encoding, _encoding_loaded
+    if not _encoding_loaded:
+        try:
+            _encoding = tiktoken.get_encoding("cl100k_base")
+        except Exception as e:
+            print(f"Encoder tiktoken non disponibile, uso una stima dei token: {e}")
+            _encoding = None
+        _encoding_loaded = True
+    return _encoding
+
+# tokens de um texto; sem encoder usa uma estimativa conservadora de 1 token a cada 3 caracteres
+def text_tokens(text: str) -> int:
+    encoding = get_encoding()
+    return len(encoding.encode(text)) if encoding else len(text) // 3 + 1
+
+# tokens de uma única mensagem (role + content), sem os metadados guardados na sessão
+def message_tokens(message: dict) -> int:
+    #adiciona 6 tokens por mensagem
+    return 6 + sum(text_tokens(message[key]) for key in ("role", "content", "name") if message.get(key))
+
 #funcao responsavel por contar os tokens
 def count_tokens(messages: list):
-    try:
-        encoding = tiktoken.get_encoding("cl100k_base")
-    except Exception:
-        return 0
-    token_count = 0
-    for message in messages:
-        #adiciona 6 tokens por mensagem
-        token_count += 6
-        for key, value in message.items():
-            token_count += len(encoding.encode(value))
-
-    #adiciona 2 tokens para a sequencia de conclusao        
+    token_count = sum(message_tokens(message) for message in messages)
+    #adiciona 2 tokens para a sequencia de conclusao
     return token_count + 2
 
 
@@ -42,39 +95,211 @@ def get_embedding(text: str):
     if not text.strip():
         print("input vuoto o spazi vuoti.")
         return None
+
+    # consulta o cache em disco antes de chamar o endpoint
+    cache_key = embedding_cache.make_key(_embedding_cache_model, text)
+    cached = embedding_cache.get(cache_key)
+    if cached is not None:
+        return cached
     try:
-        response = client.embeddings.create(
+        metrics.increment("openai_embedding_requests_total", labels={"mode": "single"})
+        response = clients.get("openai").embeddings.create(
             model=embedding_deployment,
-            input=text
+            input=text,
+            **_embedding_options
         )
-        return response.data[0].embedding
+        embedding = embedding_cache.normalize(response.data[0].embedding)
+        embedding_cache.put(cache_key, embedding)
+        return embedding
     except Exception as e:
         print(
             f"Errore nella creazione dell'embedding", e)
         return None
 
-#gera respostas do gpt baseadas no contexto recuperado do azure search
-def chat_with_context(context: str, question: str, history: list):
-   # mensagem do Sistema (contém o Contexto RAG)
-    system_message = {
-        "role": "system", 
-        "content": (
-            f"You are a RAG assistant. Respond ONLY based on the following context. "
-            f"If the answer is not explicitly in context, "
-            f"you MUST respond that the information was not found in the document. "
-            f"Use the conversation chronology to maintain the contest:\n\n{context}"
+# versão assíncrona de get_embedding, usada no caminho de consulta do /chat
+async def get_embedding_async(text: str):
+    if not isinstance(text, str) or not text.strip():
+        print("input vuoto o non valido.")
+        return None
+
+    cache_key = embedding_cache.make_key(_embedding_cache_model, text)
+    cached = embedding_cache.get(cache_key)
+    if cached is not None:
+        return cached
+    try:
+        metrics.increment("openai_embedding_requests_total", labels={"mode": "query"})
+        response = await clients.get("openai_async").embeddings.create(
+            model=embedding_deployment,
+            input=text,
+            **_embedding_options
+        )
+        embedding = embedding_cache.normalize(response.data[0].embedding)
+        # a escrita pode esperar pela trava do banco enquanto o worker grava; fora do event loop
+        await asyncio.to_thread(embedding_cache.put, cache_key, embedding)
+        return embedding
+    except Exception as e:
+        print(
+            "Errore nella creazione dell'embedding", e)
+        return None
+
+# divide os inputs em lotes que respeitam o limite de inputs e de tokens por requisição
+def _pack_batches(items: list, max_inputs: int, max_tokens: int):
+    batches = []
+    current = []
+    current_tokens = 0
+    for position, text in items:
+        tokens = text_tokens(text)
+        if tokens > EMBEDDING_MAX_INPUT_TOKENS:
+            print(f"input {position} troppo lungo per l'embedding ({tokens} token).")
+            continue
+        if current and (len(current) >= max_inputs or current_tokens + tokens > max_tokens):
+            batches.append(current)
+            current = []
+            current_tokens = 0
+        current.append((position, text))
+        current_tokens += tokens
+    if current:
+        batches.append(current)
+    return batches
+
+
+# envia um lote para o endpoint e devolve {posição: embedding}; em caso de falha
+# tenta de novo apenas os itens que não voltaram, dividindo o lote ao meio para isolar inputs ruins
+def _embed_batch(batch: list, attempt: int, max_retries: int) -> dict:
+    embeddings = {}
+    metrics.increment("openai_embedding_requests_total", labels={"mode": "batch"})
+    metrics.increment("openai_embedding_inputs_total", len(batch))
+    try:
+        response = clients.get("openai").embeddings.create(
+            model=embedding_deployment,
+            input=[text for _, text in batch],
+            **_embedding_options
         )
-    }
+        for item in response.data:
+            embeddings[batch[item.index][0]] = item.embedding
+    except Exception as e:
+        print(f"Errore nella creazione del lotto di embedding ({len(batch)} input):", e)
+
+    failed = [entry for entry in batch if entry[0] not in embeddings]
+    if not failed or attempt >= max_retries:
+        return embeddings
+
+    # backoff exponencial antes de tentar de novo
+    metrics.increment("openai_retries_total", labels={"operation": "embedding"})
+    time.sleep(0.5 * 2 ** attempt)
+    middle = max(1, len(failed) // 2)
+    for part in (failed[:middle], failed[middle:]):
+        if part:
+            embeddings.update(_embed_batch(part, attempt + 1, max_retries))
+    return embeddings
+
+
+# gera embeddings para muitos textos agrupando-os em poucas requisições executadas em paralelo.
+# devolve uma lista alinhada com os textos de entrada, com None para inputs inválidos ou que falharam
+def get_embeddings_batch(texts: list,
+                         max_inputs: int = EMBEDDING_BATCH_MAX_INPUTS,
+                         max_tokens: int = EMBEDDING_BATCH_MAX_TOKENS,
+                         max_concurrency: int = EMBEDDING_MAX_CONCURRENCY,
+                         max_retries: int = EMBEDDING_MAX_RETRIES) -> list:
+    results = [None] * len(texts)
 
-    #constrói a lista de mensagens completa sistema + histórico + pergunta Atual
-    messages = [system_message] + history
+    # descarta inputs que não são strings ou estão vazios, como faz get_embedding
+    valid = [(i, t) for i, t in enumerate(texts) if isinstance(t, str) and t.strip()]
+    if len(valid) < len(texts):
+        print(f"{len(texts) - len(valid)} input non validi ignorati.")
+    if not valid:
+        return results
 
-    #adiciona a pergunta atual
-    messages.append({"role": "user", "content": question})
+    # só vai para o endpoint o que não estiver no cache; textos repetidos são enviados uma vez só
+    keys = {i: embedding_cache.make_key(_embedding_cache_model, t) for i, t in valid}
+    cached = embedding_cache.get_many(list(keys.values()))
+    to_embed = {}
+    for i, text in valid:
+        if keys[i] in cached:
+            results[i] = cached[keys[i]]
+        else:
+            to_embed.setdefault(keys[i], (i, text))
+    if not to_embed:
+        return results
 
+    batches = _pack_batches(list(to_embed.values()), max_inputs, max_tokens)
+    new_embeddings = {}
+    with ThreadPoolExecutor(max_workers=max(1, max_concurrency)) as executor:
+        for embeddings in executor.map(lambda b: _embed_batch(b, 0, max_retries), batches):
+            for position, embedding in embeddings.items():
+                new_embeddings[keys[position]] = embedding_cache.normalize(embedding)
+    embedding_cache.put_many(new_embeddings)
+
+    for i, _ in valid:
+        if results[i] is None:
+            results[i] = new_embeddings.get(keys[i])
+
+    return results
+
+# as mensagens (sistema + histórico + pergunta) são montadas por src/prompt.py
+
+# contadores de tokens do chat (rag_openai_*_tokens_total). usa o uso informado pela api;
+# sem ele (respostas em streaming) os tokens são contados localmente
+def record_chat_tokens(messages_or_tokens, completion: str = None, usage=None):
+    if usage is not None:
+        prompt_tokens, completion_tokens = usage.prompt_tokens, usage.completion_tokens
+    else:
+        prompt_tokens = messages_or_tokens if isinstance(messages_or_tokens, int) else count_tokens(messages_or_tokens)
+        completion_tokens = text_tokens(completion or "")
+    metrics.increment("openai_chat_requests_total")
+    metrics.increment("openai_prompt_tokens_total", prompt_tokens or 0)
+    metrics.increment("openai_completion_tokens_total", completion_tokens or 0)
+
+#gera respostas do gpt baseadas no contexto recuperado do azure search
+def chat_completion(messages: list):
     # envia para o azure openai
-    response = client.chat.completions.create(
+    response = clients.get("openai").chat.completions.create(
         model=deployment,
         messages=messages
     )
-    return response.choices[0].message.content
\ No newline at end of file
+    answer = response.choices[0].message.content
+    record_chat_tokens(messages, answer, getattr(response, "usage", None))
+    return answer
+
+# versão assíncrona de chat_completion
+async def chat_completion_async(messages: list):
+    response = await clients.get("openai_async").chat.completions.create(
+        model=deployment,
+        messages=messages
+    )
+    answer = response.choices[0].message.content
+    record_chat_tokens(messages, answer, getattr(response, "usage", None))
+    return answer
+
+# resume os turnos que saíram da janela do histórico, junto com o resumo anterior (se houver)
+async def summarize_history_async(previous_summary: str, messages: list, max_tokens: int = 300) -> str:
+    transcript = "\n".join(f"{m['role']}: {m['content']}" for m in messages)
+    prompt = (
+        "Summarize the earlier part of this conversation so it can replace it as context. "
+        "Keep facts, names, numbers and open questions; be concise.\n\n"
+        f"Previous summary:\n{previous_summary or '-'}\n\nConversation:\n{transcript}"
+    )
+    messages = [{"role": "user", "content": prompt}]
+    response = await clients.get("openai_async").chat.completions.create(
+        model=deployment,
+        messages=messages,
+        max_tokens=max_tokens
+    )
+    summary = response.choices[0].message.content or ""
+    record_chat_tokens(messages, summary, getattr(response, "usage", None))
+    return summary
+
+# gera a resposta em streaming, devolvendo os pedaços de texto conforme chegam.
+# se o consumidor parar antes do fim (cliente desconectou), a requisição ao azure é fechada
+async def stream_chat_completion(messages: list):
+    stream = await clients.get("openai_async").chat.completions.create(
+        model=deployment,
+        messages=messages,
+        stream=True
+    )
+    try:
+        async for chunk in stream:
+            if chunk.choices and chunk.choices[0].delta.content:
+                yield chunk.choices[0].delta.content
+    finally:
+        await stream.response.aclose()
@@ -0,0 +1,95 @@
+import os
+from src import openai, chunking
+
+# montagem do prompt do /chat num lugar só: o mesmo texto de sistema é usado para contar
+# os tokens e para chamar o modelo. os trechos recuperados entram na ordem da busca
+# até encher o orçamento, cortados no fim de uma frase e com a fonte de cada um
+PROMPT_CONTEXT_TOKENS = int(os.getenv("PROMPT_CONTEXT_TOKENS", "3000"))
+# sobra mínima para valer a pena incluir um trecho cortado
+PROMPT_MIN_CHUNK_TOKENS = int(os.getenv("PROMPT_MIN_CHUNK_TOKENS", "40"))
+
+SYSTEM_PROMPT = (
+    "CRITICAL RULE: If the user message is a simple greeting in ANY language, respond with a polite greeting and short question. "
+    "Ignore RAG instructions for this turn.\n\n"
+    "You are a RAG assistant. Respond ONLY based on the following context. "
+    "If the answer is not explicitly in context, respond: 'The information was not found in the document.'\n"
+    "Each excerpt starts with its number and source. "
+    "Use the conversation chronology to maintain the context:\n\n{context}"
+)
+
+# corta o texto no fim da última frase que ainda cabe em max_tokens ("" se nem a primeira cabe)
+def truncate_to_tokens(text: str, max_tokens: int) -> str:
+    if openai.text_tokens(text) <= max_tokens:
+        return text
+    kept = []
+    used = 0
+    for sentence in chunking.split_sentences(text):
+        # o espaço entre as frases conta como mais um token
+        tokens = openai.text_tokens(sentence) + 1
+        if used + tokens > max_tokens:
+            break
+        kept.append(sentence)
+        used += tokens
+    return " ".join(kept)
+
+
+def _label(position: int, result: dict) -> str:
+    return f"[{position}] source: {result.get('source') or '-'} (id: {result['id']})\n"
+
+
+# enche o orçamento de tokens com os resultados da busca, na ordem em que vêm (a busca já os
+# ordena; com o mmr a ordem de escolha não segue a pontuação da fusão).
+# devolve {"context": texto, "results": resultados usados, "tokens": tokens do contexto}
+def pack_context(results: list, max_tokens: int = PROMPT_CONTEXT_TOKENS) -> dict:
+    parts = []
+    used_results = []
+    used = 0
+    for result in results:
+        content = (result.get("content") or "").strip()
+        if not content:
+            continue
+        label = _label(len(parts) + 1, result)
+        # trechos separados por linha em branco (~2 tokens)
+        overhead = openai.text_tokens(label) + 2
+        remaining = max_tokens - used - overhead
+        if remaining < PROMPT_MIN_CHUNK_TOKENS:
+            break
+        text = truncate_to_tokens(content, remaining)
+        if not text:
+            continue
+        parts.append(label + text)
+        used_results.append({**result, "truncated": text != content})
+        used += overhead + openai.text_tokens(text)
+
+    context = "\n\n".join(parts)
+    return {"context": context, "results": used_results, "tokens": openai.text_tokens(context)}
+
+
+def system_message(context: str) -> dict:
+    return {"role": "system", "content": SYSTEM_PROMPT.format(context=context)}
+
+
+# tokens do prompt sem contexto nem histórico (instruções + pergunta)
+def base_tokens(question: str) -> int:
+    return openai.count_tokens([system_message(""), {"role": "user", "content": question}])
+
+
+# mensagens enviadas ao modelo (sistema + histórico + pergunta) e os tokens de cada parte.
+# history_tokens é a contagem já guardada na sessão; sem ela o histórico é codificado aqui
+def build_prompt(context: str, question: str, history: list, history_tokens: int = None) -> dict:
+    system = system_message(context)
+    user = {"role": "user", "content": question}
+    system_tokens = openai.message_tokens(system)
+    question_tokens = openai.message_tokens(user)
+    if history_tokens is None:
+        history_tokens = sum(openai.message_tokens(m) for m in history)
+    return {
+        "messages": [system] + history + [user],
+        "tokens": {
+            "system": system_tokens,
+            "history": history_tokens,
+            "question": question_tokens,
+            # mesma conta de openai.count_tokens: +2 da sequência de conclusão
+            "total": system_tokens + history_tokens + question_tokens + 2,
+        },
+    }
@@ -0,0 +1,115 @@
+import os
+import shutil
+from src.local_index import LocalVectorIndex
+from src.bm25_index import BM25Index
+
+# backends de recuperação que o search_service pode usar no lugar do azure ai search.
+# SEARCH_BACKEND=azure (padrão) mantém o comportamento atual; SEARCH_BACKEND=local usa
+# os índices em disco deste processo, sem nenhuma chamada de rede
+SEARCH_BACKEND = os.getenv("SEARCH_BACKEND", "azure").lower()
+LOCAL_INDEX_DIR = os.getenv("LOCAL_INDEX_DIR", ".cache/local_index")
+LOCAL_INDEX_DTYPE = os.getenv("LOCAL_INDEX_DTYPE", "float32")
+# tamanho dos vetores do índice; por padrão o mesmo dos embeddings (EMBEDDING_DIMENSIONS)
+VECTOR_DIMENSIONS = int(os.getenv("VECTOR_DIMENSIONS") or os.getenv("EMBEDDING_DIMENSIONS") or "1536")
+# compressão dos vetores do índice local (SEARCH_BACKEND=local): none, scalar (int8) ou binary.
+# a busca percorre os vetores comprimidos e repontua os k * VECTOR_OVERSAMPLING melhores
+# candidatos com os vetores originais. no azure não tem efeito (o azure-search-documents 11.4
+# não tem quantização). mudar o tamanho dos vetores pede python worker.py reindex
+VECTOR_COMPRESSION = os.getenv("VECTOR_COMPRESSION", "none").lower()
+VECTOR_OVERSAMPLING = float(os.getenv("VECTOR_OVERSAMPLING", "4"))
+# nome da quantização do índice local para cada compressão
+LOCAL_QUANTIZATION = {"none": "none", "scalar": "int8", "int8": "int8", "binary": "binary"}
+# compacta o índice quando a fração de tombstones passa deste valor
+COMPACTION_RATIO = float(os.getenv("LOCAL_INDEX_COMPACTION_RATIO", "0.3"))
+
+
+# interface que todo backend de recuperação implementa; os resultados são dicts
+# com pelo menos "id", "content" e "score". sources (opcional) restringe a busca aos
+# chunks desses documentos
+class SearchBackend:
+    def create_index(self):
+        raise NotImplementedError
+
+    def upload(self, docs: list):
+        raise NotImplementedError
+
+    def delete(self, ids: list):
+        raise NotImplementedError
+
+    def vector_search(self, vector, k: int, sources=None) -> list:
+        raise NotImplementedError
+
+    def text_search(self, query: str, top: int, sources=None) -> list:
+        raise NotImplementedError
+
+    # vetores dos documentos com esses ids (uma linha por id), para a diversificação (mmr)
+    def get_vectors(self, ids: list):
+        raise NotImplementedError
+
+
+# filtro por documento de origem para os índices locais (None = sem filtro)
+def _source_filter(sources):
+    if not sources:
+        return None
+    allowed = set(sources)
+    return lambda row: row.get("source") in allowed
+
+
+class LocalSearchBackend(SearchBackend):
+    def __init__(self, directory: str = LOCAL_INDEX_DIR, dimensions: int = VECTOR_DIMENSIONS,
+                 dtype: str = LOCAL_INDEX_DTYPE, compression: str = VECTOR_COMPRESSION):
+        self.directory = directory
+        self.dimensions = dimensions
+        self.dtype = dtype
+        self.compression = compression
+        self._open()
+
+    def _open(self):
+        self.vectors = LocalVectorIndex(
+            os.path.join(self.directory, "vectors"), self.dimensions, self.dtype,
+            LOCAL_QUANTIZATION.get(self.compression, self.compression), VECTOR_OVERSAMPLING
+        )
+        self.keywords = BM25Index(os.path.join(self.directory, "bm25"))
+
+    def create_index(self):
+        # os arquivos são criados sob demanda pelo próprio índice
+        return
+
+    # apaga os índices em disco e começa vazio (reindexação)
+    def reset(self):
+        shutil.rmtree(self.directory, ignore_errors=True)
+        self._open()
+
+    def upload(self, docs: list):
+        self.vectors.upsert(docs)
+        self.keywords.upsert(docs)
+
+    def delete(self, ids: list):
+        self.vectors.delete(ids)
+        self.keywords.delete(ids)
+        if self.vectors.tombstone_ratio() > COMPACTION_RATIO:
+            self.vectors.compact()
+        if self.keywords.tombstone_ratio() > COMPACTION_RATIO:
+            self.keywords.compact()
+
+    def vector_search(self, vector, k: int, sources=None) -> list:
+        return self.vectors.search(vector, k, filter_fn=_source_filter(sources))
+
+    def text_search(self, query: str, top: int, sources=None) -> list:
+        return self.keywords.search(query, top, filter_fn=_source_filter(sources))
+
+    def get_vectors(self, ids: list):
+        return self.vectors.get_vectors(ids)
+
+
+_local_backend = None
+
+
+# devolve o backend local (criado uma vez por processo) ou None quando o backend é o azure
+def get_backend():
+    global _local_backend
+    if SEARCH_BACKEND != "local":
+        return None
+    if _local_backend is None:
+        _local_backend = LocalSearchBackend()
+    return _local_backend
@@ -1,5 +1,6 @@
 from azure.core.credentials import AzureKeyCredential
 from azure.search.documents import SearchClient
+from azure.search.documents.aio import SearchClient as AsyncSearchClient
 from azure.search.documents.indexes import SearchIndexClient
 from azure.search.documents.indexes.models import (
     SearchIndex, SimpleField, SearchFieldDataType, SearchableField,
@@ -7,36 +8,78 @@ from azure.search.documents.indexes.models import (
     HnswAlgorithmConfiguration, SearchField
 )
 import os
-from src.openai import get_embedding
+import asyncio
+import numpy as np
+from azure.core.exceptions import ResourceNotFoundError
+from concurrent.futures import ThreadPoolExecutor
+from src.openai import get_embedding, get_embeddings_batch, get_embedding_async
 from azure.search.documents.models import VectorizedQuery
-import uuid
+from src.search_backends import get_backend, VECTOR_DIMENSIONS, VECTOR_COMPRESSION
+from src import clients, ingest_manifest, tracing
+import hashlib
 
 search_endpoint = os.getenv("AZURE_AISEARCH_ENDPOINT")
 search_key = os.getenv("AZURE_AISEARCH_KEY")
 index_name = os.getenv("AZURE_AISEARCH_INDEX_NAME")
 
-search_client = SearchClient(search_endpoint, index_name, AzureKeyCredential(search_key))
-index_client = SearchIndexClient(search_endpoint, AzureKeyCredential(search_key))
+# quantos documentos vão em cada requisição de escrita (o azure aceita até 1000 por lote)
+UPLOAD_BATCH_SIZE = int(os.getenv("AZURE_AISEARCH_UPLOAD_BATCH_SIZE", "100"))
+# casas decimais dos vetores enviados. o índice guarda float32, e com 9 casas o erro (até
+# 5e-10 por dimensão) não muda a ordem dos resultados, enquanto o json fica ~40% menor que
+# com a representação completa de cada float (os vetores do cache voltam como float32)
+VECTOR_UPLOAD_DECIMALS = int(os.getenv("VECTOR_UPLOAD_DECIMALS", "9"))
+VECTOR_PROFILE_NAME = "vectorProfile"
+VECTOR_ALGORITHM_NAME = "hnsw-config"
+
+# clientes criados no primeiro uso (src/clients.py): importar o módulo não abre conexões
+clients.register("search", lambda: SearchClient(
+    search_endpoint, index_name, AzureKeyCredential(search_key), transport=clients.azure_transport()))
+clients.register("search_index", lambda: SearchIndexClient(
+    search_endpoint, AzureKeyCredential(search_key), transport=clients.azure_transport()))
+# cliente assíncrono para as buscas feitas durante o /chat
+clients.register("search_async", lambda: AsyncSearchClient(
+    search_endpoint, index_name, AzureKeyCredential(search_key), transport=clients.azure_async_transport()))
 
 
 # cria o índice vetorial se ainda não existir.
 def create_vector_index():
-    try:
-        index_client.get_index(index_name)
-        print("L'indice gia esiste.")
+    # com SEARCH_BACKEND=local o índice fica em disco e não há nada no azure para criar
+    backend = get_backend()
+    if backend is not None:
+        backend.create_index()
         return
+
+    try:
+        existing = clients.get("search_index").get_index(index_name)
     except:
-        pass
+        existing = None
 
-    VECTOR_DIMENSIONS = 1536
-    VECTOR_PROFILE_NAME = "vectorProfile"
-    VECTOR_ALGORITHM_NAME = "hnsw-config"
+    if existing is not None:
+        # índices criados antes do campo "source" recebem o campo (adicionar campos é permitido)
+        if not any(field.name == "source" for field in existing.fields):
+            existing.fields.append(
+                SimpleField(name="source", type=SearchFieldDataType.String, filterable=True)
+            )
+            clients.get("search_index").create_or_update_index(existing)
+            print("Campo 'source' aggiunto all'indice.")
+        vector_field = next((field for field in existing.fields if field.name == "contentVector"), None)
+        if vector_field is not None and vector_field.vector_search_dimensions != VECTOR_DIMENSIONS:
+            print(f"L'indice ha vettori di {vector_field.vector_search_dimensions} dimensioni, la configurazione "
+                  f"ne chiede {VECTOR_DIMENSIONS}: esegui 'python worker.py reindex'.")
+        print("L'indice gia esiste.")
+        return
 
+    # a compressão dos vetores (VECTOR_COMPRESSION) é só do índice local: o
+    # azure-search-documents 11.4 não tem as classes de quantização do índice
+    if VECTOR_COMPRESSION != "none":
+        print(f"VECTOR_COMPRESSION={VECTOR_COMPRESSION} vale solo per l'indice locale: indice Azure senza compressione.")
     index = SearchIndex(
         name=index_name,
         fields=[
             SimpleField(name="id", type=SearchFieldDataType.String, key=True),
             SearchableField(name="content", type=SearchFieldDataType.String),
+            # documento de origem do chunk, para mostrar a fonte e filtrar por documento
+            SimpleField(name="source", type=SearchFieldDataType.String, filterable=True),
 
             SearchField(
                 name="contentVector",
@@ -66,68 +109,348 @@ def create_vector_index():
             ]
         )
     )
-    
-    index_client.create_index(index)
-    print("Indice creato con successo!")
+
+    clients.get("search_index").create_index(index)
+    print(f"Indice creato con successo! ({VECTOR_DIMENSIONS} dimensioni)")
+
+
+# apaga e recria o índice com a configuração atual (tamanho dos vetores; no local, a compressão).
+# os documentos precisam ser ingeridos de novo depois (python worker.py reindex)
+def recreate_vector_index():
+    backend = get_backend()
+    if backend is not None:
+        backend.reset()
+        return
+    try:
+        clients.get("search_index").delete_index(index_name)
+        print(f"Indice {index_name} eliminato.")
+    except ResourceNotFoundError:
+        pass
+    create_vector_index()
+
+
+# vetor com VECTOR_UPLOAD_DECIMALS casas, para o corpo do envio
+def compact_vector(embedding) -> list:
+    return np.round(np.asarray(embedding, dtype=np.float64), VECTOR_UPLOAD_DECIMALS).tolist()
+
+# id determinístico de um chunk: o mesmo conteúdo da mesma origem gera sempre o mesmo id,
+# assim reenviar um documento sobrescreve os chunks em vez de duplicá-los
+def make_chunk_id(source_doc_id: str, content, prefix: str = "") -> str:
+    data = content if isinstance(content, bytes) else content.encode("utf-8")
+    digest = hashlib.sha256(data).hexdigest()[:32]
+    return f"{source_doc_id}-{prefix}{digest}"
 
 # envia embeddings ao indice
-def upload_documents(chunks):
-    docs = []
-    for chunk in chunks:
-        content = chunk.get("content") if isinstance(chunk, dict) else str(chunk)
+def upload_documents(chunks, source_doc_id: str = "doc"):
+    contents = [chunk.get("content") if isinstance(chunk, dict) else str(chunk) for chunk in chunks]
+
+    # reaproveita os vetores já calculados e gera em lote apenas os que faltam
+    embeddings = [chunk.get("contentVector") if isinstance(chunk, dict) else None for chunk in chunks]
+    missing = [i for i, embedding in enumerate(embeddings) if not embedding]
+    if missing:
+        for i, embedding in zip(missing, get_embeddings_batch([contents[i] for i in missing])):
+            embeddings[i] = embedding
 
-        # gera o embedding
-        embedding = get_embedding(content)
+    docs = []
+    for chunk, content, embedding in zip(chunks, contents, embeddings):
         if not embedding:
             continue
 
+        chunk_id = chunk.get("id") if isinstance(chunk, dict) else None
+        source = chunk.get("source") if isinstance(chunk, dict) else None
         doc = {
-            "id": str(uuid.uuid4()),
+            "id": chunk_id or make_chunk_id(source_doc_id, content),
             "content": content,
-            "contentVector": embedding,  
+            "source": source or source_doc_id,
+            "contentVector": compact_vector(embedding),
         }
         docs.append(doc)
 
-    search_client.upload_documents(docs)
+    backend = get_backend()
+    if backend is not None:
+        backend.upload(docs)
+        return [doc["id"] for doc in docs]
+
+    # upload no azure é um upsert pela chave, então reenvios não duplicam documentos
+    for start in range(0, len(docs), UPLOAD_BATCH_SIZE):
+        clients.get("search").upload_documents(docs[start:start + UPLOAD_BATCH_SIZE])
+    return [doc["id"] for doc in docs]
+
+# remove do indice os chunks que não existem mais na origem
+def delete_documents(ids):
+    ids = list(ids)
+    backend = get_backend()
+    if backend is not None:
+        backend.delete(ids)
+        return
+
+    for start in range(0, len(ids), UPLOAD_BATCH_SIZE):
+        clients.get("search").delete_documents([{"id": doc_id} for doc_id in ids[start:start + UPLOAD_BATCH_SIZE]])
 
 # busca trechos mais relevantes no indice
 def search_semantic(query: str):
-    query_vector = get_embedding(query)
+    return [r["content"] for r in search_vector_scored(query, 20) if r["content"]]
+
+
+#busca textual simples 
+def search_textual(query: str):
+    return [r["content"] for r in search_text_scored(query, 5) if r["content"]]
+
+# diversificação opcional dos resultados da busca híbrida (maximal marginal relevance): os
+# MMR_CANDIDATES primeiros da fusão viram candidatos e os top são escolhidos um a um pelo
+# que acrescentam, mmr_lambda * similaridade com a consulta - (1 - mmr_lambda) * maior
+# similaridade com um trecho já escolhido. evita mandar ao modelo vários trechos quase iguais
+# (parágrafos repetidos entre o layout e o texto do pymupdf, tabelas repetidas).
+# lambda 1 = só a similaridade com a consulta, 0 = só a diversidade
+MMR_ENABLED = os.getenv("MMR_ENABLED", "false").lower() == "true"
+MMR_LAMBDA = float(os.getenv("MMR_LAMBDA", "0.7"))
+MMR_CANDIDATES = int(os.getenv("MMR_CANDIDATES", "20"))
+
+# parâmetros padrão da busca híbrida; podem ser trocados em cada requisição
+HYBRID_DEFAULTS = {
+    "top": 5,
+    "vector_k": 20,
+    "text_k": 20,
+    "vector_weight": 1.0,
+    "text_weight": 1.0,
+    "rrf_k": 60,
+    # lista de documentos (campo source) aos quais a busca fica restrita; None = todos
+    "sources": None,
+    "mmr": MMR_ENABLED,
+    "mmr_lambda": MMR_LAMBDA,
+    "mmr_candidates": MMR_CANDIDATES,
+}
+
+# threads compartilhadas para executar as duas buscas da versão síncrona em paralelo
+_hybrid_executor = ThreadPoolExecutor(max_workers=8)
+
+# campos devolvidos pelas buscas com pontuação
+RESULT_FIELDS = ["id", "content", "source"]
+
+
+# campos pedidos ao azure; com vectors o vetor de cada resultado vem junto (para o mmr)
+def _result_fields(vectors: bool = False) -> list:
+    return RESULT_FIELDS + ["contentVector"] if vectors else RESULT_FIELDS
+
+
+def _to_result(r: dict) -> dict:
+    result = {
+        "id": r.get("id"),
+        "content": r.get("content"),
+        "source": r.get("source"),
+        "score": r.get("score", r.get("@search.score")),
+    }
+    if r.get("contentVector") is not None:
+        result["vector"] = r["contentVector"]
+    return result
+
+
+# filtro odata do azure search que restringe a busca aos documentos dados
+def source_filter(sources):
+    if not sources:
+        return None
+    values = "|".join(source.replace("'", "''") for source in sources)
+    return f"search.in(source, '{values}', '|')"
 
-    # crie a consulta vetorial
-    vector_query = VectorizedQuery(
-        vector=query_vector,
-        k_nearest_neighbors=20,
-        fields="contentVector"
+
+# busca vetorial com pontuação: [{"id", "content", "source", "score"}]; com vectors=True os
+# resultados do azure trazem também o "vector". depois de k os argumentos são só nomeados,
+# iguais nas versões síncrona e assíncrona
+def search_vector_scored(query: str, k: int = 20, *, sources=None, query_vector=None, vectors: bool = False):
+    if query_vector is None:
+        query_vector = get_embedding(query)
+    if query_vector is None:
+        return []
+
+    backend = get_backend()
+    if backend is not None:
+        return [_to_result(r) for r in backend.vector_search(query_vector, k, sources)]
+
+    vector_query = VectorizedQuery(vector=query_vector, k_nearest_neighbors=k, fields="contentVector")
+    results = clients.get("search").search(
+        search_text="", vector_queries=[vector_query], select=_result_fields(vectors), top=k,
+        filter=source_filter(sources)
     )
+    return [_to_result(r) for r in results]
+
+
+# busca textual com pontuação
+def search_text_scored(query: str, top: int = 20, *, sources=None, vectors: bool = False):
+    backend = get_backend()
+    if backend is not None:
+        return [_to_result(r) for r in backend.text_search(query, top, sources)]
 
-    results = search_client.search(
-        search_text="",  # texto vazio porque estamos usando vetor
-        vector_queries=[vector_query],
-        select=["content"]
+    results = clients.get("search").search(
+        search_text=query, top=top, select=_result_fields(vectors), filter=source_filter(sources)
     )
+    return [_to_result(r) for r in results]
 
-    # Retorne os resultados como lista
-    return [r["content"] for r in results if "content" in r]
 
+# reciprocal rank fusion ponderado: cada lista contribui peso / (rrf_k + posição) para o
+# chunk, identificado pelo id. um dicionário faz a deduplicação em O(n)
+def fuse_rrf(result_lists: list, weights: list, rrf_k: int = 60, top: int = 5) -> list:
+    fused = {}
+    for leg, (results, weight) in enumerate(zip(result_lists, weights)):
+        for rank, result in enumerate(results, start=1):
+            key = result.get("id") or result.get("content")
+            entry = fused.get(key)
+            if entry is None:
+                entry = fused[key] = {**result, "score": 0.0, "ranks": {}}
+            entry["score"] += weight / (rrf_k + rank)
+            entry["ranks"][leg] = rank
+    return sorted(fused.values(), key=lambda r: r["score"], reverse=True)[:top]
+
+
+# posições escolhidas por mmr entre os candidatos (uma linha de vectors por candidato), na
+# ordem de escolha. a similaridade entre todos os pares é uma única multiplicação de
+# matrizes; a cada passo a maior similaridade com os escolhidos é atualizada só com o último.
+# candidatos sem vetor (linha de zeros) ficam com similaridade 0 com tudo
+def mmr_select(query_vector, vectors, top: int, mmr_lambda: float = MMR_LAMBDA) -> list:
+    vectors = np.asarray(vectors, dtype=np.float32)
+    count = min(top, len(vectors))
+    if count <= 0:
+        return []
+    norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+    vectors = vectors / np.where(norms == 0, 1, norms)
+    query = np.asarray(query_vector, dtype=np.float32)
+    query = query / (np.linalg.norm(query) or 1)
+    relevance = mmr_lambda * (vectors @ query)
+    similarity = vectors @ vectors.T
+
+    selected = [int(np.argmax(relevance))]
+    redundancy = similarity[selected[0]]
+    chosen = np.zeros(len(vectors), dtype=bool)
+    chosen[selected[0]] = True
+    while len(selected) < count:
+        scores = relevance - (1 - mmr_lambda) * redundancy
+        scores[chosen] = -np.inf
+        best = int(np.argmax(scores))
+        selected.append(best)
+        chosen[best] = True
+        redundancy = np.maximum(redundancy, similarity[best])
+    return selected
+
+
+# aplica o mmr aos candidatos da fusão. os vetores vêm junto com os resultados do azure ou,
+# no backend local, do próprio índice; saem dos resultados antes de irem para o prompt
+def _diversify(query_vector, results: list, options: dict) -> list:
+    with tracing.span("search.mmr"):
+        returned = [result.pop("vector", None) for result in results]
+        if query_vector is None or not results:
+            return results[:options["top"]]
+        backend = get_backend()
+        if backend is not None:
+            vectors = backend.get_vectors([result["id"] for result in results])
+        else:
+            missing = np.zeros(len(query_vector), dtype=np.float32)
+            vectors = np.asarray([vector if vector is not None else missing for vector in returned], dtype=np.float32)
+        selected = mmr_select(query_vector, vectors, options["top"], options["mmr_lambda"])
+        return [results[position] for position in selected]
+
+
+def _fuse_hybrid(vector_results: list, text_results: list, options: dict, query_vector=None) -> list:
+    fused = fuse_rrf(
+        [vector_results, text_results],
+        [options["vector_weight"], options["text_weight"]],
+        rrf_k=options["rrf_k"],
+        # com o mmr a fusão devolve mais candidatos para a diversificação escolher
+        top=max(options["top"], options["mmr_candidates"]) if options["mmr"] else options["top"],
+    )
+    # identifica as posições pelo nome da busca em vez do índice da lista
+    for result in fused:
+        ranks = result.pop("ranks")
+        result["vector_rank"] = ranks.get(0)
+        result["text_rank"] = ranks.get(1)
+    if options["mmr"]:
+        fused = _diversify(query_vector, fused, options)
+    return fused
+
+
+# busca híbrida com as duas consultas executadas em paralelo e fundidas por rrf.
+# devolve resultados com pontuação, id do chunk e fonte
+def search_hybrid(query: str, **options):
+    options = {**HYBRID_DEFAULTS, **{k: v for k, v in options.items() if v is not None}}
+    # o mmr precisa do vetor da consulta e, no azure, dos vetores dos resultados
+    query_vector = get_embedding(query) if options["mmr"] else None
+    vectors = options["mmr"] and get_backend() is None
+    vector_future = _hybrid_executor.submit(
+        search_vector_scored, query, options["vector_k"],
+        sources=options["sources"], query_vector=query_vector, vectors=vectors
+    )
+    text_future = _hybrid_executor.submit(
+        search_text_scored, query, options["text_k"], sources=options["sources"], vectors=vectors
+    )
+    return _fuse_hybrid(vector_future.result(), text_future.result(), options, query_vector)
 
-#busca textual simples 
-def search_textual(query: str):
-    results = search_client.search(search_text=query, top=5, select=["content"])
-    return [r["content"] for r in results]
 
 #busca hibrida combinacao de semantica mais textual
 def search_hibryd(query: str):
-    vector_results = search_semantic(query)
-    textual_results = search_client.search(
-        search_text=query,
-        top=5,
-        select=["content"]
+    return [r["content"] for r in search_hybrid(query)]
+
+
+# versões assíncronas das buscas, usadas pelo /chat sem bloquear o event loop
+async def search_semantic_async(query: str):
+    return [r["content"] for r in await search_vector_scored_async(query, 20) if r["content"]]
+
+
+async def search_textual_async(query: str):
+    return [r["content"] for r in await search_text_scored_async(query, 5) if r["content"]]
+
+
+async def search_vector_scored_async(query: str, k: int = 20, *, sources=None, query_vector=None, vectors: bool = False):
+    if query_vector is None:
+        query_vector = await get_embedding_async(query)
+    if query_vector is None:
+        return []
+
+    backend = get_backend()
+    if backend is not None:
+        # a busca local é cpu (numpy), então roda numa thread para não travar o event loop
+        results = await asyncio.to_thread(backend.vector_search, query_vector, k, sources)
+        return [_to_result(r) for r in results]
+
+    vector_query = VectorizedQuery(vector=query_vector, k_nearest_neighbors=k, fields="contentVector")
+    results = await clients.get("search_async").search(
+        search_text="", vector_queries=[vector_query], select=_result_fields(vectors), top=k,
+        filter=source_filter(sources)
     )
-    text_results = [r["content"] for r in textual_results if "content" in r]
-    # remove duplicados mantendo a ordem
-    combined = []
-    for r in vector_results + text_results:
-        if r not in combined:
-            combined.append(r)
-    return combined[:5]
\ No newline at end of file
+    return [_to_result(r) async for r in results]
+
+
+async def search_text_scored_async(query: str, top: int = 20, *, sources=None, vectors: bool = False):
+    backend = get_backend()
+    if backend is not None:
+        results = await asyncio.to_thread(backend.text_search, query, top, sources)
+        return [_to_result(r) for r in results]
+
+    results = await clients.get("search_async").search(
+        search_text=query, top=top, select=_result_fields(vectors), filter=source_filter(sources)
+    )
+    return [_to_result(r) async for r in results]
+
+
+# busca hibrida com as duas consultas executadas ao mesmo tempo; query_vector evita
+# recalcular o embedding quando quem chama já o tem
+async def search_hybrid_async(query: str, query_vector=None, **options):
+    options = {**HYBRID_DEFAULTS, **{k: v for k, v in options.items() if v is not None}}
+    if query_vector is None and options["mmr"]:
+        query_vector = await get_embedding_async(query)
+    vectors = options["mmr"] and get_backend() is None
+    vector_results, text_results = await asyncio.gather(
+        tracing.traced("search.vector", search_vector_scored_async(
+            query, options["vector_k"], sources=options["sources"], query_vector=query_vector, vectors=vectors
+        )),
+        tracing.traced("search.text", search_text_scored_async(
+            query, options["text_k"], sources=options["sources"], vectors=vectors
+        ))
+    )
+    return _fuse_hybrid(vector_results, text_results, options, query_vector)
+
+
+async def search_hibryd_async(query: str):
+    return [r["content"] for r in await search_hybrid_async(query)]
+
+
+# documentos ingeridos (manifesto), com a quantidade de chunks de cada um no índice
+def list_documents() -> list:
+    return ingest_manifest.list_documents()
@@ -0,0 +1,387 @@
+import os
+import json
+import time
+import asyncio
+from collections import OrderedDict
+from datetime import datetime, timezone
+from azure.core import MatchConditions
+from azure.core.exceptions import ResourceNotFoundError, ResourceExistsError, ResourceModifiedError
+from src import blob_logs, openai
+
+# camada de sessões do /chat: as sessões ativas ficam num cache lru/ttl em memória e cada
+# turno novo é acrescentado (write-behind) num append blob session_memory/<id>.jsonl, uma
+# mensagem por linha. o blob é lido inteiro só quando a sessão não está no cache. as escritas
+# usam o etag do blob, então dois processos (workers da api) escrevendo na mesma sessão não se
+# sobrescrevem: a escrita que perde baixa só as linhas que o outro acrescentou e tenta de novo
+SESSION_CACHE_MAX = int(os.getenv("SESSION_CACHE_MAX", "1000"))
+SESSION_TTL_SECONDS = float(os.getenv("SESSION_TTL_SECONDS", "1800"))
+SESSION_FLUSH_SECONDS = float(os.getenv("SESSION_FLUSH_SECONDS", "1.0"))
+# compromisso entre chamadas ao storage e frescor: uma sessão em cache é conferida com o blob
+# (get_blob_properties) no máximo a cada tantos segundos, e não em todo turno. com a sessão
+# presa a um worker (o caso normal) nada muda; se dois workers atendem a mesma conversa, o
+# prompt de um pode não ter por até esse tempo o turno gravado pelo outro, que entra no mais
+# tardar na próxima escrita deste. 0 confere em todo turno
+SESSION_REVALIDATE_SECONDS = float(os.getenv("SESSION_REVALIDATE_SECONDS", "30"))
+# depois de tantos blocos acrescentados o journal é reescrito num bloco só
+# (um append blob aceita no máximo 50 mil blocos)
+SESSION_COMPACT_BLOCKS = int(os.getenv("SESSION_COMPACT_BLOCKS", "1000"))
+# quando o histórico não cabe no orçamento e há resumo, a janela é cortada até esta fração
+# do orçamento; assim o resumo é refeito a cada vários turnos e não em todos
+SESSION_TRIM_TARGET = float(os.getenv("SESSION_TRIM_TARGET", "0.6"))
+SESSION_SUMMARY_MAX_TOKENS = int(os.getenv("SESSION_SUMMARY_MAX_TOKENS", "300"))
+
+
+class _Session:
+    def __init__(self, messages: list, etag, block_count: int = 0, size: int = 0):
+        self.messages = messages        # mensagens persistidas + pendentes, com metadados
+        self.pending = []               # mensagens ainda não gravadas no blob
+        self.etag = etag                # None quando o journal ainda não existe
+        self.block_count = block_count
+        self.size = size                # bytes do journal já lidos ou gravados por este processo
+        self.last_access = time.time()
+        self.validated = time.time()
+        self.lock = asyncio.Lock()
+        _recount(self)
+
+
+# cada mensagem guarda os próprios tokens ("tokens"); a sessão mantém o total da conversa
+# e o último resumo (entrada com kind="summary" e covers = mensagens resumidas).
+# só mensagens antigas, sem contagem, são codificadas aqui
+def _recount(session: _Session):
+    session.tokens = 0
+    session.summary = None
+    for message in session.messages:
+        if "tokens" not in message:
+            message["tokens"] = openai.message_tokens(message)
+        if message.get("kind") == "summary":
+            session.summary = message
+        else:
+            session.tokens += message["tokens"]
+
+
+def _conversation(messages: list) -> list:
+    return [m for m in messages if m.get("kind") != "summary"]
+
+
+_sessions = OrderedDict()
+_dirty = set()
+_flush_event = None
+_flusher = None
+
+
+def _journal_blob(session_id: str):
+    return blob_logs.async_container_client().get_blob_client(f"session_memory/{session_id}.jsonl")
+
+
+# só role e content vão para o modelo
+def _to_history(messages: list) -> list:
+    return [{"role": m["role"], "content": m["content"]} for m in messages]
+
+
+def _encode(messages: list) -> bytes:
+    return "".join(json.dumps(m, ensure_ascii=False) + "\n" for m in messages).encode("utf-8")
+
+
+def _decode(data: bytes) -> list:
+    return [json.loads(line) for line in data.decode("utf-8").splitlines() if line.strip()]
+
+
+# lê o journal (ou o json antigo de sessão inteira) do blob storage
+async def _load(session_id: str) -> _Session:
+    try:
+        download = await _journal_blob(session_id).download_blob()
+        data = await download.readall()
+        return _Session(_decode(data), download.properties.etag,
+                        download.properties.get("append_blob_committed_block_count") or 0, len(data))
+    except ResourceNotFoundError:
+        pass
+
+    # sessões gravadas antes do journal: migra o histórico completo na primeira escrita
+    history = await blob_logs.load_session_history_async(session_id)
+    # o histórico antigo passa pelo _recount do construtor (tokens de cada mensagem e total)
+    session = _Session(list(history or []), None)
+    session.pending = list(session.messages)
+    return session
+
+
+def _evict():
+    now = time.time()
+    for session_id in list(_sessions.keys()):
+        session = _sessions[session_id]
+        expired = now - session.last_access > SESSION_TTL_SECONDS
+        if (expired or len(_sessions) > SESSION_CACHE_MAX) and session_id not in _dirty:
+            del _sessions[session_id]
+        elif not expired:
+            break
+
+
+async def _get_session(session_id: str) -> _Session:
+    session = _sessions.get(session_id)
+    if session is None:
+        session = await _load(session_id)
+        # outra requisição pode ter carregado a mesma sessão enquanto esta esperava o blob
+        session = _sessions.setdefault(session_id, session)
+    else:
+        await _revalidate(session_id, session)
+    _sessions.move_to_end(session_id)
+    session.last_access = time.time()
+    _evict()
+    return session
+
+
+async def _revalidate(session_id: str, session: _Session):
+    if time.time() - session.validated < SESSION_REVALIDATE_SECONDS:
+        return
+    async with session.lock:
+        try:
+            await _catch_up(session_id, session)
+        except Exception as e:
+            print(f"Errore durante l'aggiornamento della sessione {session_id}: {e}")
+
+
+# traz para a sessão em cache o que outro processo gravou no journal (com session.lock). com o
+# journal só crescendo desde a última leitura, baixa a partir do tamanho conhecido; se ele foi
+# reescrito (compactação) ou criado por outro processo, relê tudo. as pendentes ficam no fim
+async def _catch_up(session_id: str, session: _Session):
+    blob_client = _journal_blob(session_id)
+    try:
+        properties = await blob_client.get_blob_properties()
+    except ResourceNotFoundError:
+        session.validated = time.time()
+        return
+    session.validated = time.time()
+    if properties.etag == session.etag:
+        return
+
+    persisted = session.messages[:len(session.messages) - len(session.pending)]
+    blocks = properties.get("append_blob_committed_block_count") or 0
+    if session.etag is not None and properties.size >= session.size and blocks >= session.block_count:
+        if properties.size > session.size:
+            download = await blob_client.download_blob(offset=session.size)
+            data = await download.readall()
+            persisted = persisted + _decode(data)
+            session.size += len(data)
+            properties = download.properties
+    else:
+        download = await blob_client.download_blob()
+        data = await download.readall()
+        persisted = _decode(data)
+        session.size = len(data)
+        properties = download.properties
+    session.messages = persisted + session.pending
+    session.etag = properties.etag
+    session.block_count = properties.get("append_blob_committed_block_count") or 0
+    _recount(session)
+
+
+# histórico completo da sessão no formato de mensagens do modelo
+async def get_history(session_id: str) -> list:
+    if not session_id:
+        return []
+    session = await _get_session(session_id)
+    return _to_history(_conversation(session.messages))
+
+
+# janela do histórico que cabe em max_tokens, como (mensagens, tokens). os turnos mais
+# antigos saem da janela e, se summarize for dado (async (resumo anterior, mensagens) -> texto),
+# são substituídos por um resumo. os tokens vêm da contagem guardada em cada mensagem
+async def get_window(session_id: str, max_tokens: int, summarize=None):
+    if not session_id:
+        return [], 0
+    entries = await _window(session_id, max_tokens, summarize)
+    return _to_history(entries), sum(m["tokens"] for m in entries)
+
+
+async def _window(session_id: str, max_tokens: int, summarize) -> list:
+    session = await _get_session(session_id)
+    conversation = _conversation(session.messages)
+    if session.summary is None and session.tokens <= max_tokens:
+        return conversation
+
+    if summarize is None:
+        return _fit(conversation, 0, max_tokens)
+
+    summary = session.summary
+    start = summary["covers"] if summary else 0
+    window_tokens = session.tokens - (summary["covered_tokens"] if summary else 0)
+    if summary is not None and window_tokens + summary["tokens"] <= max_tokens:
+        return [summary] + conversation[start:]
+
+    # a janela estourou: resume o que sai dela e corta até SESSION_TRIM_TARGET do orçamento
+    target = int(max_tokens * SESSION_TRIM_TARGET) - SESSION_SUMMARY_MAX_TOKENS
+    window = _fit(conversation, start, target)
+    dropped = conversation[start:len(conversation) - len(window)]
+    if not dropped:
+        return ([summary] if summary else []) + window
+    try:
+        text = await summarize(summary["content"] if summary else "", _to_history(dropped))
+    except Exception as e:
+        print(f"Errore durante il riassunto della sessione {session_id}: {e}")
+        return _fit(conversation, start, max_tokens)
+
+    new_summary = {
+        "role": "system",
+        "content": f"Summary of the earlier conversation: {text}",
+        "kind": "summary",
+        "covers": len(conversation) - len(window),
+        "covered_tokens": (summary["covered_tokens"] if summary else 0) + sum(m["tokens"] for m in dropped),
+        "ts": datetime.now(timezone.utc).isoformat(),
+    }
+    new_summary["tokens"] = openai.message_tokens(new_summary)
+    # outra requisição da mesma sessão pode ter resumido enquanto esta esperava o modelo
+    if session.summary is summary:
+        session.messages.append(new_summary)
+        session.pending.append(new_summary)
+        session.summary = new_summary
+        await _schedule_flush(session_id)
+    return [new_summary] + window
+
+
+# maior sufixo de conversation[start:] que cabe em max_tokens, começando numa mensagem do usuário
+def _fit(conversation: list, start: int, max_tokens: int) -> list:
+    first = len(conversation)
+    used = 0
+    while first > start and used + conversation[first - 1]["tokens"] <= max_tokens:
+        first -= 1
+        used += conversation[first]["tokens"]
+    while first < len(conversation) and conversation[first]["role"] != "user":
+        first += 1
+    return conversation[first:]
+
+
+# acrescenta as mensagens do turno à sessão; a gravação no blob acontece em segundo plano
+async def append_turn(session_id: str, messages: list):
+    session = await _get_session(session_id)
+    timestamp = datetime.now(timezone.utc).isoformat()
+    # só as mensagens novas são codificadas; o total da sessão é atualizado incrementalmente
+    entries = [{**m, "ts": timestamp, "tokens": openai.message_tokens(m)} for m in messages]
+    session.messages.extend(entries)
+    session.pending.extend(entries)
+    session.tokens += sum(e["tokens"] for e in entries)
+    await _schedule_flush(session_id)
+
+
+async def _schedule_flush(session_id: str):
+    _dirty.add(session_id)
+    if _flush_event is not None:
+        _flush_event.set()
+    else:
+        # sem o flusher rodando (scripts, testes) grava na hora
+        await flush_session(session_id)
+
+
+# grava as mensagens pendentes de uma sessão com escrita condicional pelo etag
+async def flush_session(session_id: str):
+    session = _sessions.get(session_id)
+    if session is None:
+        return
+    async with session.lock:
+        if not session.pending:
+            _dirty.discard(session_id)
+            return
+        blob_client = _journal_blob(session_id)
+        pending = list(session.pending)
+
+        for _ in range(3):
+            try:
+                if session.etag is None:
+                    created = await blob_client.create_append_blob(match_condition=MatchConditions.IfMissing)
+                    session.etag = created["etag"]
+                    session.block_count = 0
+                    session.size = 0
+                data = _encode(pending)
+                result = await blob_client.append_block(
+                    data, etag=session.etag, match_condition=MatchConditions.IfNotModified
+                )
+                session.size += len(data)
+                session.etag = result["etag"]
+                session.block_count = int(result.get("blob_committed_block_count") or session.block_count + 1)
+                del session.pending[:len(pending)]
+                break
+            except (ResourceModifiedError, ResourceExistsError):
+                # outro processo escreveu nesta sessão: traz o que ele acrescentou e reaplica as pendentes
+                try:
+                    await _catch_up(session_id, session)
+                except Exception as e:
+                    print(f"Errore durante il salvataggio della sessione {session_id}: {e}")
+                    return
+            except Exception as e:
+                print(f"Errore durante il salvataggio della sessione {session_id}: {e}")
+                return
+
+        if not session.pending:
+            _dirty.discard(session_id)
+        if session.block_count >= SESSION_COMPACT_BLOCKS:
+            await _compact(session_id, session)
+
+
+# reescreve o journal num único bloco; só acontece se ninguém escreveu nesse meio tempo
+async def _compact(session_id: str, session: _Session):
+    blob_client = _journal_blob(session_id)
+    persisted = session.messages[:len(session.messages) - len(session.pending)]
+    try:
+        created = await blob_client.create_append_blob(etag=session.etag, match_condition=MatchConditions.IfNotModified)
+    except ResourceModifiedError:
+        # outro processo mexeu no journal; a compactação fica para a próxima vez
+        return
+    except Exception as e:
+        print(f"Errore durante la compattazione della sessione {session_id}: {e}")
+        return
+
+    # o blob agora está vazio: se a regravação falhar, tudo volta a ser pendente
+    session.etag = created["etag"]
+    session.block_count = 0
+    session.size = 0
+    session.pending = persisted + session.pending
+    _dirty.add(session_id)
+    rewrite = list(session.pending)
+    try:
+        data = _encode(rewrite)
+        result = await blob_client.append_block(
+            data, etag=session.etag, match_condition=MatchConditions.IfNotModified
+        )
+        session.etag = result["etag"]
+        session.block_count = 1
+        session.size = len(data)
+        del session.pending[:len(rewrite)]
+        if not session.pending:
+            _dirty.discard(session_id)
+        print(f"Sessione {session_id} compattata ({len(persisted)} messaggi).")
+    except Exception as e:
+        print(f"Errore durante la compattazione della sessione {session_id}: {e}")
+
+
+async def flush_all():
+    for session_id in list(_dirty):
+        await flush_session(session_id)
+
+
+async def _flush_loop():
+    while True:
+        await _flush_event.wait()
+        _flush_event.clear()
+        # agrupa os turnos que chegarem durante o intervalo numa única escrita por sessão
+        await asyncio.sleep(SESSION_FLUSH_SECONDS)
+        await flush_all()
+
+
+# inicia o flusher em segundo plano (no startup da api)
+def start():
+    global _flush_event, _flusher
+    if _flusher is None:
+        _flush_event = asyncio.Event()
+        _flusher = asyncio.create_task(_flush_loop())
+
+
+# para o flusher e grava tudo o que estiver pendente (no shutdown da api)
+async def stop():
+    global _flush_event, _flusher
+    if _flusher is not None:
+        _flusher.cancel()
+        try:
+            await _flusher
+        except asyncio.CancelledError:
+            pass
+    _flusher = None
+    _flush_event = None
+    await flush_all()
@@ -2,10 +2,21 @@ import fitz
 from azure.ai.documentintelligence.models import DocumentAnalysisFeature
 from azure.ai.documentintelligence import DocumentIntelligenceClient
 from azure.core.credentials import AzureKeyCredential
+from src import clients, layout_cache
 from pydantic import BaseModel
-from typing import Optional, List
+from typing import Optional, List, Iterator, Union
 from io import BytesIO
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor, wait
+from contextlib import contextmanager
+from itertools import count, islice
+import atexit
+import multiprocessing
 import os
+import sys
+import hashlib
+import tempfile
+import threading
 from dotenv import load_dotenv
 load_dotenv()
 
@@ -23,120 +34,497 @@ class ContentBlock(BaseModel):
     image_bytes: Optional[bytes] = None
     page_number: int
     bounding_box: Optional[List[float]] = None
+    xref: Optional[int] = None
 
 
-doc_client = DocumentIntelligenceClient(
-    endpoint=smart_doc_endpoint, credential=AzureKeyCredential(smart_doc_key))
+# cliente do document intelligence, criado no primeiro uso (src/clients.py)
+clients.register("document_intelligence", lambda: DocumentIntelligenceClient(
+    endpoint=smart_doc_endpoint, credential=AzureKeyCredential(smart_doc_key), transport=clients.azure_transport()))
 
-# extrai todo o conteúdo do pdf
-def extract_all_content(file_bytes: bytes, filename: str) -> List[ContentBlock]:
-    # verifica se as credenciais estão configuradas
-    if not smart_doc_endpoint or not smart_doc_key:
-        raise ValueError("Le impostazioni di Azure Document Intelligence non sono configurate.")
+# extração com pymupdf: páginas divididas em faixas entre processos (o pdf é aberto uma
+# vez por processo) e os blocos devolvidos em ordem, conforme as faixas terminam
+EXTRACT_WORKERS = int(os.getenv("EXTRACT_WORKERS", str(min(os.cpu_count() or 1, 4))))
+EXTRACT_PAGES_PER_TASK = int(os.getenv("EXTRACT_PAGES_PER_TASK", "8"))
+# pdfs pequenos são extraídos no próprio processo; subir o pool custaria mais que a extração
+EXTRACT_MIN_PAGES_FOR_POOL = int(os.getenv("EXTRACT_MIN_PAGES_FOR_POOL", "32"))
 
-    # analisa o layout e o texto com o azure document intelligence
-    print(f"Analisi del layout iniziale per {filename}...")
+# o pdf pode vir em memória (bytes) ou como caminho de um arquivo no disco. pelo caminho o
+# pymupdf lê só as páginas que usa, então a memória não cresce com o tamanho do pdf, e os
+# processos do pool abrem o arquivo em vez de receber uma cópia dos bytes
+PdfSource = Union[bytes, str]
+
+
+def open_pdf(pdf: PdfSource):
+    if isinstance(pdf, str):
+        return fitz.open(pdf, filetype="pdf")
+    return fitz.open(stream=pdf, filetype="pdf")
+
+
+# sha-256 do pdf, lendo o arquivo em pedaços quando ele está no disco
+def pdf_hash(pdf: PdfSource) -> str:
+    if not isinstance(pdf, str):
+        return hashlib.sha256(pdf).hexdigest()
+    digest = hashlib.sha256()
+    with open(pdf, "rb") as f:
+        for block in iter(lambda: f.read(1024 * 1024), b""):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+# como os processos do pool são criados. o pool sobe de dentro das threads do run_bulk e do
+# worker, e um fork com outra thread segurando uma trava (sqlite, logging, clientes http)
+# deixa o filho travado. o forkserver cria os processos a partir de um servidor sem threads;
+# sem ele (windows), spawn. cada tarefa recebe o caminho do pdf, então os processos não
+# herdam nada do processo principal.
+# cada processo novo executa de novo o módulo principal; o servidor importa antes este módulo
+# e o principal (pelo nome, quando rodado com -m), para que os imports já estejam carregados
+def _pool_context():
+    if "forkserver" not in multiprocessing.get_all_start_methods():
+        return multiprocessing.get_context("spawn")
+    context = multiprocessing.get_context("forkserver")
+    main_name = getattr(getattr(sys.modules["__main__"], "__spec__", None), "name", None)
+    preload = ["__main__", __name__]
+    if main_name and not main_name.endswith("__main__"):
+        preload.append(main_name)
+    context.set_forkserver_preload(preload)
+    return context
+
+
+# um único pool de extração por processo, com EXTRACT_WORKERS processos, criado no primeiro
+# pdf grande e compartilhado pelos documentos ingeridos em paralelo (run_bulk). sem
+# initializer por documento: cada tarefa abre o pdf pelo caminho
+_extract_pool = None
+_extract_pool_lock = threading.Lock()
+
+
+def _get_extract_pool() -> ProcessPoolExecutor:
+    global _extract_pool
+    with _extract_pool_lock:
+        if _extract_pool is None:
+            _extract_pool = ProcessPoolExecutor(max_workers=EXTRACT_WORKERS, mp_context=_pool_context())
+        return _extract_pool
+
+
+# encerra o pool de extração (no fim do worker e na saída do processo)
+def shutdown_extract_pool():
+    global _extract_pool
+    with _extract_pool_lock:
+        pool, _extract_pool = _extract_pool, None
+    if pool is not None:
+        pool.shutdown(wait=True, cancel_futures=True)
+
+
+atexit.register(shutdown_extract_pool)
+
+
+# caminho do pdf para as tarefas do pool; pdfs em memória vão para um arquivo temporário
+# enquanto são extraídos, em vez de serem copiados para cada tarefa
+@contextmanager
+def _pdf_path(pdf: PdfSource):
+    if isinstance(pdf, str):
+        yield pdf
+        return
+    handle = tempfile.NamedTemporaryFile(suffix=".pdf", dir=os.getenv("INGEST_TEMP_DIR") or None, delete=False)
+    try:
+        with handle:
+            handle.write(pdf)
+        yield handle.name
+    finally:
+        os.remove(handle.name)
+
+
+# imagens menores que isso (lado ou área, em pixels) ou muito alongadas (linhas, fios,
+# fundos decorativos) não são legendadas
+IMAGE_MIN_SIDE = int(os.getenv("IMAGE_MIN_SIDE", "48"))
+IMAGE_MIN_AREA = int(os.getenv("IMAGE_MIN_AREA", "10000"))
+IMAGE_MAX_ASPECT = float(os.getenv("IMAGE_MAX_ASPECT", "12"))
+
+
+def _is_decorative(width: int, height: int) -> bool:
+    if min(width, height) < IMAGE_MIN_SIDE or width * height < IMAGE_MIN_AREA:
+        return True
+    return max(width, height) / max(min(width, height), 1) > IMAGE_MAX_ASPECT
+
+
+# texto (só para páginas sem texto do document intelligence) e imagens de uma faixa de páginas.
+# cada xref é extraído uma vez por faixa; imagens decorativas são descartadas antes de extrair.
+# texts traz o texto já lido pela sondagem do layout, sem get_text de novo nessas páginas.
+# devolve {"blocks": dicts simples, "stats": contagens}; os ContentBlock são criados no processo principal
+# document é o documento aberto ou, nas tarefas do pool, o caminho do pdf.
+def _extract_page_range(start: int, end: int, skip_text_pages: frozenset, document, texts: dict = None) -> dict:
+    if isinstance(document, str):
+        with open_pdf(document) as pdf_document:
+            return _extract_page_range(start, end, skip_text_pages, pdf_document, texts)
+    pdf_document = document
+    blocks = []
+    stats = {"pages": end - start, "images": 0, "duplicate_images": 0, "small_images": 0}
+    seen_xrefs = set()
+    for page_index in range(start, end):
+        page_number = page_index + 1
+        pdf_page = pdf_document.load_page(page_index)
+
+        if page_number not in skip_text_pages:
+            text = texts[page_number] if texts and page_number in texts else pdf_page.get_text("text").strip()
+            if text:
+                blocks.append({"type": "text", "content": text, "page_number": page_number})
+
+        for img_index, img_info in enumerate(pdf_page.get_images(full=True)):
+            xref, width, height = img_info[0], img_info[2], img_info[3]
+            stats["images"] += 1
+            if xref in seen_xrefs:
+                stats["duplicate_images"] += 1
+                continue
+            seen_xrefs.add(xref)
+            if _is_decorative(width, height):
+                stats["small_images"] += 1
+                continue
+            try:
+                image_info = pdf_document.extract_image(xref)
+            except Exception as e:
+                print(f"Errore durante l'estrazione dell'immagine {xref} a pagina {page_number}: {e}")
+                continue
+            blocks.append({
+                "type": "image",
+                "content": f"Imagem {img_index + 1} na página {page_number}",
+                "image_bytes": image_info["image"],
+                "page_number": page_number,
+                "xref": xref,
+            })
+    # esvazia o cache de recursos do mupdf (fontes, imagens decodificadas) entre as faixas,
+    # senão ele cresce com o tamanho do pdf até o limite padrão de 256 MiB
+    fitz.TOOLS.store_shrink(100)
+    return {"blocks": blocks, "stats": stats}
+
+
+# gera os blocos de texto e imagem do pdf página a página, em ordem. com o pool, no máximo
+# 2 × workers faixas deste pdf ficam em voo, então a memória depende disso e não do tamanho do pdf.
+# stats (opcional) recebe as páginas lidas e as contagens de imagens: total, repetidas e decorativas.
+# page_texts (opcional) é o texto por página já lido pela sondagem (probe_pages); cada texto
+# sai do dicionário quando a sua faixa é enviada
+def iter_pdf_blocks(pdf: PdfSource, skip_text_pages=frozenset(), workers: int = None,
+                    pages_per_task: int = None, stats: dict = None, page_texts: dict = None):
+    workers = workers or EXTRACT_WORKERS
+    pages_per_task = pages_per_task or EXTRACT_PAGES_PER_TASK
+    skip_text_pages = frozenset(skip_text_pages)
+    stats = stats if stats is not None else {}
+    page_texts = page_texts if page_texts is not None else {}
+    # a mesma imagem (xref) pode aparecer em faixas diferentes; só a primeira segue adiante
+    seen_xrefs = set()
+
+    def emit(result: dict):
+        for key, value in result["stats"].items():
+            stats[key] = stats.get(key, 0) + value
+        for block in result["blocks"]:
+            if block["type"] == "image":
+                if block["xref"] in seen_xrefs:
+                    stats["duplicate_images"] = stats.get("duplicate_images", 0) + 1
+                    continue
+                seen_xrefs.add(block["xref"])
+            yield block
+
+    try:
+        pdf_document = open_pdf(pdf)
+    except Exception as e:
+        print(f"Errore durante il caricamento del PDF con PyMuPDF: {e}")
+        return
+    page_count = pdf_document.page_count
+    ranges = [(start, min(start + pages_per_task, page_count)) for start in range(0, page_count, pages_per_task)]
+
+    # só o texto das páginas da faixa vai junto para o processo que a extrai, e deixa de ser guardado
+    def range_texts(start: int, end: int) -> dict:
+        return {n: page_texts.pop(n) for n in range(start + 1, end + 1) if n in page_texts}
+
+    if workers <= 1 or page_count < EXTRACT_MIN_PAGES_FOR_POOL:
+        try:
+            for start, end in ranges:
+                yield from emit(_extract_page_range(start, end, skip_text_pages, pdf_document, range_texts(start, end)))
+        finally:
+            pdf_document.close()
+        return
+    pdf_document.close()
+
+    executor = _get_extract_pool()
+    with _pdf_path(pdf) as path:
+        in_flight = deque()
+        next_range = iter(ranges)
+
+        def submit(start: int, end: int):
+            in_flight.append(executor.submit(
+                _extract_page_range, start, end, skip_text_pages, path, range_texts(start, end)))
+
+        try:
+            for start, end in islice(next_range, workers * 2):
+                submit(start, end)
+            while in_flight:
+                result = in_flight.popleft().result()
+                for start, end in islice(next_range, 1):
+                    submit(start, end)
+                yield from emit(result)
+        finally:
+            # consumidor parou no meio: descarta as faixas que ainda não começaram e espera as
+            # que já começaram, antes de o arquivo temporário ser apagado
+            for future in in_flight:
+                future.cancel()
+            wait(in_flight)
+
+
+# como usar o document intelligence: "full" manda o pdf inteiro, "selective" só as páginas
+# que o pymupdf não resolve sozinho (sem camada de texto ou com tabelas), "off" não usa
+SMART_DOC_DI_MODE = os.getenv("SMART_DOC_DI_MODE", "selective")
+# páginas com menos caracteres que isso são tratadas como digitalizadas (precisam de ocr)
+DI_MIN_TEXT_CHARS = int(os.getenv("DI_MIN_TEXT_CHARS", "50"))
+# procura tabelas com o pymupdf na sondagem (páginas com tabela vão para o layout)
+DI_PROBE_TABLES = os.getenv("DI_PROBE_TABLES", "true").lower() == "true"
+# texto lido na sondagem guardado para a extração (caracteres, somando todas as páginas)
+DI_PROBE_TEXT_MAX_CHARS = int(os.getenv("DI_PROBE_TEXT_MAX_CHARS", "2000000"))
+# tamanho máximo de cada faixa de páginas e quantas faixas são analisadas ao mesmo tempo
+DI_MAX_RANGE_PAGES = int(os.getenv("DI_MAX_RANGE_PAGES", "8"))
+DI_MAX_CONCURRENCY = int(os.getenv("DI_MAX_CONCURRENCY", "4"))
+DI_MODEL = "prebuilt-layout"
+
+
+# motivo para mandar a página ao document intelligence, ou None se o pymupdf basta
+def _page_needs_layout(pdf_page, text: str) -> Optional[str]:
+    if len(text) < DI_MIN_TEXT_CHARS:
+        return "ocr"
+    # texto com muitos caracteres de substituição: camada de texto quebrada (fontes sem mapa)
+    if text.count("\ufffd") > len(text) * 0.05:
+        return "ocr"
+    # find_tables é caro: só roda em páginas com algumas linhas/retângulos desenhados
+    # (bordas de tabela), e não em páginas de arte vetorial com milhares de traços
+    if DI_PROBE_TABLES:
+        try:
+            rules = sum(
+                1 for drawing in pdf_page.get_cdrawings() for item in drawing["items"] if item[0] in ("l", "re")
+            )
+            if 4 <= rules <= 1000 and pdf_page.find_tables().tables:
+                return "table"
+        except Exception:
+            pass
+    return None
+
+
+# sonda cada página do documento já aberto; devolve {número da página: motivo} só das que
+# precisam de análise. texts (opcional) recebe o texto das páginas que ficam com o pymupdf, que
+# a extração reaproveita, até DI_PROBE_TEXT_MAX_CHARS no total; as outras são lidas de novo na
+# extração, então a memória não cresce com o número de páginas
+def probe_pages(pdf_document, texts: dict = None) -> dict:
+    needs = {}
+    kept = 0
+    for page_index in range(pdf_document.page_count):
+        pdf_page = pdf_document.load_page(page_index)
+        text = pdf_page.get_text("text").strip()
+        reason = _page_needs_layout(pdf_page, text)
+        if reason:
+            needs[page_index + 1] = reason
+        elif texts is not None and kept + len(text) <= DI_PROBE_TEXT_MAX_CHARS:
+            texts[page_index + 1] = text
+            kept += len(text)
+    return needs
+
+
+# agrupa páginas em faixas contíguas no formato aceito pelo serviço ("3-5", "9")
+def page_ranges(pages, max_pages: int = DI_MAX_RANGE_PAGES) -> list:
+    ranges = []
+    start = previous = None
+    for page in sorted(pages):
+        if start is not None and page == previous + 1 and page - start < max_pages:
+            previous = page
+            continue
+        if start is not None:
+            ranges.append(f"{start}-{previous}" if previous != start else str(start))
+        start = previous = page
+    if start is not None:
+        ranges.append(f"{start}-{previous}" if previous != start else str(start))
+    return ranges
+
+
+# faixa "3-5" (ou "9") como (primeira, última)
+def _range_bounds(pages: str) -> tuple:
+    first, _, last = pages.partition("-")
+    return int(first), int(last or first)
+
+
+# pdf só com as páginas da faixa: o serviço recebe os bytes dessas páginas, e não o arquivo inteiro
+def _sub_pdf(pdf_document, first: int, last: int) -> bytes:
+    with fitz.open() as sub_document:
+        sub_document.insert_pdf(pdf_document, from_page=first - 1, to_page=last - 1)
+        return sub_document.tobytes()
+
+
+# tabela do document intelligence como texto, uma linha por linha da tabela
+def _table_text(table) -> str:
+    rows = {}
+    for cell in table.cells or []:
+        rows.setdefault(cell.row_index, {})[cell.column_index] = (cell.content or "").strip()
+    return "\n".join(" | ".join(row[c] for c in sorted(row)) for _, row in sorted(rows.items()))
+
+
+# guarda só o que a ingestão usa do resultado: parágrafos e tabelas com a página.
+# page_offset converte as páginas de um sub-pdf para as do pdf original
+def _simplify(result, page_offset: int = 0) -> dict:
+    paragraphs = [
+        {"content": p.content.strip(), "page_number": p.bounding_regions[0].page_number + page_offset}
+        for p in (result.paragraphs or []) if p.bounding_regions and p.content and p.content.strip()
+    ]
+    tables = [
+        {"content": _table_text(t), "page_number": t.bounding_regions[0].page_number + page_offset}
+        for t in (result.tables or []) if t.bounding_regions
+    ]
+    return {"paragraphs": paragraphs, "tables": tables}
+
+
+def _cache_key(digest: str, pages: str) -> str:
+    return layout_cache.make_key(digest, pages, f"{DI_MODEL}+ocr-high-resolution")
+
+
+# chama o serviço com o corpo (arquivo aberto ou bytes); None se falhar. first_page é a página
+# do pdf original que abre o corpo, quando ele é o sub-pdf de uma faixa
+def _request_layout(body, filename: str, pages: str = None, first_page: int = 1):
+    print(f"Analisi del layout per {filename} (pagine {pages or 'tutte'})...")
     try:
-        poller = doc_client.begin_analyze_document(
-            "prebuilt-layout",
-            BytesIO(file_bytes),
+        poller = clients.get("document_intelligence").begin_analyze_document(
+            DI_MODEL,
+            body,
             features=[DocumentAnalysisFeature.OCR_HIGH_RESOLUTION]
         )
-        result = poller.result()
+        return _simplify(poller.result(), first_page - 1)
     except Exception as e:
         print(f"[ERRO] Azure Document Intelligence falhou: {e}")
-        result = None
+        return None
+
 
-    # lista onde serão armazenados os blocos extraídos
-    content_blocks: List[ContentBlock] = []
-    chunk_index_counter = 0
+# analisa o layout e o texto com o azure document intelligence (None se falhar).
+# pages limita a análise a uma faixa ("3-5"); o resultado fica no cache por hash do pdf e faixa
+def analyze_layout(pdf: PdfSource, filename: str, pages: str = None, digest: str = None):
+    digest = digest or pdf_hash(pdf)
+    cache_key = _cache_key(digest, pages)
+    cached = layout_cache.get(cache_key)
+    if cached is not None:
+        return cached
+
+    if pages:
+        first, last = _range_bounds(pages)
+        with open_pdf(pdf) as pdf_document:
+            body = _sub_pdf(pdf_document, first, last)
+        result = _request_layout(BytesIO(body), filename, pages, first)
+    else:
+        # o arquivo do disco é enviado direto do handle, sem ser lido inteiro para a memória
+        with (open(pdf, "rb") if isinstance(pdf, str) else BytesIO(pdf)) as body:
+            result = _request_layout(body, filename)
+    if result is not None:
+        layout_cache.put(cache_key, result)
+    return result
+
+
+# analisa as faixas que não estão no cache, até DI_MAX_CONCURRENCY ao mesmo tempo. o sub-pdf
+# de cada faixa é montado nesta thread (o documento do pymupdf não é thread-safe) e só quando
+# a faixa vai ser enviada, para não guardar os bytes de todas as faixas de uma vez
+def _analyze_ranges(pdf_document, filename: str, ranges: list, digest: str) -> dict:
+    results = {}
+    missing = []
+    for pages in ranges:
+        cached = layout_cache.get(_cache_key(digest, pages))
+        if cached is not None:
+            results[pages] = cached
+        else:
+            missing.append(pages)
+    if not missing:
+        return results
+
+    concurrency = max(1, min(DI_MAX_CONCURRENCY, len(missing)))
+    with ThreadPoolExecutor(max_workers=concurrency) as executor:
+        def submit(pages: str):
+            first, last = _range_bounds(pages)
+            body = BytesIO(_sub_pdf(pdf_document, first, last))
+            return pages, executor.submit(_request_layout, body, filename, pages, first)
+
+        next_pages = iter(missing)
+        in_flight = deque(submit(pages) for pages in islice(next_pages, concurrency))
+        while in_flight:
+            pages, future = in_flight.popleft()
+            result = future.result()
+            for following in islice(next_pages, 1):
+                in_flight.append(submit(following))
+            if result is not None:
+                layout_cache.put(_cache_key(digest, pages), result)
+                results[pages] = result
+    return results
+
+
+# analisa só as páginas que precisam, em faixas paralelas, e junta os resultados em ordem.
+# o pdf é aberto uma vez para a sondagem e para os sub-pdfs das faixas. stats (opcional)
+# recebe quantas páginas foram enviadas e quantas o pymupdf resolveu; page_texts (opcional)
+# recebe o texto lido na sondagem das páginas que ficam com o pymupdf, para a extração não ler de novo
+def analyze_selective(pdf: PdfSource, filename: str, stats: dict = None, digest: str = None,
+                      page_texts: dict = None) -> dict:
+    digest = digest or pdf_hash(pdf)
+    merged = {"paragraphs": [], "tables": []}
+    with open_pdf(pdf) as pdf_document:
+        needs = probe_pages(pdf_document, page_texts)
+        ranges = page_ranges(needs)
+        if stats is not None:
+            stats["layout_pages_total"] = pdf_document.page_count
+            stats["layout_pages_sent"] = len(needs)
+            stats["layout_ranges"] = len(ranges)
+        if not ranges:
+            return merged
+        print(f"{filename}: {len(needs)} pagine per Document Intelligence in {len(ranges)} intervalli.")
+        results = _analyze_ranges(pdf_document, filename, ranges, digest)
+
+    for pages in ranges:
+        result = results.get(pages)
+        if result:
+            merged["paragraphs"].extend(result["paragraphs"])
+            merged["tables"].extend(result["tables"])
+    return merged
+
+
+# gera todo o conteúdo do pdf como ContentBlock, sem montar a lista inteira: primeiro os
+# parágrafos e tabelas do document intelligence, depois texto de reserva e imagens do pymupdf,
+# que já podem ser consumidos (chunking, embeddings, legendas) enquanto as outras páginas são lidas
+# stats recebe as contagens de imagens e layout_stats as de páginas enviadas ao serviço
+def iter_content_blocks(pdf: PdfSource, filename: str, stats: dict = None,
+                        layout_stats: dict = None, digest: str = None) -> Iterator[ContentBlock]:
+    result = None
+    page_texts = None
+    if SMART_DOC_DI_MODE != "off":
+        # verifica se as credenciais estão configuradas
+        if not smart_doc_endpoint or not smart_doc_key:
+            raise ValueError("Le impostazioni di Azure Document Intelligence non sono configurate.")
+        if SMART_DOC_DI_MODE == "selective":
+            page_texts = {}
+            result = analyze_selective(pdf, filename, layout_stats, digest, page_texts)
+        else:
+            result = analyze_layout(pdf, filename, digest=digest)
+    block_ids = count()
 
-    
     # extrai o conteúdo textual completo
     azure_text_pages = set()
-    if result and result.paragraphs:
-        for paragraph in result.paragraphs:
-            if paragraph.bounding_regions:
-                page_number = paragraph.bounding_regions[0].page_number
-                if paragraph.content.strip():
-                    content_blocks.append(
-                        ContentBlock(
-                            id=chunk_index_counter,
-                            type='text',
-                            content=paragraph.content.strip(),
-                            page_number=page_number
-                        )
-                    )
-                    azure_text_pages.add(page_number)
-                    chunk_index_counter += 1
-
-    # Se ainda assim não encontrou texto, mostra aviso
-    try:
-        pdf_document = fitz.open(stream=file_bytes, filetype="pdf")
-        for page_num in range(pdf_document.page_count):
-            page = pdf_document.load_page(page_num)
-            text = page.get_text("text")
-            if text.strip() and (page_num + 1) not in azure_text_pages:
-                content_blocks.append(ContentBlock(
-                    id=chunk_index_counter,
-                    type='text',
-                    content=text.strip(),
-                    page_number=page_num + 1
-                ))
-                chunk_index_counter += 1
-        pdf_document.close()
-    except Exception as e:
-        print(f"[ERRO] Falha na extração de texto com PyMuPDF: {e}")
+    for paragraph in (result or {}).get("paragraphs", []):
+        azure_text_pages.add(paragraph["page_number"])
+        yield ContentBlock(
+            id=next(block_ids),
+            type='text',
+            content=paragraph["content"],
+            page_number=paragraph["page_number"]
+        )
 
     # extrai tabelas e converte para texto
-    if result.tables:
-        for table in result.tables:
-            table_text = "\n".join(
-                [f"Tabella a pagina {table.bounding_regions[0].page_number} (Contenuto strutturato):\n" + table.content])
-
-            content_blocks.append(
-                ContentBlock(
-                    id=chunk_index_counter,
-                    type='table',
-                    content=table_text,
-                    page_number=table.bounding_regions[0].page_number,
-                )
-            )
-            chunk_index_counter += 1
+    for table in (result or {}).get("tables", []):
+        page_number = table["page_number"]
+        yield ContentBlock(
+            id=next(block_ids),
+            type='table',
+            content=f"Tabella a pagina {page_number} (Contenuto strutturato):\n" + table["content"],
+            page_number=page_number,
+        )
 
-    # extrai imagens e gráficos com pymupdf
-    try:
-        # abre o pdf em memória
-        pdf_document = fitz.open(stream=file_bytes, filetype="pdf")
-    except Exception as e:
-        print(f"Errore durante il caricamento del PDF con PyMuPDF: {e}")
-        return content_blocks
-
-    # percorre cada página e coleta as imagens
-    for page_number in range(len(pdf_document)):
-        pdf_page = pdf_document.load_page(page_number)
-        images_on_page = pdf_page.get_images(full=True)
-
-        for img_index, img_info in enumerate(images_on_page):
-            xref = img_info[0]
-            image_info = pdf_document.extract_image(xref)
-            image_bytes = image_info["image"]
-            image_ext = image_info["ext"]
-
-            # cria um bloco para cada imagem
-            content_blocks.append(
-                ContentBlock(
-                    id=chunk_index_counter,
-                    type='image',
-                    content=f"Imagem {img_index + 1} na página {page_number + 1}",
-                    image_bytes=image_bytes,
-                    page_number=page_number + 1,
-                    bounding_box=None
-                )
-            )
-            chunk_index_counter += 1
+    # texto das páginas que o document intelligence não leu e imagens/gráficos
+    for block in iter_pdf_blocks(pdf, azure_text_pages, stats=stats, page_texts=page_texts):
+        yield ContentBlock(id=next(block_ids), **block)
 
-    pdf_document.close()
 
-    # retorna todos os blocos extraídos a lista completa de texto, tabelas e imagens binárias/metadados
-    return content_blocks
+# extrai todo o conteúdo do pdf numa lista
+def extract_all_content(pdf: PdfSource, filename: str) -> List[ContentBlock]:
+    return list(iter_content_blocks(pdf, filename))
@@ -0,0 +1,264 @@
+import os
+import sqlite3
+import threading
+import time
+from contextlib import contextmanager
+
+# cache chave-valor persistente num arquivo sqlite, usado pelos caches de embeddings, de
+# legendas e de layouts: cada módulo define só a tabela, o formato da chave e como o valor
+# vira bytes ou texto. aqui ficam a conexão, a evicção lru por tamanho e as estatísticas.
+#
+# o total de bytes e de entradas de cada tabela fica numa linha de cache_meta, atualizada na
+# mesma transação das escritas, então nenhuma escrita soma a tabela inteira. as leituras não
+# escrevem: os acessos (last_access) ficam em memória e vão para o banco junto com a próxima
+# escrita ou, num processo que só lê, a cada CACHE_ACCESS_FLUSH_SECONDS e só se o banco
+# estiver livre naquele momento. erros do sqlite (banco travado pelo outro processo, disco
+# cheio) nunca sobem: a leitura vira falta e a escrita é descartada
+CACHE_BUSY_TIMEOUT_SECONDS = float(os.getenv("CACHE_BUSY_TIMEOUT_SECONDS", "5"))
+CACHE_ACCESS_FLUSH_SECONDS = float(os.getenv("CACHE_ACCESS_FLUSH_SECONDS", "30"))
+CACHE_ACCESS_FLUSH_KEYS = 1000
+# o sqlite limita o número de parâmetros por consulta
+_CHUNK = 500
+
+
+def _size(value) -> int:
+    return len(value) if isinstance(value, (bytes, bytearray)) else len(str(value).encode("utf-8"))
+
+
+class SqliteCache:
+    def __init__(self, path: str, table: str, value_column: str = "value", max_bytes: int = None):
+        self.path = path
+        self.table = table
+        self.value_column = value_column
+        # sem limite (None) nada é removido
+        self.max_bytes = max_bytes
+        self._lock = threading.Lock()
+        self._connection = None
+        self._insert = None
+        self._created_at = False
+        self._accessed = {}
+        self._accessed_since = None
+        self._stats = {"hits": 0, "misses": 0, "evictions": 0, "errors": 0}
+
+    # abre (uma única vez) a conexão; as transações são explícitas (isolation_level=None)
+    def _connect(self):
+        if self._connection is not None:
+            return self._connection
+        directory = os.path.dirname(self.path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        connection = sqlite3.connect(
+            self.path, timeout=CACHE_BUSY_TIMEOUT_SECONDS, check_same_thread=False, isolation_level=None
+        )
+        try:
+            connection.execute("PRAGMA journal_mode=WAL")
+            with _transaction(connection):
+                columns = self._create_schema(connection)
+        except sqlite3.Error:
+            connection.close()
+            raise
+        # tabelas antigas têm created_at obrigatório
+        self._created_at = "created_at" in columns
+        extra = ", created_at" if self._created_at else ""
+        self._insert = (
+            f"INSERT OR REPLACE INTO {self.table} (key, {self.value_column}, size, last_access{extra}) "
+            f"VALUES (?, ?, ?, ?{', ?' if self._created_at else ''})"
+        )
+        self._connection = connection
+        return connection
+
+    # cria a tabela e a linha de totais; tabelas antigas (só key, valor e created_at) ganham
+    # as colunas de tamanho e de último acesso
+    def _create_schema(self, connection) -> set:
+        table, value = self.table, self.value_column
+        connection.execute(
+            f"CREATE TABLE IF NOT EXISTS {table} ("
+            f"key TEXT PRIMARY KEY, {value} BLOB NOT NULL, size INTEGER NOT NULL, last_access REAL NOT NULL)"
+        )
+        columns = {row[1] for row in connection.execute(f"PRAGMA table_info({table})")}
+        if "size" not in columns:
+            connection.execute(f"ALTER TABLE {table} ADD COLUMN size INTEGER NOT NULL DEFAULT 0")
+            connection.execute(f"UPDATE {table} SET size = length(CAST({value} AS BLOB))")
+        if "last_access" not in columns:
+            connection.execute(f"ALTER TABLE {table} ADD COLUMN last_access REAL NOT NULL DEFAULT 0")
+            if "created_at" in columns:
+                connection.execute(f"UPDATE {table} SET last_access = created_at")
+        # o cache de embeddings criava um índice com nome sem a tabela
+        connection.execute("DROP INDEX IF EXISTS idx_last_access")
+        connection.execute(f"CREATE INDEX IF NOT EXISTS idx_{table}_last_access ON {table}(last_access)")
+        connection.execute("CREATE TABLE IF NOT EXISTS cache_meta (name TEXT PRIMARY KEY, value INTEGER NOT NULL)")
+        connection.execute(
+            f"INSERT OR IGNORE INTO cache_meta (name, value) SELECT ?, COALESCE(SUM(size), 0) FROM {table}",
+            (f"{table}:bytes",)
+        )
+        connection.execute(
+            f"INSERT OR IGNORE INTO cache_meta (name, value) SELECT ?, COUNT(*) FROM {table}",
+            (f"{table}:entries",)
+        )
+        return columns
+
+    def _error(self, operation: str, error: Exception):
+        self._stats["errors"] += 1
+        print(f"Cache {self.table}: {operation} non riuscita, si procede senza cache.", error)
+
+    # devolve {chave: valor} para as chaves encontradas, sem escrever no banco
+    def get_many(self, keys: list) -> dict:
+        found = {}
+        if not keys:
+            return found
+
+        unique_keys = list(dict.fromkeys(keys))
+        with self._lock:
+            try:
+                connection = self._connect()
+                for start in range(0, len(unique_keys), _CHUNK):
+                    part = unique_keys[start:start + _CHUNK]
+                    placeholders = ",".join("?" * len(part))
+                    found.update(connection.execute(
+                        f"SELECT key, {self.value_column} FROM {self.table} WHERE key IN ({placeholders})", part
+                    ).fetchall())
+            except sqlite3.Error as e:
+                self._error("lettura", e)
+
+            now = time.time()
+            for key in found:
+                self._accessed[key] = now
+            if found and self._accessed_since is None:
+                self._accessed_since = now
+            self._stats["hits"] += sum(1 for key in keys if key in found)
+            self._stats["misses"] += sum(1 for key in keys if key not in found)
+            self._flush_accesses_if_due(now)
+        return found
+
+    def get(self, key: str):
+        return self.get_many([key]).get(key)
+
+    # grava vários valores numa transação: acessos pendentes, inserção, totais e evicção
+    def put_many(self, items: dict):
+        if not items:
+            return
+
+        now = time.time()
+        rows = [(key, value, _size(value), now) for key, value in items.items()]
+        with self._lock:
+            try:
+                connection = self._connect()
+                if self._created_at:
+                    rows = [row + (now,) for row in rows]
+                with _transaction(connection):
+                    self._write_accesses(connection)
+                    replaced = self._existing_sizes(connection, list(items))
+                    connection.executemany(self._insert, rows)
+                    self._add_totals(
+                        connection,
+                        sum(row[2] for row in rows) - sum(replaced.values()),
+                        len(rows) - len(replaced),
+                    )
+                    self._evict(connection)
+                self._accessed.clear()
+                self._accessed_since = None
+            except sqlite3.Error as e:
+                self._error("scrittura", e)
+
+    def put(self, key: str, value):
+        self.put_many({key: value})
+
+    def _existing_sizes(self, connection, keys: list) -> dict:
+        sizes = {}
+        for start in range(0, len(keys), _CHUNK):
+            part = keys[start:start + _CHUNK]
+            placeholders = ",".join("?" * len(part))
+            sizes.update(connection.execute(
+                f"SELECT key, size FROM {self.table} WHERE key IN ({placeholders})", part
+            ).fetchall())
+        return sizes
+
+    def _add_totals(self, connection, size: int, entries: int):
+        connection.executemany(
+            "UPDATE cache_meta SET value = value + ? WHERE name = ?",
+            [(size, f"{self.table}:bytes"), (entries, f"{self.table}:entries")]
+        )
+
+    def _totals(self, connection) -> tuple:
+        values = dict(connection.execute(
+            "SELECT name, value FROM cache_meta WHERE name IN (?, ?)",
+            (f"{self.table}:bytes", f"{self.table}:entries")
+        ).fetchall())
+        return values.get(f"{self.table}:bytes", 0), values.get(f"{self.table}:entries", 0)
+
+    def _write_accesses(self, connection):
+        if self._accessed:
+            connection.executemany(
+                f"UPDATE {self.table} SET last_access = ? WHERE key = ?",
+                [(accessed, key) for key, accessed in self._accessed.items()]
+            )
+
+    # sem escritas, os acessos pendentes vão para o banco de tempos em tempos, sem esperar
+    # pela trava: se o outro processo estiver escrevendo, ficam para a próxima vez
+    def _flush_accesses_if_due(self, now: float):
+        if not self._accessed or self._connection is None:
+            return
+        if len(self._accessed) < CACHE_ACCESS_FLUSH_KEYS and now - self._accessed_since < CACHE_ACCESS_FLUSH_SECONDS:
+            return
+        connection = self._connection
+        try:
+            connection.execute("PRAGMA busy_timeout = 0")
+            try:
+                with _transaction(connection):
+                    self._write_accesses(connection)
+                self._accessed.clear()
+                self._accessed_since = None
+            finally:
+                connection.execute(f"PRAGMA busy_timeout = {int(CACHE_BUSY_TIMEOUT_SECONDS * 1000)}")
+        except sqlite3.Error:
+            pass
+
+    # remove as entradas menos usadas recentemente até caber no limite de tamanho
+    def _evict(self, connection):
+        if self.max_bytes is None:
+            return
+        total, _ = self._totals(connection)
+        if total <= self.max_bytes:
+            return
+
+        excess = total - self.max_bytes
+        removed = 0
+        keys = []
+        for key, size in connection.execute(f"SELECT key, size FROM {self.table} ORDER BY last_access ASC"):
+            keys.append((key,))
+            removed += size
+            if removed >= excess:
+                break
+        connection.executemany(f"DELETE FROM {self.table} WHERE key = ?", keys)
+        self._add_totals(connection, -removed, -len(keys))
+        self._stats["evictions"] += len(keys)
+
+    # estatísticas de acerto/erro e tamanho do cache (totais da linha de cache_meta)
+    def stats(self) -> dict:
+        with self._lock:
+            entries = size = 0
+            try:
+                size, entries = self._totals(self._connect())
+            except sqlite3.Error as e:
+                self._error("lettura delle statistiche", e)
+            lookups = self._stats["hits"] + self._stats["misses"]
+            return {
+                **self._stats,
+                "hit_rate": self._stats["hits"] / lookups if lookups else 0.0,
+                "entries": entries,
+                "bytes": size,
+            }
+
+
+# begin immediate já pega a trava de escrita, então a leitura dos tamanhos antigos e a
+# atualização dos totais não se intercalam com a escrita de outro processo
+@contextmanager
+def _transaction(connection):
+    connection.execute("BEGIN IMMEDIATE")
+    try:
+        yield connection
+    except BaseException:
+        if connection.in_transaction:
+            connection.execute("ROLLBACK")
+        raise
+    connection.execute("COMMIT")
@@ -0,0 +1,101 @@
+import os
+import json
+import time
+import contextvars
+from contextlib import contextmanager, nullcontext
+from src import metrics
+
+# spans em volta de cada etapa do /chat e da ingestão. cada span vira uma observação de
+# rag_stage_seconds{stage="..."} no /metrics e entra no registro da requisição atual, que é
+# impresso como uma linha json no fim (TRACING_LOG). com TRACING_OTEL=true (ou a variável
+# padrão OTEL_EXPORTER_OTLP_ENDPOINT definida) os spans também vão para o opentelemetry,
+# se os pacotes opentelemetry-sdk e opentelemetry-exporter-otlp estiverem instalados
+TRACING_LOG = os.getenv("TRACING_LOG", "true").lower() == "true"
+TRACING_OTEL = os.getenv("TRACING_OTEL", "").lower() == "true" or bool(os.getenv("OTEL_EXPORTER_OTLP_ENDPOINT"))
+OTEL_SERVICE_NAME = os.getenv("OTEL_SERVICE_NAME", "rag-chatbot")
+
+# registro da requisição em andamento ({"event", atributos, "stages"}), por contexto
+_current = contextvars.ContextVar("tracing_request", default=None)
+_tracer = None
+_tracer_ready = False
+
+
+# tracer do opentelemetry, criado uma vez; None se desligado ou sem os pacotes
+def _otel_tracer():
+    global _tracer, _tracer_ready
+    if _tracer_ready:
+        return _tracer
+    _tracer_ready = True
+    if not TRACING_OTEL:
+        return None
+    try:
+        from opentelemetry import trace
+        from opentelemetry.sdk.resources import Resource
+        from opentelemetry.sdk.trace import TracerProvider
+        from opentelemetry.sdk.trace.export import BatchSpanProcessor
+        from opentelemetry.exporter.otlp.proto.http.trace_exporter import OTLPSpanExporter
+    except ImportError as e:
+        print(f"OpenTelemetry non disponibile, tracing solo locale: {e}")
+        return None
+    provider = TracerProvider(resource=Resource.create({"service.name": OTEL_SERVICE_NAME}))
+    # o exportador lê o endpoint e os cabeçalhos das variáveis OTEL_EXPORTER_OTLP_*
+    provider.add_span_processor(BatchSpanProcessor(OTLPSpanExporter()))
+    trace.set_tracer_provider(provider)
+    _tracer = trace.get_tracer(OTEL_SERVICE_NAME)
+    return _tracer
+
+
+# soma a duração de uma etapa na métrica e no registro da requisição atual
+def record(stage: str, seconds: float):
+    metrics.observe("stage_seconds", seconds, {"stage": stage})
+    current = _current.get()
+    if current is not None:
+        current["stages"][stage] = current["stages"].get(stage, 0.0) + seconds
+
+
+# mede uma etapa: with tracing.span("chat.search"): ...
+@contextmanager
+def span(stage: str, **attributes):
+    tracer = _otel_tracer()
+    started = time.perf_counter()
+    with tracer.start_as_current_span(stage, attributes=attributes) if tracer else nullcontext():
+        try:
+            yield
+        except Exception:
+            metrics.increment("stage_errors_total", labels={"stage": stage})
+            raise
+        finally:
+            record(stage, time.perf_counter() - started)
+
+
+# versão para corrotinas: resultado = await tracing.traced("chat.embedding", corrotina)
+async def traced(stage: str, awaitable, **attributes):
+    with span(stage, **attributes):
+        return await awaitable
+
+
+# uma requisição (ou documento ingerido): abre o registro das etapas, que pode receber mais
+# campos pelo dict devolvido, e no fim imprime uma linha json com o tempo total e por etapa
+@contextmanager
+def request(event: str, **attributes):
+    current = {"event": event, **attributes, "stages": {}}
+    token = _current.set(current)
+    started = time.perf_counter()
+    try:
+        with span(event, **attributes):
+            yield current
+    except Exception as e:
+        current["error"] = str(e)
+        raise
+    finally:
+        try:
+            _current.reset(token)
+        except ValueError:
+            # geradores de streaming podem ser fechados em outro contexto; o registro já terminou
+            pass
+        if TRACING_LOG:
+            stages = current.pop("stages")
+            line = {**current, "total_ms": round((time.perf_counter() - started) * 1000, 1),
+                    "stages_ms": {name: round(seconds * 1000, 1) for name, seconds in stages.items()
+                                  if name != event}}
+            print(json.dumps(line, ensure_ascii=False, default=str))
@@ -0,0 +1,5 @@
+from benchmarks import fakes
+
+# variáveis de ambiente fictícias antes de qualquer import de src: os testes rodam sem
+# credenciais e sem rede, com os substitutos de benchmarks/fakes.py
+fakes.install_env()
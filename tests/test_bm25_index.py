@@ -0,0 +1,80 @@
+import os
+import subprocess
+import sys
+from src import bm25_index
+from src.bm25_index import BM25Index
+
+
+def _ids(results):
+    return {r["id"] for r in results}
+
+
+# o leitor (a api) vê inclusões e remoções feitas por outro processo (o worker)
+def test_reader_sees_updates_from_writer(tmp_path):
+    writer = BM25Index(str(tmp_path))
+    writer.upsert([{"id": "a", "content": "garanzia del prodotto"}])
+    reader = BM25Index(str(tmp_path))
+    writer.upsert([{"id": "b", "content": "garanzia estesa"}, {"id": "c", "content": "spedizione gratuita"}])
+    writer.delete(["a"])
+
+    assert _ids(reader.search("garanzia", top=5)) == {"b"}
+    assert _ids(reader.search("spedizione", top=5)) == {"c"}
+    assert len(reader) == 2
+
+
+# o snapshot troca o log por um vazio; quem lê recarrega e não perde nem repete operações
+def test_reader_follows_snapshots_and_compaction(tmp_path, monkeypatch):
+    monkeypatch.setattr(bm25_index, "SNAPSHOT_EVERY", 3)
+    writer = BM25Index(str(tmp_path))
+    reader = BM25Index(str(tmp_path))
+    for i in range(7):
+        writer.upsert([{"id": f"d{i}", "content": f"documento numero{i} garanzia"}])
+    assert writer.generation >= 2
+    assert len(reader.search("garanzia", top=10)) == 7
+
+    writer.delete([f"d{i}" for i in range(4)])
+    writer.compact()
+    writer.upsert([{"id": "new", "content": "garanzia nuova"}])
+    assert _ids(reader.search("garanzia", top=10)) == {"d4", "d5", "d6", "new"}
+    assert len(reader.rows) == len(writer.rows)
+
+
+# reindexar ou remover documentos não muda o idf de consultas sem relação com eles: as linhas
+# removidas ainda nas postings não contam como documentos com o termo
+def test_tombstones_do_not_change_scores(tmp_path):
+    index = BM25Index(str(tmp_path))
+    docs = [{"id": f"d{i}", "content": f"garanzia prodotto{i % 3} spedizione"} for i in range(6)]
+    index.upsert(docs)
+    index.upsert([{"id": "d0", "content": "garanzia aggiornata"}, {"id": "d1", "content": "reso"}])
+    index.delete(["d2"])
+    before = [(r["id"], r["score"]) for r in index.search("garanzia spedizione", top=10)]
+
+    reader = BM25Index(str(tmp_path))
+    assert [(r["id"], r["score"]) for r in reader.search("garanzia spedizione", top=10)] == before
+    index.compact()
+    assert [(r["id"], r["score"]) for r in index.search("garanzia spedizione", top=10)] == before
+
+
+_WRITER = """
+import sys
+from src import bm25_index
+from src.bm25_index import BM25Index
+bm25_index.SNAPSHOT_EVERY = 25
+index = BM25Index(sys.argv[1])
+for batch in range(20):
+    index.upsert([{"id": f"w{batch}-{i}", "content": f"garanzia lotto{batch}"} for i in range(5)])
+"""
+
+
+# um processo escrevendo (com snapshots no meio) enquanto este busca
+def test_concurrent_writer_process(tmp_path):
+    reader = BM25Index(str(tmp_path))
+    writer = subprocess.Popen(
+        [sys.executable, "-c", _WRITER, str(tmp_path)],
+        cwd=os.path.dirname(os.path.dirname(os.path.abspath(__file__))),
+    )
+    while writer.poll() is None:
+        for result in reader.search("garanzia", top=5):
+            assert result["id"].startswith("w")
+    assert writer.returncode == 0
+    assert len(reader.search("garanzia", top=1000)) == 100
@@ -0,0 +1,117 @@
+import asyncio
+import uuid
+from types import SimpleNamespace
+import pytest
+from benchmarks.fakes import fake_embedding
+from src import clients, embedding_cache, openai
+from src.sqlite_cache import SqliteCache
+
+
+# endpoint de embeddings falso que conta as requisições e guarda os inputs de cada uma.
+# fail(text, tentativa) decide se o item some da resposta, como um input rejeitado
+class CountingEmbeddings:
+    def __init__(self, fail=None):
+        self.requests = []
+        self.attempts = {}
+        self.fail = fail or (lambda text, attempt: False)
+        self.embeddings = SimpleNamespace(create=self._create)
+
+    def _create(self, model, input, **kwargs):
+        self.requests.append(list(input))
+        data = []
+        for index, text in enumerate(input):
+            attempt = self.attempts[text] = self.attempts.get(text, 0) + 1
+            if not self.fail(text, attempt):
+                data.append(SimpleNamespace(index=index, embedding=fake_embedding(text)))
+        return SimpleNamespace(data=data)
+
+
+@pytest.fixture
+def endpoint(monkeypatch):
+    monkeypatch.setattr(openai.time, "sleep", lambda seconds: None)
+
+    def install(fail=None):
+        fake = CountingEmbeddings(fail)
+        clients.override("openai", fake)
+        return fake
+    return install
+
+
+# textos novos a cada teste, para o cache de embeddings não responder no lugar do endpoint
+def _texts(count: int, words: int = 3) -> list:
+    run = uuid.uuid4().hex[:8]
+    return [" ".join([f"testo{i:02d}"] * words) + f" {run}" for i in range(count)]
+
+
+def test_batches_respect_max_inputs(endpoint):
+    fake = endpoint()
+    texts = _texts(25)
+    results = openai.get_embeddings_batch(texts, max_inputs=10, max_tokens=100_000, max_concurrency=1)
+
+    assert [len(request) for request in fake.requests] == [10, 10, 5]
+    assert results == [fake_embedding(text) for text in texts]
+
+
+def test_batches_respect_max_tokens(endpoint):
+    fake = endpoint()
+    texts = _texts(12, words=20)
+    per_text = openai.text_tokens(texts[0])
+    limit = per_text * 3 + 1
+    results = openai.get_embeddings_batch(texts, max_inputs=100, max_tokens=limit, max_concurrency=2)
+
+    assert len(fake.requests) == 4
+    assert all(sum(openai.text_tokens(t) for t in request) <= limit for request in fake.requests)
+    assert results == [fake_embedding(text) for text in texts]
+
+
+# a lista devolvida segue a ordem da entrada: inválidos viram None, repetidos vão uma vez só
+# ao endpoint e o que já está no cache não é pedido de novo
+def test_results_keep_input_order(endpoint):
+    texts = _texts(6)
+    endpoint()
+    openai.get_embeddings_batch(texts[:2])
+    fake = endpoint()
+    inputs = [texts[2], "", texts[0], None, texts[3], texts[2], texts[4], 42, texts[5], texts[1]]
+    results = openai.get_embeddings_batch(inputs, max_inputs=2, max_concurrency=3)
+
+    expected = [fake_embedding(t) if isinstance(t, str) and t else None for t in inputs]
+    assert results == expected
+    sent = [text for request in fake.requests for text in request]
+    assert sorted(sent) == sorted([texts[2], texts[3], texts[4], texts[5]])
+
+
+# só os itens que não voltaram são reenviados; um item que sempre falha vira None sem
+# derrubar os outros do lote
+def test_only_failed_items_are_retried(endpoint):
+    texts = _texts(8)
+    flaky, broken = texts[2], texts[5]
+    fake = endpoint(lambda text, attempt: text == broken or (text == flaky and attempt == 1))
+    results = openai.get_embeddings_batch(texts, max_inputs=8, max_concurrency=1, max_retries=2)
+
+    assert fake.requests[0] == texts
+    retried = [text for request in fake.requests[1:] for text in request]
+    assert set(retried) == {flaky, broken}
+    assert fake.attempts[flaky] == 2
+    assert fake.attempts[broken] == 3
+    assert results == [None if text == broken else fake_embedding(text) for text in texts]
+
+
+# o endpoint devolve float64; a primeira chamada (falta) e a segunda (acerto) dão o mesmo
+# vetor, nos três caminhos
+def test_cache_miss_and_hit_return_the_same_values(monkeypatch, tmp_path):
+    monkeypatch.setattr(embedding_cache, "_cache", SqliteCache(str(tmp_path / "embeddings.sqlite"), "embeddings", "vector"))
+    vector = [0.1, 1 / 3, -2 / 7]
+    response = SimpleNamespace(data=[SimpleNamespace(index=0, embedding=vector)])
+
+    async def create_async(**kwargs):
+        return response
+    clients.override("openai", SimpleNamespace(embeddings=SimpleNamespace(create=lambda **kwargs: response)))
+    clients.override("openai_async", SimpleNamespace(embeddings=SimpleNamespace(create=create_async)))
+
+    texts = _texts(3)
+    for fetch, text in ((openai.get_embedding, texts[0]),
+                        (lambda t: asyncio.run(openai.get_embedding_async(t)), texts[1]),
+                        (lambda t: openai.get_embeddings_batch([t])[0], texts[2])):
+        miss = fetch(text)
+        assert miss != vector
+        assert fetch(text) == miss
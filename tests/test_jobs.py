@@ -0,0 +1,71 @@
+import time
+import pytest
+import worker
+from src import jobs
+
+
+@pytest.fixture(autouse=True)
+def queue(monkeypatch, tmp_path):
+    monkeypatch.setattr(jobs, "jobs_path", str(tmp_path / "jobs.sqlite"))
+
+
+def _expire(job_id: str):
+    with jobs._connect() as connection:
+        connection.execute("UPDATE jobs SET lease_until = ? WHERE id = ?", (time.time() - 1, job_id))
+
+
+# um job com o lease renovado não é pego por outro worker; com o lease expirado, é
+def test_heartbeat_keeps_job_with_its_worker():
+    job = jobs.enqueue(jobs.INGEST_BLOB, {"blob_name": "a.pdf"})
+    assert jobs.claim()["id"] == job["id"]
+    _expire(job["id"])
+    assert jobs.heartbeat(job["id"])
+    assert jobs.claim() is None
+
+    _expire(job["id"])
+    claimed = jobs.claim()
+    assert claimed["id"] == job["id"] and claimed["attempts"] == 2
+
+
+# lease expirado sem tentativas sobrando: o job falha em vez de voltar para a fila
+def test_expired_lease_without_attempts_fails(monkeypatch):
+    monkeypatch.setattr(jobs, "JOB_MAX_ATTEMPTS", 2)
+    job = jobs.enqueue(jobs.INGEST_BLOB, {"blob_name": "b.pdf"})
+    for _ in range(2):
+        assert jobs.claim()["id"] == job["id"]
+        _expire(job["id"])
+
+    assert jobs.claim() is None
+    failed = jobs.get(job["id"])
+    assert failed["status"] == jobs.FAILED and "lease" in failed["error"]
+    assert not jobs.heartbeat(job["id"])
+
+
+# o worker renova o lease enquanto o job roda
+def test_worker_renews_lease_while_job_runs(monkeypatch):
+    monkeypatch.setattr(jobs, "JOB_HEARTBEAT_SECONDS", 0.01)
+    renewed = []
+    heartbeat = jobs.heartbeat
+    monkeypatch.setattr(jobs, "heartbeat", lambda job_id: renewed.append(job_id) or heartbeat(job_id))
+    job = jobs.enqueue(jobs.INGEST_BLOB, {"blob_name": "c.pdf"})
+    claimed = jobs.claim()
+    with worker.keep_lease(claimed["id"]):
+        time.sleep(0.1)
+
+    assert renewed and set(renewed) == {job["id"]}
+    count = len(renewed)
+    time.sleep(0.05)
+    assert len(renewed) == count
+
+
+# o job do upload leva o etag gravado; a ingestão usa esse etag, sem consultar o blob de novo
+def test_run_job_passes_upload_etag(monkeypatch):
+    from src import ingest
+    calls = []
+    monkeypatch.setattr(ingest, "ingest_blob", lambda blob_name, etag=None: calls.append((blob_name, etag)) or {})
+    jobs.enqueue(jobs.INGEST_BLOB, {"blob_name": "d.pdf", "etag": "0x1"})
+    jobs.enqueue(jobs.INGEST_BLOB, {"blob_name": "e.pdf"})
+    worker.run_job(jobs.claim())
+    worker.run_job(jobs.claim())
+
+    assert calls == [("d.pdf", "0x1"), ("e.pdf", None)]
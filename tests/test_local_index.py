@@ -0,0 +1,109 @@
+import os
+import subprocess
+import sys
+import numpy as np
+from src.local_index import LocalVectorIndex
+
+DIMENSIONS = 8
+
+
+def _docs(ids, seed=0):
+    rng = np.random.default_rng(seed)
+    return [{"id": doc_id, "content": f"testo {doc_id}", "contentVector": rng.standard_normal(DIMENSIONS).tolist()}
+            for doc_id in ids]
+
+
+def _ids(results):
+    return {r["id"] for r in results}
+
+
+# o leitor (a api) vê o que outro processo (o worker) acrescentou depois de abrir o índice
+def test_reader_sees_documents_written_after_it_opened(tmp_path):
+    writer = LocalVectorIndex(str(tmp_path), DIMENSIONS)
+    writer.upsert(_docs(["a"]))
+    reader = LocalVectorIndex(str(tmp_path), DIMENSIONS)
+    writer.upsert(_docs(["b", "c", "d"], seed=1))
+    writer.delete(["a"])
+
+    docs = _docs(["b", "c", "d"], seed=1)
+    assert _ids(reader.search(docs[0]["contentVector"], k=10)) == {"b", "c", "d"}
+    assert len(reader) == 3
+
+
+# vetores gravados sem a linha do log (escritor no meio de um upsert) não são cortados por quem
+# só lê; o escritor continua consistente e descarta o resto só na própria escrita seguinte
+def test_reader_does_not_truncate_pending_vectors(tmp_path):
+    writer = LocalVectorIndex(str(tmp_path), DIMENSIONS)
+    writer.upsert(_docs(["a", "b"]))
+    with open(writer.vectors_path, "ab") as data:
+        data.write(np.ones(DIMENSIONS, dtype=np.float32).tobytes())
+    size = os.path.getsize(writer.vectors_path)
+
+    reader = LocalVectorIndex(str(tmp_path), DIMENSIONS)
+    assert os.path.getsize(writer.vectors_path) == size
+    assert len(reader) == 2
+
+    docs = _docs(["c"], seed=2)
+    writer.upsert(docs)
+    assert reader.search(docs[0]["contentVector"], k=1)[0]["id"] == "c"
+    assert writer.search(docs[0]["contentVector"], k=1)[0]["id"] == "c"
+    assert os.path.getsize(writer.vectors_path) == 3 * DIMENSIONS * 4
+
+
+# a compactação troca a geração: quem lê recarrega os arquivos novos e continua acertando
+def test_reader_reloads_after_compaction(tmp_path):
+    writer = LocalVectorIndex(str(tmp_path), DIMENSIONS)
+    docs = _docs([f"d{i}" for i in range(10)])
+    writer.upsert(docs)
+    reader = LocalVectorIndex(str(tmp_path), DIMENSIONS)
+    assert len(reader.search(docs[0]["contentVector"], k=10)) == 10
+
+    writer.delete([f"d{i}" for i in range(5)])
+    writer.compact()
+    writer.upsert(_docs(["new"], seed=3))
+
+    results = reader.search(docs[7]["contentVector"], k=10)
+    assert _ids(results) == {f"d{i}" for i in range(5, 10)} | {"new"}
+    assert results[0]["id"] == "d7"
+    assert reader.generation == writer.generation == 1
+    assert not os.path.exists(os.path.join(str(tmp_path), "vectors.bin"))
+
+
+# os códigos de uma quantização usada por um processo são mantidos por escritores sem quantização
+def test_writer_keeps_codes_of_other_processes(tmp_path):
+    writer = LocalVectorIndex(str(tmp_path), DIMENSIONS)
+    writer.upsert(_docs(["a", "b"]))
+    reader = LocalVectorIndex(str(tmp_path), DIMENSIONS, quantization="int8")
+    docs = _docs(["c"], seed=4)
+    writer.upsert(docs)
+
+    assert reader.search(docs[0]["contentVector"], k=1)[0]["id"] == "c"
+    assert reader._codes is not None and reader._codes.shape[0] == 3
+
+
+_WRITER = """
+import sys
+import numpy as np
+from src.local_index import LocalVectorIndex
+index = LocalVectorIndex(sys.argv[1], {dimensions})
+rng = np.random.default_rng(5)
+for batch in range(20):
+    index.upsert([{{"id": f"w{{batch}}-{{i}}", "contentVector": rng.standard_normal({dimensions}).tolist()}}
+                  for i in range(5)])
+"""
+
+
+# um processo escrevendo de verdade enquanto este busca: ao fim, tudo visível e consistente
+def test_concurrent_writer_process(tmp_path):
+    reader = LocalVectorIndex(str(tmp_path), DIMENSIONS)
+    writer = subprocess.Popen(
+        [sys.executable, "-c", _WRITER.format(dimensions=DIMENSIONS), str(tmp_path)],
+        cwd=os.path.dirname(os.path.dirname(os.path.abspath(__file__))),
+    )
+    query = np.ones(DIMENSIONS)
+    while writer.poll() is None:
+        for result in reader.search(query, k=5):
+            assert result["id"].startswith("w")
+    assert writer.returncode == 0
+    assert len(reader.search(query, k=1000)) == 100
+    assert reader._matrix.shape[0] == 100
@@ -0,0 +1,18 @@
+from types import SimpleNamespace
+import pytest
+import worker
+from src import ingest_manifest, search_service
+
+
+# se o processo cair ao recriar o índice, o manifesto já está limpo: o próximo bulk ingere
+# todos os documentos de novo em vez de pulá-los como já indexados
+def test_reindex_clears_manifest_before_dropping_the_index(tmp_path, monkeypatch):
+    ingest_manifest.save_document("manuale.pdf", "etag-1", "hash-1", {"chunk-1"})
+
+    def crash():
+        raise RuntimeError("processo interrotto")
+    monkeypatch.setattr(search_service, "recreate_vector_index", crash)
+
+    with pytest.raises(RuntimeError):
+        worker.reindex(SimpleNamespace(dir=str(tmp_path), prefix=None, concurrency=1))
+    assert ingest_manifest.get_document("manuale.pdf") is None
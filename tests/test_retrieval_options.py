@@ -0,0 +1,21 @@
+import pytest
+from fastapi.testclient import TestClient
+import main
+
+# sem o "with", o TestClient não roda o lifespan: a validação responde antes de qualquer serviço
+client = TestClient(main.app)
+
+
+@pytest.mark.parametrize("retrieval", [
+    {"top": 0}, {"vector_k": 0}, {"text_k": -3}, {"rrf_k": -1},
+    {"vector_weight": -0.5}, {"text_weight": -1}, {"mmr_lambda": 1.5}, {"mmr_candidates": 0},
+])
+def test_invalid_retrieval_options_are_rejected(retrieval):
+    response = client.post("/chat", json={"question": "Quanto dura la garanzia?", "retrieval": retrieval})
+    assert response.status_code == 422
+
+
+def test_valid_retrieval_options_keep_only_given_values():
+    options = main.RetrievalOptions(top=3, rrf_k=0, vector_weight=0.0)
+    assert {k: v for k, v in options.model_dump().items() if v is not None} == \
+        {"top": 3, "rrf_k": 0, "vector_weight": 0.0}
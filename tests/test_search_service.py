@@ -0,0 +1,12 @@
+import inspect
+from src import search_service
+
+
+# as versões síncrona e assíncrona aceitam os mesmos argumentos, na mesma ordem, e tudo
+# depois de k/top é só nomeado: trocar uma pela outra não troca o filtro pelo vetor
+def test_sync_and_async_searches_share_signatures():
+    for name in ("search_vector_scored", "search_text_scored"):
+        sync = inspect.signature(getattr(search_service, name)).parameters
+        async_ = inspect.signature(getattr(search_service, f"{name}_async")).parameters
+        assert list(sync) == list(async_)
+        assert all(p.kind == p.KEYWORD_ONLY for p in list(sync.values())[2:])
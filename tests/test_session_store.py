@@ -0,0 +1,131 @@
+import json
+import asyncio
+import pytest
+from benchmarks import fakes
+from src import blob_logs, clients, session_store
+
+
+@pytest.fixture
+def blob_service():
+    service = fakes.FakeAsyncBlobServiceClient(latency=0)
+    clients.override("blob_async", service)
+    clients.override("blob_logs_container_async", service.get_container_client(blob_logs.log_container_name))
+    session_store._sessions.clear()
+    session_store._dirty.clear()
+    yield service
+    session_store._sessions.clear()
+    session_store._dirty.clear()
+
+
+def _store(service):
+    return service.containers[blob_logs.log_container_name]
+
+
+# sessão gravada no formato antigo (session_memory/<id>.json, histórico inteiro): a migração
+# conta os tokens das mensagens, então a janela do /chat funciona já no primeiro turno
+def test_legacy_session_is_migrated_with_token_counts(blob_service):
+    history = [
+        {"role": "user", "content": "Ciao, come funziona la garanzia?"},
+        {"role": "assistant", "content": "La garanzia dura due anni."},
+    ]
+    payload = json.dumps({"session_id": "legacy", "history": history}).encode("utf-8")
+    _store(blob_service)["session_memory/legacy.json"] = [payload, "etag-0", 1]
+
+    async def scenario():
+        window, tokens = await session_store.get_window("legacy", 10_000)
+        session = session_store._sessions["legacy"]
+        assert window == history
+        assert tokens > 0
+        assert session.tokens == tokens
+        assert all("tokens" in m for m in session.messages)
+
+        # o turno seguinte usa a mesma sessão em cache e grava o histórico migrado no journal
+        await session_store.append_turn("legacy", [{"role": "user", "content": "E dopo?"}])
+        window, _ = await session_store.get_window("legacy", 10_000)
+        assert len(window) == 3
+
+    asyncio.run(scenario())
+    journal = session_store._decode(_store(blob_service)["session_memory/legacy.jsonl"][0])
+    assert [m["content"] for m in journal] == [m["content"] for m in history] + ["E dopo?"]
+
+
+# dois workers da api com a mesma sessão em cache: o turno gravado por um aparece no prompt
+# do outro sem esperar um conflito de escrita
+def test_cached_session_sees_turns_written_by_another_worker(blob_service, monkeypatch):
+    monkeypatch.setattr(session_store, "SESSION_REVALIDATE_SECONDS", 0)
+    store = _store(blob_service)
+
+    async def other_worker(messages):
+        # o outro processo acrescenta um bloco ao journal, como o flush dele faria
+        blob = blob_service.get_container_client(blob_logs.log_container_name).get_blob_client(
+            "session_memory/shared.jsonl")
+        entries = [{**m, "tokens": session_store.openai.message_tokens(m)} for m in messages]
+        await blob.append_block(session_store._encode(entries), etag=store["session_memory/shared.jsonl"][1],
+                                match_condition=session_store.MatchConditions.IfNotModified)
+
+    async def scenario():
+        await session_store.append_turn("shared", [
+            {"role": "user", "content": "Prima domanda"}, {"role": "assistant", "content": "Prima risposta"},
+        ])
+        await other_worker([
+            {"role": "user", "content": "Seconda domanda"}, {"role": "assistant", "content": "Seconda risposta"},
+        ])
+        window, tokens = await session_store.get_window("shared", 10_000)
+        assert [m["content"] for m in window] == ["Prima domanda", "Prima risposta", "Seconda domanda", "Seconda risposta"]
+        session = session_store._sessions["shared"]
+        assert session.tokens == tokens
+        assert session.size == len(store["session_memory/shared.jsonl"][0])
+
+        # o próximo turno deste worker entra depois, sem conflito
+        await session_store.append_turn("shared", [{"role": "user", "content": "Terza domanda"}])
+
+        # o journal reescrito por outro processo (compactação) é relido inteiro
+        messages = session_store._decode(store["session_memory/shared.jsonl"][0])
+        extra = {"role": "assistant", "content": "Terza risposta", "tokens": 5}
+        store["session_memory/shared.jsonl"] = [session_store._encode(messages + [extra]), "compacted", 1]
+        history = await session_store.get_history("shared")
+        assert [m["content"] for m in history][-2:] == ["Terza domanda", "Terza risposta"]
+        assert len(history) == 6
+
+    asyncio.run(scenario())
+    journal = session_store._decode(_store(blob_service)["session_memory/shared.jsonl"][0])
+    assert [m["content"] for m in journal][-2:] == ["Terza domanda", "Terza risposta"]
+
+
+# dentro do intervalo de revalidação os turnos não consultam o blob; o turno gravado por outro
+# worker nesse meio tempo é detectado pelo etag da escrita, que baixa só o que falta
+def test_turns_do_not_check_the_blob_and_writes_catch_up(blob_service, monkeypatch):
+    store = _store(blob_service)
+    calls = []
+    for name in ("get_blob_properties", "download_blob"):
+        original = getattr(fakes._FakeAsyncBlobClient, name)
+
+        def counted(self, *args, _name=name, _original=original, **kwargs):
+            calls.append((_name, kwargs.get("offset")))
+            return _original(self, *args, **kwargs)
+        monkeypatch.setattr(fakes._FakeAsyncBlobClient, name, counted)
+
+    async def scenario():
+        await session_store.append_turn("busy", [{"role": "user", "content": "Uno"}])
+        calls.clear()
+        for i in range(5):
+            await session_store.get_window("busy", 10_000)
+        assert calls == []
+
+        # outro worker acrescenta um turno; a próxima escrita daqui perde a corrida do etag
+        blob = blob_service.get_container_client(blob_logs.log_container_name).get_blob_client(
+            "session_memory/busy.jsonl")
+        size = len(store["session_memory/busy.jsonl"][0])
+        other = [{"role": "assistant", "content": "Due", "tokens": 3}]
+        await blob.append_block(session_store._encode(other), etag=store["session_memory/busy.jsonl"][1],
+                                match_condition=session_store.MatchConditions.IfNotModified)
+        await session_store.append_turn("busy", [{"role": "user", "content": "Tre"}])
+        assert ("download_blob", size) in calls
+        assert ("download_blob", None) not in calls
+
+        history = await session_store.get_history("busy")
+        assert [m["content"] for m in history] == ["Uno", "Due", "Tre"]
+
+    asyncio.run(scenario())
+    journal = session_store._decode(store["session_memory/busy.jsonl"][0])
+    assert [m["content"] for m in journal] == ["Uno", "Due", "Tre"]
@@ -0,0 +1,122 @@
+import fitz
+from concurrent.futures import ThreadPoolExecutor
+import pytest
+from benchmarks.fakes import FakeDocumentIntelligenceClient
+from src import clients, smart_doc
+from src.sqlite_cache import SqliteCache
+
+TEXT = "Questa pagina ha abbastanza testo per non passare dal servizio di layout. " * 3
+
+
+# pdf de 10 páginas: as páginas 3, 4 e 8 têm pouco ou nenhum texto (vão para o document intelligence)
+def _pdf(tmp_path) -> str:
+    path = str(tmp_path / "documento.pdf")
+    with fitz.open() as document:
+        for page_number in range(1, 11):
+            page = document.new_page()
+            if page_number in (3, 8):
+                page.insert_text((50, 100), f"scansione {page_number}")
+            elif page_number != 4:
+                page.insert_textbox(fitz.Rect(50, 50, 550, 800), f"Pagina {page_number}. {TEXT}")
+        document.save(path)
+    return path
+
+
+# substituto do serviço que guarda as páginas de cada corpo recebido
+class RecordingLayoutClient(FakeDocumentIntelligenceClient):
+    def __init__(self):
+        super().__init__(latency_per_page=0)
+        self.bodies = []
+
+    def begin_analyze_document(self, model_id, body, pages=None, features=None, **kwargs):
+        data = body.read()
+        with fitz.open(stream=data, filetype="pdf") as document:
+            self.bodies.append((document.page_count, pages))
+        return super().begin_analyze_document(model_id, data, pages, features, **kwargs)
+
+
+@pytest.fixture
+def layout_client(monkeypatch, tmp_path):
+    monkeypatch.setattr(smart_doc.layout_cache, "_cache", SqliteCache(str(tmp_path / "layout.sqlite"), "layouts", "result"))
+    fake = RecordingLayoutClient()
+    clients.override("document_intelligence", fake)
+    return fake
+
+
+# cada faixa vai como um sub-pdf só com as suas páginas, e as páginas voltam numeradas como
+# no pdf original
+def test_selective_sends_sub_pdfs_and_remaps_pages(tmp_path, layout_client):
+    path = _pdf(tmp_path)
+    stats, texts = {}, {}
+    result = smart_doc.analyze_selective(path, "documento.pdf", stats, page_texts=texts)
+
+    assert sorted(layout_client.bodies) == [(1, None), (2, None)]
+    assert stats == {"layout_pages_total": 10, "layout_pages_sent": 3, "layout_ranges": 2}
+    assert {p["content"]: p["page_number"] for p in result["paragraphs"]} == {
+        "scansione 3": 3, "scansione 8": 8}
+    # só o texto das páginas que não foram ao serviço fica guardado para a extração
+    assert set(texts) == {1, 2, 5, 6, 7, 9, 10}
+
+    # segunda passada: tudo do cache, nada enviado
+    layout_client.bodies.clear()
+    assert smart_doc.analyze_selective(path, "documento.pdf") == result
+    assert layout_client.bodies == []
+
+
+# a extração usa o texto lido na sondagem em vez de ler a página de novo, também nos
+# processos do pool
+@pytest.mark.parametrize("workers", [1, 2])
+def test_extraction_reuses_probe_text(tmp_path, monkeypatch, workers):
+    monkeypatch.setattr(smart_doc, "EXTRACT_MIN_PAGES_FOR_POOL", 1)
+    path = _pdf(tmp_path)
+    texts = {page_number: f"testo della sonda {page_number}" for page_number in range(1, 11)}
+    blocks = list(smart_doc.iter_pdf_blocks(
+        path, skip_text_pages={2}, workers=workers, pages_per_task=3, page_texts=texts))
+
+    assert [(b["page_number"], b["content"]) for b in blocks] == [
+        (n, f"testo della sonda {n}") for n in range(1, 11) if n != 2]
+    # cada texto sai do dicionário quando a sua faixa é extraída
+    assert texts == {}
+
+
+# o texto guardado pela sondagem tem um teto; as páginas de fora são lidas de novo na extração
+def test_probe_text_is_bounded(tmp_path, monkeypatch):
+    path = _pdf(tmp_path)
+    monkeypatch.setattr(smart_doc, "DI_PROBE_TEXT_MAX_CHARS", 3 * len(TEXT))
+    texts = {}
+    with fitz.open(path) as document:
+        smart_doc.probe_pages(document, texts)
+    assert 0 < len(texts) < 7
+    assert sum(len(text) for text in texts.values()) <= 3 * len(TEXT)
+
+    blocks = list(smart_doc.iter_pdf_blocks(path, workers=1, page_texts=texts))
+    assert [b["page_number"] for b in blocks] == [1, 2, 3, 5, 6, 7, 8, 9, 10]
+
+
+# o pool é criado de dentro de threads (run_bulk): os processos não podem vir de um fork
+# do processo principal
+def test_extraction_pool_does_not_fork_the_caller():
+    assert smart_doc._pool_context().get_start_method() in ("forkserver", "spawn")
+
+
+# documentos extraídos em paralelo (run_bulk) usam o mesmo pool, com EXTRACT_WORKERS processos;
+# pdfs em memória passam pelo arquivo temporário
+def test_documents_share_one_extraction_pool(tmp_path, monkeypatch):
+    monkeypatch.setattr(smart_doc, "EXTRACT_MIN_PAGES_FOR_POOL", 1)
+    path = _pdf(tmp_path)
+    with open(path, "rb") as f:
+        data = f.read()
+    expected = [(b["page_number"], b["content"]) for b in smart_doc.iter_pdf_blocks(path, workers=1)]
+
+    def extract(pdf):
+        return [(b["page_number"], b["content"]) for b in smart_doc.iter_pdf_blocks(pdf, workers=2, pages_per_task=2)]
+
+    with ThreadPoolExecutor(max_workers=4) as executor:
+        results = list(executor.map(extract, [path, data, path, data]))
+    pool = smart_doc._extract_pool
+    assert all(result == expected for result in results)
+    assert pool is not None and pool._max_workers == smart_doc.EXTRACT_WORKERS
+    assert extract(path) == expected and smart_doc._extract_pool is pool
+
+    smart_doc.shutdown_extract_pool()
+    assert smart_doc._extract_pool is None
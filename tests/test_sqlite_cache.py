@@ -0,0 +1,76 @@
+import sqlite3
+from src import sqlite_cache
+from src.sqlite_cache import SqliteCache
+
+
+def _totals(path: str, table: str) -> tuple:
+    with sqlite3.connect(path) as connection:
+        counted = connection.execute(f"SELECT COALESCE(SUM(size), 0), COUNT(*) FROM {table}").fetchone()
+        meta = dict(connection.execute("SELECT name, value FROM cache_meta").fetchall())
+    return counted, (meta[f"{table}:bytes"], meta[f"{table}:entries"])
+
+
+# o total em cache_meta acompanha inserções, substituições e evicções sem somar a tabela
+def test_running_totals_follow_writes_and_evictions(tmp_path):
+    path = str(tmp_path / "cache.sqlite")
+    cache = SqliteCache(path, "items", max_bytes=100)
+    cache.put_many({f"k{i}": b"x" * 10 for i in range(8)})
+    cache.put("k0", b"y" * 30)
+    counted, meta = _totals(path, "items")
+    assert counted == meta == (100, 8)
+
+    cache.get("k1")
+    cache.put("k8", b"z" * 25)
+    counted, meta = _totals(path, "items")
+    assert counted == meta
+    assert meta[0] <= 100
+    # k1 foi lido antes da escrita e o acesso foi gravado junto com ela: não é o primeiro a sair
+    assert cache.get("k1") == b"x" * 10
+    assert cache.get("k2") is None
+    assert cache.stats()["evictions"] >= 1
+
+
+# leituras não escrevem no banco: funcionam com outro processo segurando a trava de escrita
+def test_reads_do_not_wait_for_writers(tmp_path, monkeypatch):
+    monkeypatch.setattr(sqlite_cache, "CACHE_BUSY_TIMEOUT_SECONDS", 0.05)
+    path = str(tmp_path / "cache.sqlite")
+    cache = SqliteCache(path, "items")
+    cache.put("a", b"1")
+
+    other = sqlite3.connect(path, isolation_level=None)
+    other.execute("BEGIN IMMEDIATE")
+    try:
+        assert cache.get("a") == b"1"
+        # a escrita não consegue a trava: é descartada sem erro
+        cache.put("b", b"2")
+        assert cache.stats()["errors"] == 1
+    finally:
+        other.execute("ROLLBACK")
+        other.close()
+    assert cache.get("b") is None
+
+
+# banco inutilizável: toda leitura vira falta e nada sobe para quem chamou
+def test_database_errors_are_misses(tmp_path):
+    path = tmp_path / "cache.sqlite"
+    path.write_bytes(b"isto nao e um banco sqlite" * 100)
+    cache = SqliteCache(str(path), "items")
+    assert cache.get_many(["a", "b"]) == {}
+    cache.put("a", b"1")
+    stats = cache.stats()
+    assert stats["misses"] == 2
+    assert stats["errors"] >= 2
+
+
+# tabelas antigas (key, valor, created_at) ganham tamanho e último acesso e continuam valendo
+def test_migrates_tables_without_size(tmp_path):
+    path = str(tmp_path / "cache.sqlite")
+    with sqlite3.connect(path) as connection:
+        connection.execute("CREATE TABLE captions (key TEXT PRIMARY KEY, caption TEXT NOT NULL, created_at REAL NOT NULL)")
+        connection.execute("INSERT INTO captions VALUES ('a', 'legenda', 1.0)")
+
+    cache = SqliteCache(path, "captions", "caption", max_bytes=1000)
+    assert cache.get("a") == "legenda"
+    cache.put("b", "outra legenda")
+    counted, meta = _totals(path, "captions")
+    assert counted == meta == (len("legenda") + len("outra legenda"), 2)
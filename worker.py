@@ -0,0 +1,177 @@
+from dotenv import load_dotenv
+load_dotenv()
+import argparse
+import os
+import sys
+import threading
+import time
+import traceback
+from contextlib import contextmanager
+from src import jobs
+
+# intervalo entre consultas à fila quando ela está vazia
+POLL_SECONDS = 2
+# porta do /metrics do worker (0 = desligado)
+METRICS_PORT = int(os.getenv("METRICS_PORT", "0"))
+
+
+# expõe as métricas da ingestão (etapas, tokens, repetições, caches) para o prometheus
+def start_metrics():
+    if not METRICS_PORT:
+        return
+    from src import metrics, embedding_cache, caption_cache, layout_cache
+    metrics.start_http_server(METRICS_PORT, lambda: {
+        "embedding": embedding_cache.stats(), "caption": caption_cache.stats(), "layout": layout_cache.stats(),
+    })
+
+
+# executa um job de acordo com o tipo
+def run_job(job: dict) -> dict:
+    from src import ingest
+    payload = job["payload"]
+    if job["kind"] == jobs.INGEST_BLOB:
+        # o etag gravado no upload: o blob sobrescrito depois disso não é indexado no lugar dele
+        return ingest.ingest_blob(payload["blob_name"], payload.get("etag"))
+    raise ValueError(f"Tipo di job sconosciuto: {job['kind']}")
+
+
+# renova o lease do job numa thread enquanto ele roda, para outro worker não pegá-lo no meio
+@contextmanager
+def keep_lease(job_id: str):
+    stop = threading.Event()
+
+    def renew():
+        while not stop.wait(jobs.JOB_HEARTBEAT_SECONDS):
+            try:
+                jobs.heartbeat(job_id)
+            except Exception as e:
+                print(f"Rinnovo del lease del job {job_id} non riuscito: {e}")
+
+    thread = threading.Thread(target=renew, daemon=True)
+    thread.start()
+    try:
+        yield
+    finally:
+        stop.set()
+        thread.join()
+
+
+# processa a fila; com once=True para quando a fila esvaziar
+def run_worker(once: bool = False):
+    from src import search_service
+
+    # garante que o índice vetorial já exista no azure search
+    search_service.create_vector_index()
+    print("Worker di ingestione avviato.")
+
+    while True:
+        job = jobs.claim()
+        if job is None:
+            if once:
+                return
+            time.sleep(POLL_SECONDS)
+            continue
+
+        print(f"Job {job['id']} ({job['kind']}) avviato: {job['payload']}")
+        try:
+            with keep_lease(job["id"]):
+                result = run_job(job)
+            jobs.complete(job["id"], result)
+            print(f"Job {job['id']} completato.")
+        except Exception as e:
+            traceback.print_exc()
+            jobs.fail(job["id"], str(e))
+            print(f"Errore nel job {job['id']}: {e}")
+
+
+# pdfs do bulk/reindex: de uma pasta local ou do container
+def select_sources(args) -> list:
+    from src import bulk_ingest
+    if args.dir:
+        return list(bulk_ingest.iter_local_sources(args.dir))
+    return list(bulk_ingest.iter_container_sources(args.prefix))
+
+
+# recria o índice com o tamanho dos vetores configurado e ingere tudo de novo.
+# os embeddings saem do cache quando o tamanho não mudou, então só a escrita no índice se repete
+def reindex(args):
+    from src import bulk_ingest, search_service, ingest_manifest
+    # as fontes são listadas antes de apagar o índice
+    sources = select_sources(args)
+    missing = {d["source"] for d in ingest_manifest.list_documents()} - {source for source, _ in sources}
+    if missing:
+        print(f"Attenzione: {len(missing)} documenti del manifesto non sono tra le fonti e "
+              f"non saranno reindicizzati: {', '.join(sorted(missing)[:10])}")
+    # o manifesto é limpo antes: se o processo cair depois de apagar o índice, o próximo bulk
+    # ingere tudo de novo em vez de pular documentos marcados como indexados. os ids dos chunks
+    # são determinísticos, então reenviar para o índice antigo não duplica nada
+    ingest_manifest.clear()
+    search_service.recreate_vector_index()
+    summary = bulk_ingest.run_bulk(sources, args.concurrency)
+    if summary["failed"]:
+        raise SystemExit(1)
+
+
+# executa o subcomando escolhido na linha de comando
+def run_command(args):
+    if args.command == "run":
+        run_worker(once=args.once)
+    elif args.command == "enqueue":
+        for blob_name in args.blob_names:
+            job = jobs.enqueue(jobs.INGEST_BLOB, {"blob_name": blob_name})
+            print(f"{job['id']} {job['status']} {blob_name}")
+    elif args.command == "bulk":
+        from src import bulk_ingest, search_service
+        search_service.create_vector_index()
+        summary = bulk_ingest.run_bulk(select_sources(args), args.concurrency)
+        if summary["failed"]:
+            raise SystemExit(1)
+    elif args.command == "reindex":
+        reindex(args)
+    elif args.command == "status":
+        selected = [jobs.get(args.job_id)] if args.job_id else jobs.list_jobs()
+        for job in selected:
+            if job:
+                print(f"{job['id']} {job['status']} tentativi={job['attempts']} {job['payload']} {job['error'] or ''}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Worker e fila di ingestione dei PDF")
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    run_parser = commands.add_parser("run", help="esegue i job in coda")
+    run_parser.add_argument("--once", action="store_true", help="termina quando la coda è vuota")
+
+    enqueue_parser = commands.add_parser("enqueue", help="mette in coda l'ingestione di uno o più blob")
+    enqueue_parser.add_argument("blob_names", nargs="+")
+
+    bulk_parser = commands.add_parser("bulk", help="ingerisce tutti i PDF del container o di una cartella")
+    bulk_parser.add_argument("--dir", help="cartella locale da ingerire al posto del container")
+    bulk_parser.add_argument("--prefix", help="solo i blob che iniziano con questo prefisso")
+    bulk_parser.add_argument("--concurrency", type=int, help="documenti elaborati in parallelo")
+
+    reindex_parser = commands.add_parser(
+        "reindex", help="ricrea l'indice con la configurazione dei vettori attuale e reingerisce i PDF"
+    )
+    reindex_parser.add_argument("--dir", help="cartella locale da ingerire al posto del container")
+    reindex_parser.add_argument("--prefix", help="solo i blob che iniziano con questo prefisso")
+    reindex_parser.add_argument("--concurrency", type=int, help="documenti elaborati in parallelo")
+
+    status_parser = commands.add_parser("status", help="mostra lo stato dei job")
+    status_parser.add_argument("job_id", nargs="?")
+
+    args = parser.parse_args()
+    if args.command in ("run", "bulk", "reindex"):
+        start_metrics()
+    try:
+        run_command(args)
+    finally:
+        # fecha os clientes, o pool de conexões e o pool de extração que o comando tenha aberto
+        from src import clients
+        if "src.smart_doc" in sys.modules:
+            sys.modules["src.smart_doc"].shutdown_extract_pool()
+        clients.close_all()
+
+
+if __name__ == "__main__":
+    main()